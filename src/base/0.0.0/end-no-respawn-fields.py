@@ -2,8 +2,6 @@
 import logging
 import os
 
-from psycopg2.extras import execute_values
-
 from odoo.addons.base.maintenance.migrations import util
 
 _logger = logging.getLogger("odoo.addons.base.maintenance.migrations.base.000.no_respawn")
@@ -19,15 +17,16 @@ def migrate(cr, version):
         )
     """
     )
-    execute_values(
-        cr._obj,
-        "INSERT INTO no_respawn(model, field) VALUES %s",
-        [
+    util.copy_rows(
+        cr,
+        "no_respawn",
+        ["model", "field"],
+        (
             (model, field)
             for model, fields in util.ENVIRON["__renamed_fields"].items()
             for field, new_name in fields.items()
             if new_name is None  # means removed :p
-        ],
+        ),
     )
     cr.execute(
         """
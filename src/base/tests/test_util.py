@@ -1,6 +1,7 @@
 import ast
 import json
 import operator
+import os
 import re
 import sys
 import threading
@@ -675,6 +676,57 @@ class TestIterBrowse(UnitTestCase):
         expected = (len(ids) + chunk_size - 1) // chunk_size
         self.assertEqual(read.call_count, expected)
 
+    @unittest.skipUnless(util.version_gte("13.0"), "Prefetching is only supported from Odoo 13")
+    def test_iter_browse_prefetch(self):
+        cr = self.env.cr
+        cr.execute("SELECT id, code FROM res_country ORDER BY id")
+        ids, expected = map(list, zip(*cr.fetchall()))
+
+        Country = self.env["res.country"]
+        with self.assertRaises(ValueError):
+            util.iter_browse(Country, ids, strategy="commit", prefetch=["country_group_ids"])
+        with self.assertRaises(ValueError):
+            util.iter_browse(Country, ids, prefetch=["code"])
+
+        def codes(ids, modify=(None, None)):
+            util.invalidate(Country)
+            func = "fetch" if util.version_gte("saas~16.2") else "_read"
+            result = []
+            with mock.patch.object(cr, "commit", lambda: None), mock.patch.object(
+                type(Country), func, autospec=True, side_effect=getattr(type(Country), func)
+            ) as read:
+                ib = util.iter_browse(Country, ids, logger=None, chunk_size=10, strategy="commit", prefetch=["code"])
+                for country in ib:
+                    if country.id == modify[0]:
+                        # a row of the next chunk, already prefetched
+                        cr.execute("UPDATE res_country SET code = lower(code) WHERE id = %s", [modify[1]])
+                    result.append(country.code)
+            return result, read.call_count
+
+        # only the first chunk is read by the ORM, the next ones are prefetched
+        self.assertEqual(codes(ids), (expected, 1))
+
+        # the rows modified since they were prefetched are read again
+        expected[10] = expected[10].lower()
+        self.assertEqual(codes(ids, modify=(ids[9], ids[10])), (expected, 2))
+
+    def test_iter_browse_adaptive_chunks(self):
+        mib = 1024 * 1024
+        adaptive = util.orm._AdaptiveChunks(100, "test", logger=None, time_budget=10, memory_limit=1024)
+        adaptive.logger = mock.Mock()
+        adaptive.adapt(100, 2.0, 500 * mib, 500 * mib)  # fast chunk
+        adaptive.adapt(200, 9.0, 500 * mib, 500 * mib)  # close enough to the budget
+        adaptive.adapt(200, 5.0, 900 * mib, 1000 * mib)  # not enough memory left for 200 more records
+        adaptive.adapt(100, 5.0, 1000 * mib, 1100 * mib)  # above the limit
+        self.assertEqual(adaptive.sizes, [100, 200, 100, 50])
+        self.assertEqual(adaptive.logger.info.call_count, 3)
+
+        cr = self.env.cr
+        cr.execute("SELECT id FROM res_country")
+        ids = [c for (c,) in cr.fetchall()]
+        ib = util.iter_browse(self.env["res.country"], ids, logger=None, chunk_size="auto")
+        self.assertEqual([c.id for c in ib], ids)
+
     def test_iter_browse_iter_chunks(self):
         cr = self.env.cr
         cr.execute("SELECT id FROM res_country")
@@ -803,6 +855,117 @@ class TestIterBrowse(UnitTestCase):
             ib.write({"name": "FAIL"})
 
 
+class TestRecomputeFields(UnitTestCase):
+    def test_recompute_fields_parallel(self):
+        cr = self.env.cr
+        company = self.env["res.partner"].create({"name": "Company", "is_company": True})
+        contact = self.env["res.partner"].create({"name": "Contact", "parent_id": company.id})
+        cr.execute("UPDATE res_partner SET commercial_partner_id = id WHERE id = %s", [contact.id])
+        util.invalidate(contact)
+
+        with self.assertRaises(ValueError):
+            util.recompute_fields(cr, "res.partner", ["commercial_partner_id"], strategy="fork")
+
+        # tests cannot commit: the chunks are recomputed and flushed by the test cursor
+        with mock.patch.object(util.orm, "_recompute_fields_parallel") as parallel:
+            util.recompute_fields(cr, "res.partner", ["commercial_partner_id"], ids=[contact.id], strategy="parallel")
+        parallel.assert_not_called()
+
+        cr.execute("SELECT commercial_partner_id FROM res_partner WHERE id = %s", [contact.id])
+        self.assertEqual(cr.fetchone()[0], company.id)
+
+    @unittest.skipUnless(util.version_gte("15.0"), "Only works on Odoo >= 15 (python >= 3.7)")
+    def test_recompute_fields_parallel_workers(self):
+        # the workers commit, and only see committed data: use a new transaction
+        with self.registry.cursor() as cr, without_testing():
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            company = env["res.partner"].create({"name": "Company", "is_company": True})
+            contacts = env["res.partner"].create(
+                [{"name": "Contact {}".format(i), "parent_id": company.id} for i in range(4)]
+            )
+            self.addCleanup(self._unlink_committed, company | contacts)
+
+            def break_and_recompute(chunks):
+                cr.execute("UPDATE res_partner SET commercial_partner_id = id WHERE id IN %s", [tuple(contacts.ids)])
+                util.invalidate(contacts)
+                util.orm._recompute_fields_parallel(cr, "res.partner", ["commercial_partner_id"], chunks)
+                cr.execute(
+                    "SELECT DISTINCT commercial_partner_id FROM res_partner WHERE id IN %s", [tuple(contacts.ids)]
+                )
+                return [r for (r,) in cr.fetchall()]
+
+            self.assertEqual(break_and_recompute([contacts.ids[:2], contacts.ids[2:]]), [company.id])
+
+            # chunks always conflicting are split, retried, then recomputed serially
+            always_failing = lambda executor, recompute_chunk, chunks, max_pending: list(chunks)
+            with mock.patch.object(util.orm, "_submit_chunks", side_effect=always_failing) as submit, mock.patch.object(
+                util.orm.time, "sleep"
+            ):
+                self.assertEqual(break_and_recompute([contacts.ids]), [company.id])
+            self.assertEqual(submit.call_count, util.pg.CONCURRENCY_RETRIES + 1)
+            self.assertEqual(len(submit.call_args[0][2]), min(4, 2**util.pg.CONCURRENCY_RETRIES))
+
+    def _unlink_committed(self, records):
+        with self.registry.cursor() as cr:
+            records.with_env(api.Environment(cr, SUPERUSER_ID, {})).unlink()
+
+    @unittest.skipUnless(util.version_gte("13.0"), "Impacted records are only gathered from Odoo 13")
+    def test_recompute_fields_batch(self):
+        cr = self.env.cr
+        company = self.env["res.partner"].create({"name": "Company", "is_company": True})
+        contact = self.env["res.partner"].create({"name": "Contact", "parent_id": company.id})
+        cr.execute(
+            "UPDATE res_partner SET commercial_partner_id = id, commercial_company_name = NULL WHERE id = %s",
+            [contact.id],
+        )
+        util.invalidate(contact)
+
+        fields = [("res.partner", ("commercial_company_name",)), ("res.partner", ("commercial_partner_id",))]
+        self.assertEqual(util.orm._fields_recompute_order(self.env, fields), fields[::-1])
+
+        Partner = type(self.env["res.partner"])
+        compute = "_compute_commercial_company_name"
+        with mock.patch.object(Partner, compute, autospec=True, side_effect=getattr(Partner, compute)) as method:
+            util.recompute_fields_batch(
+                cr,
+                [("res.partner", ["commercial_company_name"]), ("res.partner", ["commercial_partner_id"])],
+                ids={"res.partner": [contact.id]},
+            )
+        self.assertEqual(method.call_count, 1)
+
+        cr.execute("SELECT commercial_partner_id, commercial_company_name FROM res_partner WHERE id = %s", [contact.id])
+        self.assertEqual(cr.fetchone(), (company.id, "Company"))
+
+    def test_recompute_fields_related_sql(self):
+        cr = self.env.cr
+        Bank = self.env["res.partner.bank"]
+        if Bank._fields["company_id"].related is None or not Bank._fields["company_id"].store:
+            self.skipTest("`res.partner.bank.company_id` is not a stored related field")
+        company = self.env.ref("base.main_company")
+        partner = self.env["res.partner"].create({"name": "Holder", "company_id": company.id})
+        account = Bank.create({"acc_number": "BE71096123456769", "partner_id": partner.id})
+        cr.execute("UPDATE res_partner_bank SET company_id = NULL WHERE id = %s", [account.id])
+        util.invalidate(account)
+
+        self.assertEqual(
+            util.orm._related_sql_path(cr, Bank, "company_id"),
+            [("res_partner_bank", "partner_id"), ("res_partner", "company_id")],
+        )
+        # the SQL path commits, it is not used with the `flush` strategy
+        with mock.patch.object(util.orm, "_recompute_related_sql") as sql_path:
+            util.recompute_fields(cr, "res.partner.bank", ["company_id"], strategy="flush")
+        sql_path.assert_not_called()
+        cr.execute("UPDATE res_partner_bank SET company_id = NULL WHERE id = %s", [account.id])
+        util.invalidate(account)
+
+        with mock.patch.object(util.orm, "_recompute_records", side_effect=util.orm._recompute_records) as orm_path:
+            util.recompute_fields(cr, "res.partner.bank", ["company_id"], strategy="parallel")
+        orm_path.assert_not_called()
+
+        cr.execute("SELECT company_id FROM res_partner_bank WHERE id = %s", [account.id])
+        self.assertEqual(cr.fetchone()[0], company.id)
+
+
 class TestPG(UnitTestCase):
     @parametrize(
         [
@@ -1008,6 +1171,35 @@ class TestPG(UnitTestCase):
         qs = util.explode_query_range(cr, "SELECT 1", table="res_partner_category", bucket_size=count - 1)
         self.assertEqual(len(qs), 1)  # 10% rule for second bucket, 1 <= 0.1(count - 1) since count >= 11
 
+    @parametrize([("stats",), ("sample",)])
+    def test_explode_query_range_planner(self, planner):
+        cr = self.env.cr
+        cr.execute(
+            """
+            CREATE TABLE _upgrade_explode_planner_test(id integer PRIMARY KEY);
+            -- two clusters of ids separated by a huge gap
+            INSERT INTO _upgrade_explode_planner_test
+                 SELECT generate_series(1, 1000)
+              UNION ALL
+                 SELECT generate_series(10000001, 10001000);
+            ANALYZE _upgrade_explode_planner_test;
+            """
+        )
+        qs = util.explode_query_range(
+            cr,
+            "SELECT count(*) FROM _upgrade_explode_planner_test",
+            table="_upgrade_explode_planner_test",
+            bucket_size=100,
+            planner=planner,
+        )
+        # the range planner would produce 100k buckets
+        self.assertLessEqual(len(qs), 40)
+        total = 0
+        for q in qs:
+            cr.execute(q)
+            total += cr.fetchone()[0]
+        self.assertEqual(total, 2000)
+
     def test_parallel_rowcount(self):
         cr = self._get_cr()
         cr.execute("SELECT count(*) FROM res_lang")
@@ -1024,6 +1216,320 @@ class TestPG(UnitTestCase):
         with without_testing():
             self.test_parallel_rowcount()
 
+    def test_explode_execute_dynamic(self):
+        cr = self._get_cr()
+        cr.execute("SELECT count(*) FROM res_lang")
+        [expected] = cr.fetchone()
+
+        with without_testing(), mock.patch.object(cr, "commit", lambda: ...):
+            query = "UPDATE res_lang SET name = name"
+            rowcount = util.explode_execute(cr, query, table="res_lang", bucket_size=2, dynamic=True)
+        self.assertEqual(rowcount, expected)
+
+    def test_explode_execute_checkpoint(self):
+        cr = self.env.cr
+        cr.execute(
+            """
+            CREATE TABLE _upgrade_explode_checkpoint_test(id integer PRIMARY KEY, done boolean);
+            INSERT INTO _upgrade_explode_checkpoint_test SELECT generate_series(1, 100), false;
+            """
+        )
+        query = "UPDATE _upgrade_explode_checkpoint_test SET done = true"
+        # simulate a previous run interrupted after processing some buckets
+        fingerprint, done = util.pg._explode_checkpoints(cr, "_upgrade_explode_checkpoint_test", query)
+        self.assertEqual(done, [])
+        cr.execute(
+            "INSERT INTO _upgrade_explode_checkpoints VALUES (%s, 11, 30), (%s, 71, 75)", [fingerprint, fingerprint]
+        )
+
+        rowcount = util.explode_execute(
+            cr, query, table="_upgrade_explode_checkpoint_test", bucket_size=10, checkpoint=True
+        )
+        self.assertEqual(rowcount, 75)
+        cr.execute("SELECT array_agg(id ORDER BY id) FROM _upgrade_explode_checkpoint_test WHERE NOT done")
+        self.assertEqual(cr.fetchone()[0], list(range(11, 31)) + list(range(71, 76)))
+        # checkpoints are removed once done
+        cr.execute("SELECT 1 FROM _upgrade_explode_checkpoints WHERE fingerprint = %s", [fingerprint])
+        self.assertFalse(cr.rowcount)
+
+    def test_explode_query_range_ctid(self):
+        cr = self.env.cr
+        cr.execute(
+            """
+            CREATE TABLE _upgrade_explode_ctid_test(a integer, b integer);
+            INSERT INTO _upgrade_explode_ctid_test SELECT generate_series(1, 2000);
+            ANALYZE _upgrade_explode_ctid_test;
+            """
+        )
+        query = "UPDATE _upgrade_explode_ctid_test t SET b = t.a WHERE t.b IS NULL"
+        queries = util.explode_query_range(cr, query, table="_upgrade_explode_ctid_test", alias="t", bucket_size=200)
+        # executed serially in tests, no split
+        self.assertEqual(len(queries), 1)
+        self.assertIn("t.ctid IS NOT NULL", queries[0])
+
+        with self.assertRaises(ValueError):
+            util.explode_execute(cr, query, table="_upgrade_explode_ctid_test", alias="t", checkpoint=True)
+
+    def test_explode_execute_ctid(self):
+        # splitting commits the cursor: use a new transaction
+        cr = self._get_cr()
+        cr.execute("CREATE TABLE _upgrade_explode_ctid_test(a integer, b integer)")
+        cr.commit()
+        self.addCleanup(cr.commit)
+        self.addCleanup(cr.execute, "DROP TABLE IF EXISTS _upgrade_explode_ctid_test")
+
+        cr.execute("INSERT INTO _upgrade_explode_ctid_test SELECT generate_series(1, 2000)")
+        # rows written in a subtransaction have a xid above the one of the transaction
+        with util.savepoint(cr):
+            cr.execute("INSERT INTO _upgrade_explode_ctid_test SELECT generate_series(2001, 2500)")
+
+        query = "UPDATE _upgrade_explode_ctid_test t SET b = t.a WHERE t.b IS NULL"
+        with without_testing():
+            queries = util.explode_query_range(
+                cr, query, table="_upgrade_explode_ctid_test", alias="t", bucket_size=200
+            )
+            if cr._cnx.server_version >= 140000:
+                self.assertGreater(len(queries), 1)
+            self.assertEqual(util.parallel_execute(cr, queries), 2500)
+        cr.execute("SELECT count(*) FROM _upgrade_explode_ctid_test WHERE b IS DISTINCT FROM a")
+        self.assertEqual(cr.fetchone()[0], 0)
+
+    def test_explode_execute_m2m(self):
+        cr = self.env.cr
+        cr.execute(
+            """
+            CREATE TABLE _upgrade_explode_m2m_test(a integer, b integer);
+            INSERT INTO _upgrade_explode_m2m_test SELECT generate_series(1, 2000);
+            ANALYZE _upgrade_explode_m2m_test;
+            """
+        )
+        query = "UPDATE _upgrade_explode_m2m_test t SET b = t.a WHERE t.b IS NULL"
+        # small tables are updated in the current transaction
+        with mock.patch.object(cr, "commit", side_effect=AssertionError("unexpected commit")), mock.patch(
+            "odoo.upgrade.util.pg.explode_execute"
+        ) as explode:
+            self.assertEqual(util.pg._explode_execute_m2m(cr, query, "_upgrade_explode_m2m_test", "t"), 2000)
+        explode.assert_not_called()
+
+        with mock.patch.object(util.pg, "EXPLODE_M2M_THRESHOLD", 1000), mock.patch(
+            "odoo.upgrade.util.pg.explode_execute", return_value=0
+        ) as explode:
+            util.pg._explode_execute_m2m(cr, query, "_upgrade_explode_m2m_test", "t")
+        explode.assert_called_once_with(cr, query, table="_upgrade_explode_m2m_test", alias="t")
+
+    def test_explode_query_range_partitions(self):
+        cr = self.env.cr
+        cr.execute(
+            """
+            CREATE TABLE _upgrade_explode_p(id integer, v integer);
+            CREATE TABLE _upgrade_explode_p_c1(CHECK (id BETWEEN 101 AND 200)) INHERITS (_upgrade_explode_p);
+            CREATE TABLE _upgrade_explode_p_c2(CHECK (id > 1000)) INHERITS (_upgrade_explode_p);
+            INSERT INTO _upgrade_explode_p SELECT generate_series(1, 100);
+            INSERT INTO _upgrade_explode_p_c1 SELECT generate_series(101, 200);
+            INSERT INTO _upgrade_explode_p_c2 SELECT generate_series(1001, 1100);
+            """
+        )
+        query = "UPDATE _upgrade_explode_p t SET v = t.id WHERE t.id > 1000"
+        partitions = util.pg._explode_partitions(cr, query, "_upgrade_explode_p")
+        # the first child is excluded by its check constraint
+        self.assertEqual([name for _, name in partitions], ["_upgrade_explode_p", "_upgrade_explode_p_c2"])
+        self.assertIsNone(util.pg._explode_partitions(cr, query, "_upgrade_explode_p_c2"))
+        # literal `%` are escaped in the exploded queries
+        escaped = "UPDATE _upgrade_explode_p t SET v = t.id %% 1000 WHERE t.id > 1000"
+        self.assertEqual(util.pg._explode_partitions(cr, escaped, "_upgrade_explode_p"), partitions)
+
+        queries = util.explode_query_range(cr, query, table="_upgrade_explode_p", alias="t", bucket_size=10)
+        self.assertEqual(len(queries), 20)
+        # buckets of the partitions are interleaved
+        oids = [oid for oid, _ in partitions]
+        self.assertIn("t.tableoid = {} AND".format(oids[0]), queries[0])
+        self.assertIn("t.tableoid = {} AND".format(oids[1]), queries[1])
+
+        rowcount = util.explode_execute(cr, query, table="_upgrade_explode_p", alias="t", bucket_size=10)
+        self.assertEqual(rowcount, 100)
+        cr.execute("SELECT count(*) FROM _upgrade_explode_p WHERE v = id")
+        self.assertEqual(cr.fetchone()[0], 100)
+
+    def test_explode_prepared_statements(self):
+        cr = self.env.cr
+        cr.execute("SELECT count(*) FROM res_lang")
+        [expected] = cr.fetchone()
+
+        queries = util.explode_query_range(cr, "SELECT 1 FROM res_lang l", table="res_lang", alias="l", bucket_size=1)
+        queries = util.pg._prepare_bucket_queries(cr, queries)
+        name, body = queries[0].statement
+        self.assertIn("l.id BETWEEN $1 AND $2", body)
+        # the same statement is shared by all the buckets
+        self.assertEqual({q.statement for q in queries}, {(name, body)})
+
+        with util.pg._worker_cursors.cursor(cr.dbname) as tcr:
+            rowcount = sum(util.pg._execute_query(tcr, q) for q in queries)
+            self.assertIn(name, util.pg._worker_cursors._prepared[tcr])
+        self.assertEqual(rowcount, expected)
+
+        # the main cursor executes the literal queries
+        self.assertIsNone(util.pg._worker_cursors.statement(cr, queries[0]))
+
+    def test_adaptive_workers(self):
+        with mock.patch.dict(os.environ, {"MAX_WORKER": "auto"}):
+            workers = util.pg._probe_max_workers(self.env.cr)
+            self.assertGreaterEqual(workers, 1)
+            self.assertEqual(util.get_max_workers(), workers)
+
+            # never more workers than connections left in the pool of Odoo
+            with mock.patch.object(util.pg, "_free_pool_connections", return_value=2), mock.patch.object(
+                util.pg._worker_cursors, "_idle", {}
+            ):
+                self.assertLessEqual(util.pg._probe_max_workers(self.env.cr), 2)
+            util.pg._probe_max_workers(self.env.cr)  # restore the probed capacity
+
+            limiter = util.pg._concurrency_limiter(16)
+            limiter.limit = 4
+            # keep adding workers while the throughput improves
+            limiter.adapt(10)
+            limiter.adapt(20)
+            self.assertEqual(limiter.limit, 6)
+            # then back off
+            limiter.adapt(5)
+            self.assertEqual(limiter.limit, 5)
+            # worse again, turn back
+            limiter.adapt(4)
+            self.assertEqual(limiter.limit, 6)
+            for throughput in [100, 200, 400, 800, 1600, 3200]:
+                limiter.adapt(throughput)
+            self.assertEqual(limiter.limit, 16)
+
+        with mock.patch.dict(os.environ, {"MAX_WORKER": "4"}):
+            self.assertEqual(util.get_max_workers(), 4)
+            limiter = util.pg._concurrency_limiter(4)
+            self.assertFalse(limiter.adaptive)
+            self.assertEqual(limiter.limit, 4)
+
+    def test_range_scheduler(self):
+        scheduler = util.pg._RangeScheduler([(1, 1000), (5001, 5500)], 100, 4, time_budget=1)
+        ranges = []
+        while True:
+            bounds = scheduler.next_range()
+            if bounds is None:
+                break
+            ranges.append(bounds)
+            # first ranges are fast, then slow ones
+            scheduler.done(bounds[0], bounds[1], 0 if len(ranges) < 3 else 5)
+
+        expected = list(range(1, 1001)) + list(range(5001, 5501))
+        self.assertEqual([i for lower, upper in sorted(ranges) for i in range(lower, upper + 1)], expected)
+        widths = [upper - lower + 1 for lower, upper in ranges]
+        self.assertGreater(max(widths), 100)
+        self.assertLess(widths[-1], 100)
+
+    def test_analyze_modified_tables(self):
+        cr = self.env.cr
+        with mock.patch.object(util.pg, "ANALYZE_THRESHOLD", 0), mock.patch.dict(util.pg._modified_rows, clear=True):
+            util.explode_execute(cr, "UPDATE res_users SET active = active", table="res_users")
+            self.assertTrue(util.pg._modified_rows[cr.dbname]["res_users"])
+            # counted per database
+            self.assertFalse(util.pg._modified_rows[cr.dbname + "_other"])
+            self.assertEqual(util.analyze_modified_tables(cr), ["res_users"])
+            self.assertFalse(util.pg._modified_rows[cr.dbname]["res_users"])
+            self.assertEqual(util.analyze_modified_tables(cr), [])
+
+    def test_query_telemetry(self):
+        cr = self.env.cr
+        cr.execute("SELECT count(*) FROM res_users")
+        [count] = cr.fetchone()
+        with util.query_telemetry() as telemetry:
+            util.explode_execute(
+                cr, "UPDATE res_users SET active = active", table="res_users", bucket_size=1, qualifier="users"
+            )
+        self.assertTrue(telemetry.records)
+        self.assertEqual({r["status"] for r in telemetry.records}, {"ok"})
+        summary = telemetry.summary()["users"]
+        self.assertEqual(summary["queries"], len(telemetry.records))
+        self.assertEqual(summary["rows"], count)
+        self.assertLessEqual(summary["p50"], summary["p95"])
+        self.assertLessEqual(summary["p95"], summary["max"])
+        self.assertEqual(json.loads(telemetry.dumps())["summary"]["users"]["queries"], summary["queries"])
+
+    def test_split_bucket_query(self):
+        cr = self.env.cr
+        query = util.pg._BucketQuery(cr, "SELECT %(lower-bound)s, %(upper-bound)s", 1, 10)
+        self.assertEqual(query, "SELECT 1, 10")
+        parts = util.pg._split_query(cr, query)
+        self.assertEqual(parts, ["SELECT 1, 5", "SELECT 6, 10"])
+        self.assertEqual([(p.lower, p.upper) for p in parts], [(1, 5), (6, 10)])
+        # single id buckets and plain queries cannot be split
+        self.assertEqual(util.pg._split_query(cr, parts[0].restrict(cr, 3, 3)), ["SELECT 3, 3"])
+        self.assertEqual(util.pg._split_query(cr, "SELECT 1"), ["SELECT 1"])
+
+    def test_worker_cursors(self):
+        pool = util.pg._WorkerCursorPool()
+        self.addCleanup(pool.close_all)
+        dbname = self.env.cr.dbname
+        with pool.cursor(dbname) as cr1:
+            cr1.execute("SELECT 1")
+        with pool.cursor(dbname) as cr2, pool.cursor(dbname) as cr3:
+            cr2.execute("SELECT 1")
+            cr3.execute("SELECT 1")
+        self.assertIs(cr1, cr2)
+        self.assertIsNot(cr2, cr3)
+        self.assertEqual(pool.stats["created"], 2)
+        self.assertEqual(pool.stats["reused"], 1)
+
+        with self.assertRaises(ZeroDivisionError), pool.cursor(dbname) as cr4:
+            cr4.execute("SELECT 1")
+            1 / 0  # noqa: B018
+        # rolled back and given back to the pool
+        self.assertIn(cr4, (cr2, cr3))
+        self.assertEqual(pool.stats["reused"], 2)
+
+        # in a forked process, the inherited cursors are dropped without being closed
+        inherited = [cr for idle in pool._idle.values() for cr in idle]
+
+        def close_inherited():
+            for cr in inherited:
+                cr._closed = False
+                cr.close()
+
+        self.addCleanup(close_inherited)
+        with mock.patch.object(pool, "_pid", -1):
+            pool._forget_inherited()
+        self.assertTrue(all(cr._closed and not cr._cnx.closed for cr in inherited))
+        self.assertFalse(pool._idle)
+        self.assertFalse(pool._configured)
+
+    def test_worker_settings(self):
+        pool = util.pg._WorkerCursorPool()
+        self.addCleanup(pool.close_all)
+        dbname = self.env.cr.dbname
+        pool.settings = util.pg._parse_settings("work_mem=12MB, jit=off")
+
+        def current(cr, name):
+            cr.execute("SELECT current_setting(%s)", [name])
+            return cr.fetchone()[0]
+
+        with pool.cursor(dbname) as wcr:
+            self.assertEqual(current(wcr, "work_mem"), "12MB")
+            self.assertEqual(current(wcr, "jit"), "off")
+        pool.overrides = {"work_mem": "24MB"}
+        with pool.cursor(dbname) as wcr:
+            self.assertEqual(current(wcr, "work_mem"), "24MB")
+        pool.overrides = {}
+        with pool.cursor(dbname) as wcr:
+            # overrides are local to the transaction
+            self.assertEqual(current(wcr, "work_mem"), "12MB")
+        self.assertEqual(pool.stats["created"], 1)
+
+        cr = self.env.cr
+        before = current(cr, "maintenance_work_mem")
+        with util.worker_settings(cr, maintenance_work_mem="77MB"):
+            self.assertEqual(current(cr, "maintenance_work_mem"), "77MB")
+            self.assertEqual(util.pg._worker_cursors.overrides, {"maintenance_work_mem": "77MB"})
+        self.assertEqual(current(cr, "maintenance_work_mem"), before)
+        self.assertEqual(util.pg._worker_cursors.overrides, {})
+
+        with self.assertRaises(MigrationError):
+            util.pg._parse_settings("work_mem")
+
     def test_parallel_execute_retry_on_serialization_failure(self):
         TEST_TABLE_NAME = "_upgrade_serialization_failure_test_table"
         N_ROWS = 10
@@ -1067,7 +1573,8 @@ class TestPG(UnitTestCase):
         cr.execute(util.format_query(cr, "SELECT 1 FROM {}", TEST_TABLE_NAME))
         self.assertFalse(cr.rowcount)
 
-    def test_update_one_col_from_dict(self):
+    @parametrize([(False,), (True,)])
+    def test_update_one_col_from_dict(self, stage):
         TEST_TABLE_NAME = "_upgrade_bulk_update_one_col_test_table"
         N_ROWS = 10
 
@@ -1092,7 +1599,7 @@ class TestPG(UnitTestCase):
             [N_ROWS],
         )
         mapping = {id: id * 2 for id in range(1, N_ROWS + 1, 2)}
-        util.bulk_update_table(cr, TEST_TABLE_NAME, "col1", mapping)
+        util.bulk_update_table(cr, TEST_TABLE_NAME, "col1", mapping, stage=stage)
 
         cr.execute(
             util.format_query(
@@ -1121,7 +1628,8 @@ class TestPG(UnitTestCase):
         )
         self.assertFalse(cr.rowcount, "partial/incorrect updates are performed")
 
-    def test_update_multiple_cols_from_dict(self):
+    @parametrize([(False,), (True,)])
+    def test_update_multiple_cols_from_dict(self, stage):
         TEST_TABLE_NAME = "_upgrade_bulk_update_multiple_cols_test_table"
         N_ROWS = 10
 
@@ -1147,7 +1655,7 @@ class TestPG(UnitTestCase):
             [N_ROWS],
         )
         mapping = {id: [id * 2, id * 3] for id in range(1, N_ROWS + 1, 2)}
-        util.bulk_update_table(cr, TEST_TABLE_NAME, ["col1", "col2"], mapping)
+        util.bulk_update_table(cr, TEST_TABLE_NAME, ["col1", "col2"], mapping, stage=stage)
 
         cr.execute(
             util.format_query(
@@ -1176,6 +1684,84 @@ class TestPG(UnitTestCase):
         )
         self.assertFalse(cr.rowcount, "partial/incorrect updates are performed")
 
+    def test_copy_rows(self):
+        cr = self.env.cr
+        cr.execute("CREATE TEMPORARY TABLE _upgrade_test_copy_rows(id int, name varchar, flag bool)")
+        rows = [(1, "plain", True), (2, "tab\tnew\nline\\", False), (3, None, None)]
+        util.copy_rows(cr, "_upgrade_test_copy_rows", ["id", "name", "flag"], iter(rows))
+        cr.execute("SELECT id, name, flag FROM _upgrade_test_copy_rows ORDER BY id")
+        self.assertEqual(cr.fetchall(), rows)
+
+    def test_deferred_indexes(self):
+        cr = self.env.cr
+        cr.execute(
+            """
+            CREATE TABLE _upgrade_test_deferred(
+                id serial PRIMARY KEY,
+                code varchar UNIQUE,
+                name varchar,
+                partner_id integer REFERENCES res_partner(id)
+            );
+            CREATE INDEX _upgrade_test_deferred_name_idx ON _upgrade_test_deferred(name);
+            """
+        )
+
+        def indexes():
+            cr.execute("SELECT indexname FROM pg_indexes WHERE tablename = '_upgrade_test_deferred'")
+            return {name for (name,) in cr.fetchall()}
+
+        before = indexes()
+        with util.deferred_indexes(cr, "_upgrade_test_deferred", foreign_keys=True):
+            self.assertEqual(before - indexes(), {"_upgrade_test_deferred_name_idx"})
+            self.assertIsNone(util.target_of(cr, "_upgrade_test_deferred", "partner_id"))
+        self.assertEqual(indexes(), before)
+        self.assertEqual(util.target_of(cr, "_upgrade_test_deferred", "partner_id")[:2], ("res_partner", "id"))
+
+        # on errors, the indexes are recreated when possible
+        with self.assertRaises(ZeroDivisionError), util.deferred_indexes(cr, "_upgrade_test_deferred"):
+            1 / 0  # noqa: B018
+        self.assertEqual(indexes(), before)
+
+        # otherwise they are saved, and restored by the next call
+        with self.assertRaises(ZeroDivisionError), mock.patch.object(
+            util.pg, "_transaction_failed", return_value=True
+        ), util.deferred_indexes(cr, "_upgrade_test_deferred", foreign_keys=True):
+            1 / 0  # noqa: B018
+        self.assertEqual(before - indexes(), {"_upgrade_test_deferred_name_idx"})
+        self.assertIsNone(util.target_of(cr, "_upgrade_test_deferred", "partner_id"))
+        with util.deferred_indexes(cr, "_upgrade_test_deferred"):
+            self.assertEqual(before - indexes(), {"_upgrade_test_deferred_name_idx"})
+            self.assertIsNotNone(util.target_of(cr, "_upgrade_test_deferred", "partner_id"))
+        self.assertEqual(indexes(), before)
+        cr.execute("SELECT count(*) FROM _upgrade_deferred_indexes WHERE table_name = '_upgrade_test_deferred'")
+        self.assertEqual(cr.fetchone()[0], 0)
+
+    def test_create_indexes(self):
+        cr = self.env.cr
+        cr.execute("CREATE TABLE _upgrade_test_indexes(a integer, b integer, c varchar)")
+        cr.execute("SHOW maintenance_work_mem")
+        [work_mem] = cr.fetchone()
+
+        definitions = [
+            "CREATE INDEX _upgrade_test_indexes_b_idx ON _upgrade_test_indexes(b)",
+            'ALTER TABLE "_upgrade_test_indexes" ADD PRIMARY KEY (a)',
+            "CREATE UNIQUE INDEX _upgrade_test_indexes_c_idx ON public._upgrade_test_indexes(c, b)",
+            "ALTER TABLE _upgrade_test_indexes ADD CONSTRAINT _upgrade_test_indexes_b_check CHECK (b > 0)",
+        ]
+        timings = util.create_indexes(cr, definitions, maintenance_work_mem="32MB")
+        # the table has constraints: its statements are executed in the given order
+        self.assertEqual([d for d, _ in timings], definitions)
+        self.assertTrue(util.get_index_on(cr, "_upgrade_test_indexes", "a").ispk)
+        self.assertTrue(util.get_index_on(cr, "_upgrade_test_indexes", "c", "b").isunique)
+        self.assertIsNotNone(util.get_index_on(cr, "_upgrade_test_indexes", "b"))
+        cr.execute("SHOW maintenance_work_mem")
+        self.assertEqual(cr.fetchone()[0], work_mem)
+
+        with self.assertRaises(ValueError):
+            util.create_indexes(cr, ["CREATE INDEX CONCURRENTLY ON _upgrade_test_indexes(c)"])
+        with self.assertRaises(ValueError):
+            util.create_indexes(cr, ["DROP INDEX _upgrade_test_indexes_b_idx"])
+
     def test_create_column_with_fk(self):
         cr = self.env.cr
         self.assertFalse(util.column_exists(cr, "res_partner", "_test_lang_id"))
@@ -1217,6 +1803,105 @@ class TestPG(UnitTestCase):
         target = util.target_of(cr, "res_partner", "_test_lang_id")
         self.assertEqual(target, ("res_lang", "id", "res_partner__test_lang_id_fkey"))
 
+    def test_schema_cache(self):
+        cr = self.env.cr
+        uncached = (
+            util.column_type(cr, "res_country", "code", sized=True),
+            util.table_exists(cr, "res_country"),
+            util.table_exists(cr, "ir_model_fields_does_not_exists"),
+            util.target_of(cr, "res_partner", "country_id"),
+            sorted(util.get_fk(cr, "res_country")),
+            sorted(util.get_fk(cr, "res_country", quote_ident=False)),
+        )
+        with util.schema_cache(cr) as cache:
+            cached = (
+                util.column_type(cr, "res_country", "code", sized=True),
+                util.table_exists(cr, "res_country"),
+                util.table_exists(cr, "ir_model_fields_does_not_exists"),
+                util.target_of(cr, "res_partner", "country_id"),
+                sorted(util.get_fk(cr, "res_country")),
+                sorted(util.get_fk(cr, "res_country", quote_ident=False)),
+            )
+            self.assertEqual(cached, uncached)
+            self.assertTrue(util.column_exists(cr, "res_partner", "ctid"))
+
+            with util.schema_cache(cr) as nested:
+                self.assertIs(nested, cache)
+                self.assertFalse(util.column_exists(cr, "res_partner", "_test_lang_id"))
+
+            # the DDL helpers invalidate the cache
+            util.create_column(cr, "res_partner", "_test_lang_id", "int4", fk_table="res_lang")
+            self.assertTrue(util.column_exists(cr, "res_partner", "_test_lang_id"))
+            target = util.target_of(cr, "res_partner", "_test_lang_id")
+            self.assertEqual(target, ("res_lang", "id", "res_partner__test_lang_id_fkey"))
+            util.remove_column(cr, "res_partner", "_test_lang_id")
+            self.assertFalse(util.column_exists(cr, "res_partner", "_test_lang_id"))
+
+            # raw DDL needs an explicit invalidation
+            cr.execute("ALTER TABLE res_partner ADD COLUMN _test_raw int4")
+            self.assertFalse(util.column_exists(cr, "res_partner", "_test_raw"))
+            cache.invalidate("res_partner")
+            self.assertTrue(util.column_exists(cr, "res_partner", "_test_raw"))
+
+        self.assertGreater(cache.stats["hits"], cache.stats["misses"])
+        self.assertGreaterEqual(cache.stats["invalidations"], 3)
+
+    def test_schema_cached(self):
+        cr = self.env.cr
+
+        @util.pg._schema_cached
+        def lookup(cr):
+            results = [util.column_exists(cr, "res_country", "code") for _ in range(3)]
+            results.append(util.target_of(cr, "res_partner", "country_id"))
+            return results, util.pg._schema_caches[cr]
+
+        results, cache = lookup(cr)
+        self.assertEqual(results, [True] * 3 + [util.target_of(cr, "res_partner", "country_id")])
+        # only the queried relation is loaded, the foreign keys are not cached
+        self.assertFalse(cache.bulk)
+        self.assertEqual(list(cache._relations), ["res_country"])
+        self.assertEqual((cache.stats["loads"], cache.stats["hits"]), (1, 2))
+
+    def test_dependency_graph(self):
+        cr = self.env.cr
+        cr.execute(
+            """
+            CREATE TABLE _upgrade_graph_rel(
+                partner_id integer REFERENCES res_partner(id),
+                user_id integer REFERENCES res_users(id),
+                UNIQUE (partner_id, user_id)
+            );
+            CREATE VIEW _upgrade_graph_view AS SELECT id, name FROM res_partner;
+            """
+        )
+
+        def describe():
+            return (
+                sorted(util.get_fk(cr, "res_partner")),
+                util.target_of(cr, "_upgrade_graph_rel", "user_id"),
+                sorted(util.get_m2m_on(cr, "res_partner")),
+                sorted(util.pg._get_unique_indexes_with(cr, "_upgrade_graph_rel", "user_id")),
+                sorted(util.get_depending_views(cr, "res_partner", "name")),
+            )
+
+        uncached = describe()
+        self.assertIn(("_upgrade_graph_rel", "partner_id", "user_id", "res_users"), uncached[2])
+        self.assertEqual(uncached[4], [("_upgrade_graph_view", "v")])
+
+        with util.schema_cache(cr) as cache:
+            self.assertEqual(describe(), uncached)
+            loads = cache.stats["loads"]
+            self.assertEqual(describe(), uncached)
+            self.assertEqual(cache.stats["loads"], loads)
+
+            graph = util.dependency_graph(cr)
+            self.assertIs(util.dependency_graph(cr), graph)
+            self.assertIn("_upgrade_graph_rel", {fk[0] for fk in graph.referencing("res_users")})
+            self.assertEqual({fk[3] for fk in graph.referenced("_upgrade_graph_rel")}, {"res_partner", "res_users"})
+
+            util.drop_depending_views(cr, "res_partner", "name")
+            self.assertEqual(util.get_depending_views(cr, "res_partner", "name"), [])
+
     def test_ColumnList(self):
         cr = self.env.cr
 
@@ -1587,6 +2272,27 @@ class TestNamedCursors(UnitTestCase):
             result = list(self.exec(ncr, "__iter__"))
         self.assertEqual(result, expected)
 
+    def test_itercolumns(self):
+        query = "SELECT id, name, CASE WHEN id % 2 = 0 THEN priority END AS even FROM ir_ui_view ORDER BY id"
+        self.env.cr.execute(query)
+        expected = self.env.cr.fetchall()
+        with util.named_cursor(self.env.cr) as ncr:
+            ncr.execute(query)
+            batches = list(ncr.itercolumns(size=7))
+        self.assertTrue(all(len(b["id"]) <= 7 for b in batches))
+        self.assertEqual(list(batches[0]), ["id", "name", "even"])
+        rows = [row for b in batches for row in zip(b["id"], b["name"], b["even"])]
+        self.assertEqual(rows, expected)
+
+        with util.named_cursor(self.env.cr) as ncr:
+            ncr.execute(query)
+            batch = ncr.fetchcolumns(size=7, arrays=True)
+        # integer columns become arrays, unless they hold NULL values
+        self.assertNotIsInstance(batch["id"], tuple)
+        self.assertEqual(list(batch["id"]), [row[0] for row in expected[:7]])
+        self.assertIsInstance(batch["name"], tuple)
+        self.assertIsInstance(batch["even"], tuple)
+
 
 class TestQueryIds(UnitTestCase):
     def test_straight(self):
@@ -1608,6 +2314,40 @@ class TestQueryIds(UnitTestCase):
         ), util.query_ids(cr, "SELECT * FROM (VALUES (1), (1)) AS x(x)") as ids:
             list(ids)
 
+    def test_null(self):
+        with self.assertRaises(ValueError), util.query_ids(
+            self.env.cr, "SELECT * FROM (VALUES (1), (NULL)) AS x(x)"
+        ) as ids:
+            list(ids)
+
+    def test_streamed(self):
+        cr = self.env.cr
+        cr.execute("SELECT id FROM res_users ORDER BY id")
+        expected = [id_ for (id_,) in cr.fetchall()]
+        with util.query_ids(cr, "SELECT id FROM res_users ORDER BY id DESC") as ids:
+            self.assertIsNone(ids._tmp_tbl)
+            # only counted when requested
+            self.assertIsNone(ids._len)
+            self.assertEqual(len(ids), len(expected))
+            self.assertEqual(list(ids), expected)
+
+        # invalid ids are detected while iterating
+        with util.query_ids(cr, "SELECT * FROM (VALUES (2), (1), (2)) AS x(x)") as ids:
+            self.assertEqual(next(ids), 1)
+            with self.assertRaises(ValueError):
+                next(ids)
+        with self.assertRaises(TypeError), util.query_ids(cr, "SELECT 'a'") as ids:
+            list(ids)
+
+    def test_dml(self):
+        cr = self.env.cr
+        cr.execute("SELECT id FROM res_users ORDER BY id")
+        expected = [id_ for (id_,) in cr.fetchall()]
+        with util.query_ids(cr, "UPDATE res_users SET active = active RETURNING id") as ids:
+            self.assertIsNotNone(ids._tmp_tbl)
+            self.assertEqual(len(ids), len(expected))
+            self.assertEqual(list(ids), expected)
+
 
 class TestRecords(UnitTestCase):
     def test_rename_xmlid(self):
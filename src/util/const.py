@@ -23,3 +23,7 @@ NEARLYWARN = 25  # between info and warning; appear on runbot build page
 netsvc.LEVEL_COLOR_MAPPING[NEARLYWARN] = (netsvc.YELLOW, netsvc.DEFAULT)
 
 BIG_TABLE_THRESHOLD = int(os.getenv("ODOO_UPG_BIG_TABLE_THRESHOLD", "40000"))
+
+# targets of the adaptive chunk sizes, see `iter_browse` and `recompute_fields`
+CHUNK_TIME_BUDGET = float(os.getenv("ODOO_UPG_CHUNK_TIME_BUDGET", "10"))  # seconds
+CHUNK_MEMORY_LIMIT = int(os.getenv("ODOO_UPG_CHUNK_MEMORY_LIMIT", "2048"))  # MiB
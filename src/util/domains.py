@@ -35,7 +35,7 @@ from .const import NEARLYWARN
 from .helpers import _dashboard_actions, _validate_model, resolve_model_fields_path
 from .inherit import for_each_inherit
 from .misc import SelfPrintEvalContext, ast_unparse, literal_replace, safe_eval, version_gte
-from .pg import SQLStr, column_exists, format_query, get_value_or_en_translation, table_exists
+from .pg import SQLStr, _schema_cached, column_exists, format_query, get_value_or_en_translation, table_exists
 from .records import edit_view
 
 # python3 shims
@@ -121,6 +121,7 @@ class _Skip(Exception):
     pass
 
 
+@_schema_cached
 def _get_domain_fields(cr):
     # haaa, if only we had a `fields.Domain`, we would just have to get all the domains from `ir_model_fields`
     # Meanwile, we have to enumerate them explicitly
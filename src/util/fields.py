@@ -55,6 +55,8 @@ from .orm import env, invalidate
 from .pg import (
     PGRegexp,
     SQLStr,
+    _invalidate_schema_cache,
+    _schema_cached,
     alter_column_type,
     column_exists,
     column_type,
@@ -198,6 +200,7 @@ def _rm_field_adapter(leaf, is_or, negated):
     return [TRUE_LEAF]
 
 
+@_schema_cached
 def remove_field(
     cr,
     model,
@@ -349,6 +352,7 @@ def remove_field(
         )
         for (m2m_rel,) in cr.fetchall():
             cr.execute('DROP TABLE IF EXISTS "{}" CASCADE'.format(m2m_rel))
+            _invalidate_schema_cache(cr)
             cr.execute(
                 "DELETE FROM ir_model_relation r USING ir_model m WHERE m.id = r.model AND r.name = %s", [m2m_rel]
             )
@@ -704,6 +708,7 @@ def rename_field(cr, model, old, new, update_references=True, domain_adapter=Non
     # NOTE table_exists is needed to avoid altering views
     if table_exists(cr, table) and column_exists(cr, table, old):
         cr.execute('ALTER TABLE "{0}" RENAME COLUMN "{1}" TO "{2}"'.format(table, old, new))
+        _invalidate_schema_cache(cr, table)
         # Rename corresponding index
         new_index_name = make_index_name(table, new)
         old_index_name = make_index_name(table, old)
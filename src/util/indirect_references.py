@@ -2,7 +2,7 @@
 import collections
 
 from .helpers import model_of_table, table_of_model
-from .pg import SQLStr, column_exists, table_exists
+from .pg import SQLStr, _schema_cache_scope, column_exists, table_exists
 
 
 class IndirectReference(
@@ -101,7 +101,7 @@ INDIRECT_REFERENCES = [
 ]
 
 
-def indirect_references(cr, bound_only=False):
+def _existing_indirect_references(cr, bound_only):
     for ir in INDIRECT_REFERENCES:
         if bound_only and not ir.res_id:
             continue
@@ -120,6 +120,14 @@ def indirect_references(cr, bound_only=False):
 
         yield ir
 
+
+def indirect_references(cr, bound_only=False):
+    # resolve the columns upfront: the caller may alter the schema while iterating
+    with _schema_cache_scope(cr, bulk=False):
+        references = list(_existing_indirect_references(cr, bound_only))
+    for ir in references:
+        yield ir
+
     if column_exists(cr, "ir_model_fields", "company_dependent"):
         cr.execute(
             """
@@ -18,6 +18,8 @@ from .inherit import for_each_inherit, inherit_parents
 from .misc import _cached, chunks, log_progress, version_gte
 from .pg import (
     _get_unique_indexes_with,
+    _invalidate_schema_cache,
+    _schema_cached,
     column_exists,
     column_type,
     column_updatable,
@@ -226,6 +228,7 @@ def remove_model(cr, model, drop_table=True, ignore_m2m=()):
                     continue
                 _logger.info("remove_model(%r): dropping m2m table %r", model, table_name)
                 cr.execute('DROP TABLE "{}" CASCADE'.format(table_name))
+                _invalidate_schema_cache(cr)
                 ENVIRON.setdefault("_gone_m2m", {})[table_name] = model
 
         cr.execute("DELETE FROM ir_model_constraint WHERE model=%s RETURNING id", (mod_id,))
@@ -269,6 +272,7 @@ def remove_model(cr, model, drop_table=True, ignore_m2m=()):
             cr.execute('DROP TABLE "{0}" CASCADE'.format(table))
         elif view_exists(cr, table):
             cr.execute('DROP VIEW "{0}" CASCADE'.format(table))
+        _invalidate_schema_cache(cr)
 
     if notify:
         add_to_migration_reports(
@@ -306,6 +310,7 @@ def _replace_model_in_computed_custom_fields(cr, source, target):
         )
 
 
+@_schema_cached
 def rename_model(cr, old, new, rename_table=True, ignored_m2ms="ALL_BEFORE_18_1"):
     """
     Rename a model.
@@ -713,6 +718,7 @@ def convert_model_to_abstract(cr, model, drop_table=True, keep=()):
             cr.execute('DROP TABLE "{0}" CASCADE'.format(table))
         elif view_exists(cr, table):
             cr.execute('DROP VIEW "{0}" CASCADE'.format(table))
+        _invalidate_schema_cache(cr)
 
     # Even if `__last_update` can be changed on the model definition, we hardcode the name.
     # I'm not aware of any (standard) model that modify it. The field will need to be removed explicitly if it happen.
@@ -9,11 +9,17 @@ cases totally different alternatives to the ORM's own functions are provided. Th
 on this module work along the ORM of *all* supported versions.
 """
 
+import collections
 import logging
+import multiprocessing
+import random
 import re
+import sys
+import time
+import uuid
 from contextlib import contextmanager
 from functools import wraps
-from itertools import chain
+from itertools import chain, islice
 from textwrap import dedent
 
 try:
@@ -21,6 +27,13 @@ try:
 except ImportError:
     from mock import patch
 
+import psycopg2
+
+try:
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+except ImportError:
+    ProcessPoolExecutor = ThreadPoolExecutor = None
+
 try:
     try:
         from odoo.api import SUPERUSER_ID
@@ -38,11 +51,27 @@ except ImportError:
         # note: some functions on this module will fail (like recompute_fields)
         ofields = None
 
-from .const import BIG_TABLE_THRESHOLD
+from .const import BIG_TABLE_THRESHOLD, CHUNK_MEMORY_LIMIT, CHUNK_TIME_BUDGET
 from .exceptions import MigrationError
 from .helpers import table_of_model
 from .misc import chunks, log_progress, version_between, version_gte
-from .pg import SQLStr, column_exists, format_query, get_columns, named_cursor, query_ids
+from .pg import (
+    CONCURRENCY_ERRORCODES,
+    CONCURRENCY_RETRIES,
+    ColumnList,
+    SQLStr,
+    _drop_helper_table,
+    _parallel_execute_impl,
+    _parallel_execute_serial,
+    _worker_cursors,
+    column_exists,
+    explode_execute,
+    format_query,
+    get_columns,
+    get_max_workers,
+    named_cursor,
+    query_ids,
+)
 
 # python3 shims
 try:
@@ -284,9 +313,24 @@ def recompute_fields(cr, model, fields, ids=None, logger=_logger, chunk_size=256
     - *commit*: `commit` the cursor - also flush
     - *auto*: pick the best alternative between the two above given the number of records
       to compute and the presence of tracked fields.
+    - *parallel*: distribute the chunks among forked worker processes, each chunk is
+      committed by its worker.
 
     The *commit* strategy is less prone to cause a `MemoryError` for a huge volume of data.
 
+    The *parallel* strategy is meant for expensive computations on big tables. The chunks
+    are processed in no particular order, in independent transactions: the computation of a
+    chunk must not depend on the values computed for another one. It requires python 3.7,
+    it falls back to the *commit* strategy on older versions, and to the *flush* strategy
+    in tests.
+
+    With the *commit* and *parallel* strategies, when recomputing all records, the stored
+    related fields whose path only goes through stored many2one fields to a stored field
+    of the same type are recomputed in SQL, with one `UPDATE` executed via
+    :func:`~odoo.upgrade.util.pg.explode_execute`, which commits. The recomputation of the
+    fields depending on them is then triggered on the updated records. The other fields
+    are recomputed by the ORM.
+
     :param str model: name of the model to recompute
     :param list(str) fields: list of the name of the fields to recompute
     :param list(int) or None ids: list of the IDs of the records to recompute, when `None`
@@ -294,19 +338,33 @@ def recompute_fields(cr, model, fields, ids=None, logger=_logger, chunk_size=256
                                   below)
     :param logger: logger used to report the progress
     :type logger: :class:`logging.Logger`
-    :param int chunk_size: number of records per chunk - used to split the processing
+    :param int chunk_size: number of records per chunk - used to split the processing, or
+                           `"auto"` to adapt it to the duration and the memory usage of the
+                           previous chunks, see :class:`~odoo.upgrade.util.orm.iter_browse`
     :param str strategy: strategy used to process the re-computation
     :param str query: query to get the IDs of records to recompute, it is an error to set
                       both `ids` and `query`. Note that the processing will always happen
                       in ascending order. If that is unwanted, you must use `ids` instead.
     """
-    if strategy not in {"flush", "commit", "auto"}:
+    if strategy not in {"flush", "commit", "auto", "parallel"}:
         raise ValueError("Invalid strategy {!r}".format(strategy))
     if ids is not None and query is not None:
         raise ValueError("Cannot set both `ids` and `query`")
     Model = env(cr)[model] if isinstance(model, basestring) else model
     model = Model._name
 
+    if ids is None and query is None and strategy in {"commit", "parallel"}:
+        sql_fields = []
+        for field_name in fields:
+            path = _related_sql_path(cr, Model, field_name)
+            if path:
+                chunk = 256 if chunk_size == "auto" else chunk_size
+                _recompute_related_sql(cr, Model, field_name, path, logger, chunk, strategy)
+                sql_fields.append(field_name)
+        fields = [f for f in fields if f not in sql_fields]
+        if not fields:
+            return
+
     ids_ = ids
     if ids_ is None:
         ids_ = query_ids(
@@ -321,31 +379,490 @@ def recompute_fields(cr, model, fields, ids=None, logger=_logger, chunk_size=256
 
     _logger.info("Computing fields %s of %r on %d records", fields, model, count)
 
+    strategy = _recompute_strategy(Model, fields, count, strategy)
+    if strategy == "parallel":
+        if _parallel_execute_impl() is _parallel_execute_serial:
+            strategy = "flush"
+        elif ProcessPoolExecutor is None or sys.version_info < (3, 7):
+            _logger.warning("Parallel recomputation requires python >= 3.7, using the `commit` strategy")
+            strategy = "commit"
+
+    if chunk_size == "auto" and strategy != "parallel":
+        id_chunks = _AdaptiveChunks(256, model, logger)(ids_)
+        size, qual = None, "{} adaptive-bucket".format(model)
+    else:
+        chunk_size = 256 if chunk_size == "auto" else chunk_size
+        id_chunks = chunks(ids_, chunk_size, list)
+        size = (count + chunk_size - 1) / chunk_size
+        qual = "{} {:d}-bucket".format(model, chunk_size) if chunk_size != 1 else model
+    progress = log_progress(id_chunks, logger, qualifier=qual, size=size)
+    if strategy == "parallel":
+        _recompute_fields_parallel(cr, model, fields, progress)
+        invalidate(Model)
+        return
+
+    for subids in progress:
+        records = _recompute_records(Model, fields, subids)
+        if strategy == "commit":
+            cr.commit()
+        else:
+            flush(records)
+        invalidate(records)
+
+
+def recompute_fields_batch(cr, fields, ids=None, logger=_logger, chunk_size=256, strategy="auto"):
+    """
+    Recompute fields of several models, each field only once.
+
+    Calling :func:`recompute_fields` model by model may recompute some fields twice: the
+    recomputation of a field triggers the one of the stored fields depending on it, that
+    are recomputed again when it is their turn. This function orders the fields such that
+    they are recomputed after the fields they depend on. The records of the later fields
+    impacted by the recomputation of the earlier ones are gathered, and recomputed along
+    the requested ones.
+
+    .. example::
+        .. code-block:: python
+
+            util.recompute_fields_batch(
+                cr,
+                [
+                    ("sale.order", ["amount_untaxed", "amount_total"]),
+                    ("sale.order.line", ["price_subtotal", "price_total"]),
+                ],
+            )
+
+    :param list(tuple) fields: pairs of a model name and a list of the name of the fields
+                               to recompute
+    :param dict(str, list(int)) ids: IDs of the records to recompute per model name, the
+                                     fields of models absent from this mapping, or when it
+                                     is `None`, are recomputed on *all* records
+    :param logger: logger used to report the progress
+    :type logger: :class:`logging.Logger`
+    :param int chunk_size: number of records per chunk - used to split the processing
+    :param str strategy: strategy used to process the re-computation, one of `flush`,
+                         `commit` or `auto`, see :func:`recompute_fields`
+
+    .. note::
+       The gathering of the impacted records needs Odoo 13 or above. On older versions
+       the fields are recomputed with :func:`recompute_fields`, in the dependency order.
+    """
+    if strategy not in {"flush", "commit", "auto"}:
+        raise ValueError("Invalid strategy {!r}".format(strategy))
+    ids = ids or {}
+    env_ = env(cr)
+
+    # the fields computed by the same method are recomputed together
+    groups = collections.OrderedDict()
+    for model, field_names in fields:
+        for field_name in field_names:
+            compute = env_[model]._fields[field_name].compute
+            group = groups.setdefault((model, compute or field_name), [])
+            if field_name not in group:
+                group.append(field_name)
+    nodes = _fields_recompute_order(env_, [(model, tuple(names)) for (model, _), names in groups.items()])
+
+    if not hasattr(env_, "records_to_compute"):
+        # < 13.0
+        for model, field_names in nodes:
+            recompute_fields(cr, model, list(field_names), ids=ids.get(model), logger=logger, chunk_size=chunk_size)
+        return
+
+    # `None` stands for all the records of the model
+    pending = {node: set(ids[node[0]]) if node[0] in ids else None for node in nodes}
+    for i, (model, field_names) in enumerate(nodes):
+        Model = env_[model]
+        node_ids = pending.pop((model, field_names))
+        if node_ids is None:
+            query = format_query(cr, "SELECT id FROM {}", table_of_model(cr, model))
+            node_ids = query_ids(cr, query, itersize=2**20)
+        else:
+            node_ids = sorted(node_ids)
+        count = len(node_ids)
+        if not count:
+            continue
+
+        _logger.info("Computing fields %s of %r on %d records", list(field_names), model, count)
+        downstream = [(node, env_[node[0]]._fields[name]) for node in nodes[i + 1 :] for name in node[1]]
+        node_strategy = _recompute_strategy(Model, field_names, count, strategy)
+        size = (count + chunk_size - 1) / chunk_size
+        qual = "{} {:d}-bucket".format(model, chunk_size) if chunk_size != 1 else model
+        for subids in log_progress(chunks(node_ids, chunk_size, list), logger, qualifier=qual, size=size):
+            records = _recompute_records(Model, field_names, subids)
+            # take over the recomputation of the fields whose turn is still to come
+            for node, field in downstream:
+                impacted = env_.records_to_compute(field)
+                if impacted:
+                    if pending[node] is not None:
+                        pending[node].update(impacted.ids)
+                    env_.remove_to_compute(field, impacted)
+            if node_strategy == "commit":
+                cr.commit()
+            else:
+                flush(records)
+            invalidate(records)
+
+
+def _recompute_strategy(Model, fields, count, strategy):
     if strategy == "auto":
         big_table = count > BIG_TABLE_THRESHOLD
         any_tracked_field = any(getattr(Model._fields[f], _TRACKING_ATTR, False) for f in fields)
         strategy = "commit" if big_table and any_tracked_field else "flush"
+    return strategy
+
+
+def _related_sql_path(cr, Model, field_name):
+    # the (table, column) of each step of the path of a related field that can be computed in SQL
+    field = Model._fields[field_name]
+    related = getattr(field, "related", None)
+    if not related or not _is_plain_column(field):
+        return None
+    names = related.split(".") if isinstance(related, basestring) else list(related)
+    path = []
+    current = Model
+    for i, name in enumerate(names):
+        step = current._fields.get(name)
+        last = i == len(names) - 1
+        if step is None or not _is_plain_column(step) or step.type != (field.type if last else "many2one"):
+            return None
+        if last and field.type == "many2one" and step.comodel_name != field.comodel_name:
+            return None
+        if not column_exists(cr, current._table, name):
+            return None
+        path.append((current._table, name))
+        if not last:
+            current = current.env[step.comodel_name]
+    if not column_exists(cr, Model._table, field_name):
+        return None
+    return path
+
+
+_COLUMN_NULL_VALUES = {"boolean": "false", "integer": "0", "float": "0.0", "monetary": "0.0"}
+
+
+def _is_plain_column(field):
+    return (
+        field.store
+        and getattr(field, "column_type", None)
+        and not field.translate
+        and not getattr(field, "company_dependent", False)
+    )
 
-    size = (count + chunk_size - 1) / chunk_size
-    qual = "{} {:d}-bucket".format(model, chunk_size) if chunk_size != 1 else model
-    for subids in log_progress(chunks(ids_, chunk_size, list), logger, qualifier=qual, size=size):
-        records = Model.browse(subids)
-        for field_name in fields:
-            field = records._fields[field_name]
-            if hasattr(records, "_recompute_todo"):
-                # < 13.0
-                records._recompute_todo(field)
-            else:
-                Model.env.add_to_compute(field, records)
 
-        recompute(records)
-        # trigger dependent fields recomputation
-        records.modified(fields)
-        if strategy == "commit":
-            cr.commit()
+def _recompute_related_sql(cr, Model, field_name, path, logger, chunk_size, strategy):
+    field = Model._fields[field_name]
+    joins = [format_query(cr, "{} t0", Model._table)]
+    joins.extend(
+        format_query(
+            cr,
+            "LEFT JOIN {table} {alias} ON {alias}.id = {prev}.{column}",
+            table=path[i][0],
+            alias="t%d" % i,
+            prev="t%d" % (i - 1),
+            column=path[i - 1][1],
+        )
+        for i in range(1, len(path))
+    )
+    from_ = SQLStr("\n".join(joins))
+    value = format_query(cr, "{}.{}", "t%d" % (len(path) - 1), path[-1][1])
+    if field.type in _COLUMN_NULL_VALUES:
+        # the ORM stores these values instead of NULL, see `convert_to_column`
+        value = SQLStr("COALESCE({}, {})".format(value, _COLUMN_NULL_VALUES[field.type]))
+    changed = format_query(cr, "t0.{} IS DISTINCT FROM {}", field_name, SQLStr(value))
+
+    query = format_query(
+        cr,
+        """
+        UPDATE {table} t
+           SET {column} = v.value
+          FROM (SELECT t0.id, {value} AS value
+                  FROM {from_}
+                 WHERE {changed}
+                   AND {{parallel_filter}}) v
+         WHERE t.id = v.id
+        """,
+        table=Model._table,
+        column=field_name,
+        value=value,
+        from_=from_,
+        changed=changed,
+    )
+
+    # the recomputation of the dependent fields is triggered on the updated records
+    triggers = getattr(Model.pool, "field_triggers", None)
+    if triggers is not None and not triggers.get(field):
+        _logger.info("Computing related field %r of %r in SQL", field_name, Model._name)
+        explode_execute(cr, query, table=Model._table, alias="t0", logger=logger)
+        invalidate(Model)
+        return
+
+    changed_table = "_upgrade_related_{}".format(uuid.uuid4().hex)
+    try:
+        cr.execute(
+            format_query(cr, "CREATE UNLOGGED TABLE {} AS SELECT t0.id FROM {} WHERE {}", changed_table, from_, changed)
+        )
+        if not cr.rowcount:
+            return
+        _logger.info("Computing related field %r of %r in SQL", field_name, Model._name)
+        explode_execute(cr, query, table=Model._table, alias="t0", logger=logger)
+        invalidate(Model)
+
+        with query_ids(cr, format_query(cr, "SELECT id FROM {}", changed_table), itersize=2**20) as ids:
+            for subids in chunks(ids, chunk_size, list):
+                records = Model.browse(subids)
+                records.modified([field_name])
+                if strategy == "commit":
+                    cr.commit()
+                else:
+                    flush(records)
+                invalidate(records)
+    finally:
+        _drop_helper_table(cr, changed_table)
+
+
+def _field_dependencies(env, model, field_name, memo):
+    # all the fields, direct or indirect, the value of `field_name` depends on
+    key = (model, field_name)
+    if key in memo:
+        return memo[key]
+    memo[key] = dependencies = set()
+    field = env[model]._fields[field_name]
+    paths = env.registry.field_depends[field] if hasattr(env.registry, "field_depends") else field.depends
+    for path in paths or ():
+        Model = env[model]
+        for name in path.split("."):
+            dependency = Model._fields.get(name)
+            if dependency is None:
+                break
+            dependencies.add((Model._name, name))
+            if dependency.compute or dependency.related:
+                dependencies |= _field_dependencies(env, Model._name, name, memo)
+            if not dependency.relational:
+                break
+            Model = env[dependency.comodel_name]
+    return dependencies
+
+
+def _fields_recompute_order(env, nodes):
+    memo = {}
+    dependencies = {}
+    for model, field_names in nodes:
+        deps = set()
+        for field_name in field_names:
+            deps |= _field_dependencies(env, model, field_name, memo)
+        dependencies[model, field_names] = {
+            other for other in nodes if other != (model, field_names) and any((other[0], f) in deps for f in other[1])
+        }
+
+    order = []
+    remaining = list(nodes)
+    while remaining:
+        ready = [node for node in remaining if not dependencies[node].intersection(remaining)]
+        # on cycles, keep the given order
+        node = ready[0] if ready else remaining[0]
+        order.append(node)
+        remaining.remove(node)
+    return order
+
+
+def _recompute_records(Model, fields, ids):
+    records = Model.browse(ids)
+    for field_name in fields:
+        field = records._fields[field_name]
+        if hasattr(records, "_recompute_todo"):
+            # < 13.0
+            records._recompute_todo(field)
         else:
+            Model.env.add_to_compute(field, records)
+
+    recompute(records)
+    # trigger dependent fields recomputation
+    records.modified(fields)
+    return records
+
+
+def _rss():
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class _AdaptiveChunks(object):
+    """
+    Split ids in chunks whose size adapts to the processing of the previous chunks.
+
+    The processing of a chunk is measured from its creation until the next chunk is
+    requested. The size is scaled to make a chunk last `time_budget` seconds, without the
+    RSS of the process growing above `memory_limit` MiB. It is kept as is while within 25%
+    of the target, to avoid flip-flopping on noisy measures.
+
+    :meta private: exclude from online docs
+    """
+
+    minimum = 10
+    maximum = 10000
+
+    def __init__(self, size, qualifier, logger=_logger, time_budget=CHUNK_TIME_BUDGET, memory_limit=CHUNK_MEMORY_LIMIT):
+        self.size = size
+        self.qualifier = qualifier
+        self.logger = logger
+        self.time_budget = time_budget
+        self.memory_limit = memory_limit * 1024 * 1024
+        self.sizes = [size]
+
+    def __call__(self, iterable, fmt=list):
+        it = iter(iterable)
+        while True:
+            ids = list(islice(it, self.size))
+            if not ids:
+                return
+            started, rss = time.time(), _rss()
+            yield fmt(ids)
+            self.adapt(len(ids), time.time() - started, rss, _rss())
+
+    def adapt(self, count, duration, rss_before, rss_after):
+        factor = self.time_budget / duration if duration > 0 else 2.0
+        if rss_after is not None:
+            if rss_after > self.memory_limit:
+                factor = min(factor, 0.5)
+            elif rss_after > rss_before:
+                # the RSS growth of the next chunk must fit below the limit
+                growth = float(rss_after - rss_before) / count
+                factor = min(factor, (self.memory_limit - rss_after) / (growth * self.size))
+        factor = max(0.5, min(2.0, factor))
+        if 0.8 <= factor <= 1.25:
+            return
+        size = max(self.minimum, min(self.maximum, int(self.size * factor)))
+        if size != self.size:
+            self.logger.info(
+                "%s: chunk size %d -> %d (%d records in %.1fs, RSS %s MiB)",
+                self.qualifier,
+                self.size,
+                size,
+                count,
+                duration,
+                rss_after // (1024 * 1024) if rss_after is not None else "?",
+            )
+            self.size = size
+            self.sizes.append(size)
+
+
+def _is_prefetchable(field):
+    return (
+        field.store
+        and field.column_type
+        and field.name != "id"
+        and not field.translate
+        and not getattr(field, "company_dependent", False)
+    )
+
+
+def _prefetch_rows(dbname, query, ids):
+    with _worker_cursors.cursor(dbname) as cr:
+        cr.execute(query, [list(ids)])
+        return cr.fetchall()
+
+
+class _ChunkRecomputer(object):
+    """
+    Recompute fields on a chunk of records, in a worker process.
+
+    Each chunk is processed with a cursor of the worker and committed. Return `None` when
+    the chunk failed due to a concurrency issue, see :func:`_recompute_fields_parallel`.
+
+    :meta private: exclude from online docs
+    """
+
+    def __init__(self, dbname, model, fields):
+        self.dbname = dbname
+        self.model = model
+        self.fields = fields
+
+    def __call__(self, ids):
+        try:
+            with _worker_cursors.cursor(self.dbname) as cr:
+                wenv = env(cr)
+                try:
+                    records = _recompute_records(wenv[self.model], self.fields, ids)
+                    flush(records)
+                finally:
+                    # the cursor, and the cache of its environment, are reused by the next chunks
+                    wenv.clear()
+        except psycopg2.OperationalError as exc:
+            if exc.pgcode not in CONCURRENCY_ERRORCODES:
+                raise
+            return None
+        return len(ids)
+
+
+def _recompute_fields_parallel(cr, model, fields, id_chunks):
+    """
+    Recompute fields on chunks of records, in forked worker processes.
+
+    The chunks that failed due to concurrency issues are split in two halves and retried
+    with half as many concurrent chunks, after a jittered exponential backoff. The ones
+    still failing after `CONCURRENCY_RETRIES` rounds are recomputed serially.
+
+    :meta private: exclude from online docs
+    """
+    try:
+        from odoo import sql_db
+    except ImportError:
+        from openerp import sql_db
+
+    # children cannot borrow from copies of the same pool, it will cause protocol error
+    def init_worker_process():
+        sql_db._Pool = None
+
+    # the workers must see the current state of the data
+    cr.commit()
+    max_workers = get_max_workers()
+    recompute_chunk = _ChunkRecomputer(cr.dbname, model, fields)
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=init_worker_process, mp_context=multiprocessing.get_context("fork")
+    ) as executor:
+        failed = _submit_chunks(executor, recompute_chunk, id_chunks, 2 * max_workers)
+        concurrency = max_workers
+        for attempt in range(CONCURRENCY_RETRIES):
+            if not failed:
+                break
+            concurrency = max(1, concurrency // 2)
+            failed = [half for ids in failed for half in (ids[: len(ids) // 2], ids[len(ids) // 2 :]) if half]
+            _logger.info(
+                "Retry %d chunks that failed due to concurrency issues, %d at a time", len(failed), concurrency
+            )
+            time.sleep(random.uniform(0.5, 1.5) * 2**attempt)
+            failed = _submit_chunks(executor, recompute_chunk, failed, concurrency)
+
+    if failed:
+        _logger.warning("Recompute serially %d chunks that failed due to concurrency issues", len(failed))
+        Model = env(cr)[model]
+        for ids in failed:
+            records = _recompute_records(Model, fields, ids)
             flush(records)
-        invalidate(records)
+            cr.commit()
+            invalidate(records)
+
+
+def _submit_chunks(executor, recompute_chunk, id_chunks, max_pending):
+    # bound the number of pending chunks, `id_chunks` may be a stream over millions of ids
+    failed = []
+    pending = {}
+
+    def collect(futures):
+        for future in futures:
+            ids = pending.pop(future)
+            if future.result() is None:
+                failed.append(ids)
+
+    for ids in id_chunks:
+        if len(pending) >= max_pending:
+            collect(wait(pending, return_when=FIRST_COMPLETED)[0])
+        pending[executor.submit(recompute_chunk, ids)] = ids
+    collect(wait(pending)[0])
+    return failed
 
 
 class iter_browse(object):
@@ -387,20 +904,51 @@ class iter_browse(object):
                       Can also be a DML statement with a RETURNING clause.
                       See :func:`~odoo.upgrade.util.pg.query_ids`
     :param int chunk_size: number of records to load in each iteration chunk, `200` by
-                           default
+                           default. With `"auto"`, the size starts at `200` and adapts to the
+                           duration of the processing of the previous chunks, and to the
+                           growth of the memory of the process. The targets are set by the
+                           `ODOO_UPG_CHUNK_TIME_BUDGET` (seconds, `10` by default) and
+                           `ODOO_UPG_CHUNK_MEMORY_LIMIT` (MiB, `2048` by default) environment
+                           variables.
     :param bool yield_chunks: when iterating, yield records in chunks of `chunk_size` instead of one by one.
                               Default is `False`
     :param logger: logger used to report the progress, by default
                    :data:`~odoo.upgrade.util.orm._logger`
     :type logger: :class:`logging.Logger`
     :param str strategy: whether to `flush` or `commit` on each chunk, default is `flush`
+    :param bool or list(str) prefetch: read the stored fields of the next chunk on a
+                                       secondary connection while the current chunk is
+                                       processed. Either `True` for all the stored fields
+                                       prefetched by the ORM, or a list of field names.
+                                       Default is `False`. Only from Odoo 13, with the
+                                       `commit` strategy. The cursor is committed when
+                                       the iteration starts.
     :return: the object returned by this class can be used to iterate, or call any model
              method, safely on millions of records.
 
+    .. warning::
+       With `prefetch`, the cursor is committed before the first chunk, even if nothing
+       else is done, for the secondary connection to see the current data. The prefetched
+       values are read in another transaction: once the previous chunk is committed, the
+       `xmin` of their rows is compared to the current one, and only the rows that were
+       not modified in the meantime are put in the cache.
+
     See also :func:`~odoo.upgrade.util.orm.env`
     """
 
-    __slots__ = ("_chunk_size", "_cr_uid", "_it", "_logger", "_model", "_patch", "_size", "_strategy", "_yield_chunks")
+    __slots__ = (
+        "_adaptive",
+        "_chunk_size",
+        "_cr_uid",
+        "_it",
+        "_logger",
+        "_model",
+        "_patch",
+        "_prefetch",
+        "_size",
+        "_strategy",
+        "_yield_chunks",
+    )
 
     def __init__(self, model, *args, **kw):
         assert len(args) in [1, 3]  # either (cr, uid, ids) or (ids,)
@@ -414,14 +962,18 @@ class iter_browse(object):
         self._logger = kw.pop("logger", _logger)
         self._strategy = kw.pop("strategy", "flush")
         assert self._strategy in {"flush", "commit"}
+        prefetch = kw.pop("prefetch", False)
         if kw:
             raise TypeError("Unknown arguments: %s" % ", ".join(kw))
+        self._adaptive = _AdaptiveChunks(200, model._name, self._logger) if self._chunk_size == "auto" else None
+        if self._adaptive and prefetch:
+            raise ValueError("`prefetch` cannot be combined with an adaptive `chunk_size`")
 
         if not (ids is None) ^ (query is None):
             raise TypeError("Must be initialized using exactly one of `ids` or `query`")
 
         if query:
-            ids = query_ids(self._model.env.cr, query, itersize=self._chunk_size)
+            ids = query_ids(self._model.env.cr, query, itersize=self._itersize())
 
         if not self._size:
             try:  # noqa: SIM105
@@ -430,7 +982,93 @@ class iter_browse(object):
                 pass
 
         self._patch = None
-        self._it = chunks(ids, self._chunk_size, fmt=self._browse)
+        self._prefetch = self._prefetch_fields(prefetch) if prefetch else None
+        if self._prefetch:
+            self._it = self._prefetching(chunks(ids, self._chunk_size, fmt=list))
+        else:
+            self._it = self._chunks(ids, self._browse)
+
+    def _chunks(self, iterable, fmt):
+        if self._adaptive:
+            return self._adaptive(iterable, fmt=fmt)
+        return chunks(iterable, self._chunk_size, fmt=fmt)
+
+    def _count_chunks(self, size):
+        if not size or self._adaptive:
+            return None
+        return (size + self._chunk_size - 1) // self._chunk_size
+
+    def _itersize(self):
+        return self._adaptive.maximum if self._adaptive else self._chunk_size
+
+    def _prefetch_fields(self, prefetch):
+        if self._cr_uid or ThreadPoolExecutor is None or not version_gte("13.0"):
+            raise ValueError("Prefetching is only supported from Odoo 13")
+        if self._strategy != "commit":
+            raise ValueError("Prefetching requires the `commit` strategy")
+        fields = self._model._fields
+        if prefetch is True:
+            return [name for name, field in fields.items() if field.prefetch is True and _is_prefetchable(field)]
+        for name in prefetch:
+            if name not in fields or not _is_prefetchable(fields[name]):
+                raise ValueError("Field %r of %r cannot be prefetched" % (name, self._model._name))
+        return list(prefetch)
+
+    def _prefetching(self, id_chunks):
+        cr = self._model.env.cr
+        query = format_query(
+            cr,
+            "SELECT id, xmin::text, {} FROM {} WHERE id = ANY(%s)",
+            ColumnList.from_unquoted(cr, self._prefetch),
+            self._model._table,
+        )
+        # the prefetching connection must see the changes done so far
+        cr.commit()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = None
+            id_chunks = iter(id_chunks)
+            ids = next(id_chunks, None)
+            while ids is not None:
+                records = self._browse(ids)
+                if future is not None:
+                    self._fill_cache(records, future.result())
+                ids = next(id_chunks, None)
+                future = executor.submit(_prefetch_rows, cr.dbname, query, ids) if ids is not None else None
+                yield records
+
+    def _fill_cache(self, records, rows):
+        if not rows:
+            return
+        # the previous chunks may have modified the rows since they were read
+        cr = records.env.cr
+        ids, xmins = list(zip(*rows))[:2]
+        cr.execute(
+            format_query(
+                cr,
+                """
+                SELECT t.id
+                  FROM {} t
+                  JOIN unnest(%s::int[], %s::text[]) AS p(id, xmin)
+                    ON p.id = t.id
+                   AND p.xmin = t.xmin::text
+                """,
+                self._model._table,
+            ),
+            [list(ids), list(xmins)],
+        )
+        unchanged = {id_ for (id_,) in cr.fetchall()}
+        rows = [row for row in rows if row[0] in unchanged]
+        if not rows:
+            return
+        fetched = records.browse([row[0] for row in rows])
+        for field_name, values in zip(self._prefetch, list(zip(*rows))[2:]):
+            field = fetched._fields[field_name]
+            if hasattr(field, "_insert_cache"):
+                field._insert_cache(fetched, values)
+            else:
+                # older versions: the cache is filled with values in cache format
+                cache_values = [field.convert_to_cache(v, rec, validate=False) for v, rec in zip(values, fetched)]
+                fetched.env.cache.update(fetched, field, cache_values)
 
     def _browse(self, ids):
         next(self._end(), None)
@@ -458,11 +1096,7 @@ class iter_browse(object):
 
         it = self._it if self._yield_chunks else chain.from_iterable(self._it)
         if self._logger:
-            sz = (
-                (self._size + self._chunk_size - 1) // self._chunk_size
-                if self._size and self._yield_chunks
-                else self._size
-            )
+            sz = self._count_chunks(self._size) if self._yield_chunks else self._size
             qualifier = self._model._name + ("[:{}]".format(self._chunk_size) if self._yield_chunks else "")
             it = log_progress(it, self._logger, qualifier=qualifier, size=sz)
         self._it = None
@@ -477,7 +1111,7 @@ class iter_browse(object):
 
         it = self._it
         if self._logger:
-            sz = (self._size + self._chunk_size - 1) // self._chunk_size if self._size else None
+            sz = self._count_chunks(self._size)
             qualifier = "{}[:{}]".format(self._model._name, self._chunk_size)
             it = log_progress(it, self._logger, qualifier=qualifier, size=sz)
 
@@ -490,7 +1124,7 @@ class iter_browse(object):
 
     def _values_iter(self, query):
         cr = self._model.env.cr
-        with named_cursor(cr, itersize=self._chunk_size) as ncr:
+        with named_cursor(cr, itersize=self._itersize()) as ncr:
             ncr.execute(query)
             for row in ncr.iterdict():
                 yield row
@@ -530,10 +1164,10 @@ class iter_browse(object):
             except TypeError:
                 pass
 
-        it = chunks(values, self._chunk_size, fmt=list)
+        it = self._chunks(values, list)
         if self._logger:
-            sz = (size + self._chunk_size - 1) // self._chunk_size if size else None
-            qualifier = "env[%r].create([:%d])" % (self._model._name, self._chunk_size)
+            sz = self._count_chunks(size)
+            qualifier = "env[%r].create([:%s])" % (self._model._name, self._chunk_size)
             it = log_progress(it, self._logger, qualifier=qualifier, size=sz)
 
         ids = []
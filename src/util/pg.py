@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 """Utility functions for interacting with PostgreSQL."""
 
+import array
+import atexit
 import collections
+import hashlib
 import logging
 import os
+import random
 import re
 import string
 import threading
@@ -11,8 +15,9 @@ import time
 import uuid
 import warnings
 from contextlib import contextmanager
-from functools import partial, reduce
+from functools import partial, reduce, wraps
 from multiprocessing import cpu_count
+from multiprocessing import util as mp_util
 
 try:
     from concurrent.futures import ThreadPoolExecutor  # noqa: I001
@@ -30,28 +35,50 @@ try:  # noqa: SIM105
 except NameError:
     pass
 
+try:
+    unicode  # noqa: B018
+except NameError:
+    unicode = str
+
 import psycopg2
 from psycopg2 import errorcodes, sql
 from psycopg2.extensions import quote_ident
 from psycopg2.extras import Json
 
 try:
+    from odoo import sql_db
     from odoo.modules import module as odoo_module
     from odoo.sql_db import db_connect
+    from odoo.tools import config
 except ImportError:
+    from openerp import sql_db
     from openerp.sql_db import db_connect
+    from openerp.tools import config
 
     odoo_module = None
 
+from . import json
 from .exceptions import MigrationError, SleepyDeveloperError
 from .helpers import _validate_table, model_of_table
-from .misc import AUTO, Sentinel, log_progress, on_CI, version_gte
+from .misc import AUTO, Sentinel, log_progress, on_CI, str2bool, version_gte
 
 _logger = logging.getLogger(__name__)
 
 ON_DELETE_ACTIONS = frozenset(("SET NULL", "CASCADE", "RESTRICT", "NO ACTION", "SET DEFAULT"))
 MAX_BUCKETS = int(os.getenv("MAX_BUCKETS", "150000"))
 DEFAULT_BUCKET_SIZE = int(os.getenv("BUCKET_SIZE", "10000"))
+EXPLODE_PLANNERS = frozenset(("range", "stats", "sample"))
+DEFAULT_EXPLODE_PLANNER = os.getenv("EXPLODE_PLANNER", "range")
+DEFAULT_BUCKET_TIME_BUDGET = float(os.getenv("BUCKET_TIME_BUDGET", "10"))
+CONCURRENCY_ERRORCODES = frozenset((errorcodes.DEADLOCK_DETECTED, errorcodes.SERIALIZATION_FAILURE))
+CONCURRENCY_RETRIES = int(os.getenv("CONCURRENCY_RETRIES", "3"))
+ANALYZE_THRESHOLD = int(os.getenv("ANALYZE_THRESHOLD", "10000"))
+ANALYZE_SCALE_FACTOR = float(os.getenv("ANALYZE_SCALE_FACTOR", "0.1"))
+VACUUM_SCALE_FACTOR = float(os.getenv("VACUUM_SCALE_FACTOR", "0.2"))
+# experimental, opt-in until the gain over literal bucket queries is measured
+PREPARE_BUCKET_QUERIES = str2bool(os.getenv("PREPARE_BUCKET_QUERIES", "0"))
+GENERIC_PLAN_TOLERANCE = float(os.getenv("GENERIC_PLAN_TOLERANCE", "1.5"))
+EXPLODE_M2M_THRESHOLD = int(os.getenv("EXPLODE_M2M_THRESHOLD", "1000000"))
 
 
 class PGRegexp(str):
@@ -72,13 +99,126 @@ class SQLStr(str):
 
 def get_max_workers():
     force_max_worker = os.getenv("MAX_WORKER")
+    if force_max_worker == "auto":
+        return _server_capacity.get("workers") or min(8, cpu_count())
     if force_max_worker:
         if not force_max_worker.isdigit():
-            raise MigrationError("wrong parameter: MAX_WORKER should be an integer")
+            raise MigrationError("wrong parameter: MAX_WORKER should be an integer or `auto`")
         return int(force_max_worker)
     return min(8, cpu_count())
 
 
+_server_capacity = {}
+
+
+def _probe_max_workers(cr):
+    """
+    Return the maximum number of workers, probing the database server with `MAX_WORKER=auto`.
+
+    The workers are limited by the connections still available, on the server and in the
+    connection pool of Odoo (`db_maxconn`), and by the CPUs of the server not used by other
+    active backends. The CPUs of a remote server are estimated by its
+    `max_worker_processes` setting, the local ones are counted.
+
+    :meta private: exclude from online docs
+    """
+    if os.getenv("MAX_WORKER") != "auto":
+        return get_max_workers()
+    cr.execute(
+        """
+        SELECT current_setting('max_connections')::int
+             - current_setting('superuser_reserved_connections')::int
+             - (SELECT count(*) FROM pg_stat_activity),
+               current_setting('max_worker_processes')::int,
+               (SELECT count(*) FROM pg_stat_activity WHERE state = 'active' AND pid != pg_backend_pid()),
+               coalesce(host(inet_server_addr()) IN ('127.0.0.1', '::1'), true)
+        """
+    )
+    free_connections, worker_processes, active, local = cr.fetchone()
+    # our idle worker connections are reused
+    idle_workers = sum(len(idle) for idle in _worker_cursors._idle.values())
+    # keep a margin for the other clients
+    free_connections += idle_workers - 2
+    pool_connections = _free_pool_connections() + idle_workers
+    cpus = cpu_count() if local else worker_processes
+    _server_capacity["workers"] = workers = max(1, min(free_connections, pool_connections, cpus - active))
+    return workers
+
+
+def _free_pool_connections():
+    # the worker cursors borrow their connections from the pool of Odoo, which raises
+    # `PoolError` once `db_maxconn` connections are in use
+    pool = sql_db._Pool
+    if pool is None:
+        return config["db_maxconn"]
+    in_use = 0
+    for connection in pool._connections:
+        if isinstance(connection, tuple):
+            # older versions keep tuples of the connection and whether it is used
+            in_use += bool(connection[1])
+        else:
+            in_use += bool(getattr(connection, "_pool_in_use", False))
+    return pool._maxconn - in_use
+
+
+class _AdaptiveConcurrency(object):
+    """
+    Limit of the queries executed concurrently, adapted to the observed throughput.
+
+    With `MAX_WORKER=auto`, the limit starts from the usual number of workers and is moved
+    by hill climbing: after each window of queries, it keeps moving in the same direction
+    while the throughput improves, and turns back when it drops. Otherwise the limit stays
+    at the number of workers.
+
+    :meta private: exclude from online docs
+    """
+
+    def __init__(self, limit, maximum, adaptive=True):
+        self.limit = limit
+        self.maximum = maximum
+        self.adaptive = adaptive
+        self.history = []
+        self._cond = threading.Condition()
+        self._running = 0
+        self._direction = 1
+        self._throughput = None
+        self._done = 0
+        self._t0 = time.time()
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self._running >= self.limit:
+                self._cond.wait()
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._done += 1
+                if self.adaptive and self._done >= max(4, 2 * self.limit):
+                    now = time.time()
+                    self.adapt(self._done / max(now - self._t0, 1e-6))
+                    self._done = 0
+                    self._t0 = now
+                self._cond.notify_all()
+
+    def adapt(self, throughput):
+        if self._throughput is not None and throughput < 0.95 * self._throughput:
+            self._direction = -self._direction
+        self._throughput = throughput
+        step = max(1, self.limit // 4)
+        self.limit = max(1, min(self.maximum, self.limit + self._direction * step))
+        self.history.append((self.limit, throughput))
+
+
+def _concurrency_limiter(max_workers):
+    if os.getenv("MAX_WORKER") != "auto" or max_workers <= 1:
+        return _AdaptiveConcurrency(max_workers, max_workers, adaptive=False)
+    return _AdaptiveConcurrency(min(max_workers, 8, cpu_count()), max_workers)
+
+
 @contextmanager
 def savepoint(cr):
     # NOTE: the `savepoint` method on Cursor only appear in `saas-3`, which mean this function
@@ -88,39 +228,428 @@ def savepoint(cr):
         yield
 
 
-def _parallel_execute_serial(cr, queries, logger=_logger, qualifier="queries"):
+class _WorkerCursorPool(object):
+    """
+    Pool of long-lived cursors used by the parallel workers.
+
+    Instead of opening a new cursor for each query, workers borrow a cursor from this pool
+    and give it back once their transaction is committed (or rolled back). Consecutive
+    queries thus reuse the same connections during the whole upgrade.
+
+    The pool is reset in forked processes, which must not use the connections of their
+    parent. Worker processes of `multiprocessing` end without running the `atexit` hooks,
+    they must call :meth:`close_at_exit` to close their connections.
+
+    The session `settings` are applied once per connection, the `overrides` are applied
+    to each transaction. See :func:`set_worker_settings` and :func:`worker_settings`.
+
+    The statements of the bucket queries are prepared once per connection, see
+    :meth:`statement`.
+
+    :meta private: exclude from online docs
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._idle = collections.defaultdict(list)
+        self._configured = {}
+        self._prepared = {}
+        self.stats = collections.Counter()
+        self.settings = _parse_settings(os.getenv("WORKER_SESSION_SETTINGS", ""))
+        self.overrides = {}
+
+    def _forget_inherited(self):
+        """Drop the cursors inherited from the parent process, without closing them."""
+        if self._pid == os.getpid():
+            return
+        # idle and borrowed cursors; marked as closed, they do not give their connection
+        # back when garbage collected, and psycopg2 only closes the connections of the
+        # process that opened them
+        for cr in list(self._configured) + [cr for idle in self._idle.values() for cr in idle]:
+            cr._closed = True
+        # the lock may have been held by another thread of the parent when forking
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._idle = collections.defaultdict(list)
+        self._configured = {}
+        self._prepared = {}
+        self.stats = collections.Counter()
+
+    def _acquire(self, dbname):
+        self._forget_inherited()
+        with self._lock:
+            idle = self._idle[dbname]
+            while idle:
+                cr = idle.pop()
+                if not cr._cnx.closed:
+                    self.stats["reused"] += 1
+                    return cr
+                self.stats["discarded"] += 1
+            self.stats["created"] += 1
+        return db_connect(dbname).cursor()
+
+    def _release(self, dbname, cr):
+        with self._lock:
+            if not cr._cnx.closed and len(self._idle[dbname]) < get_max_workers():
+                self._idle[dbname].append(cr)
+                return
+            self.stats["discarded"] += 1
+            self._configured.pop(cr, None)
+            self._prepared.pop(cr, None)
+        try:  # noqa: SIM105
+            cr.close()
+        except psycopg2.Error:
+            pass
+
+    def _configure(self, cr):
+        applied = self._configured.get(cr, {})
+        settings = self.settings
+        if applied != settings:
+            for name in set(applied) - set(settings):
+                cr.execute("SELECT set_config(name, reset_val, false) FROM pg_settings WHERE name = %s", [name])
+            for name, value in settings.items():
+                if applied.get(name) != value:
+                    cr.execute("SELECT set_config(%s, %s, false)", [name, value])
+            # session settings set in a rolled back transaction are reverted
+            cr.commit()
+            self._configured[cr] = settings
+        for name, value in self.overrides.items():
+            cr.execute("SELECT set_config(%s, %s, true)", [name, value])
+
+    def statement(self, cr, query):
+        """
+        Return the `EXECUTE` of the prepared statement of `query` on a borrowed cursor.
+
+        The statement is prepared on first use. Return `None` for queries without
+        prepared statement, and for cursors not borrowed from the pool.
+        """
+        statement = getattr(query, "statement", None)
+        prepared = self._prepared.get(cr)
+        if statement is None or prepared is None:
+            return None
+        name, body = statement
+        if name not in prepared:
+            cr.execute("PREPARE {} AS {}".format(name, body))
+            prepared.add(name)
+        return cr.mogrify("EXECUTE {}(%s, %s)".format(name), [query.lower, query.upper]).decode()
+
+    @contextmanager
+    def cursor(self, dbname):
+        """Borrow a cursor, committed on success and rolled back on failure."""
+        cr = self._acquire(dbname)
+        committed = False
+        try:
+            self._configure(cr)
+            self._prepared.setdefault(cr, set())
+            yield cr
+            cr.commit()
+            committed = True
+        finally:
+            if not committed:
+                try:
+                    cr.rollback()
+                    if self._prepared.get(cr):
+                        # forget the statements, whether they were prepared in the failed transaction or not
+                        cr.execute("DEALLOCATE ALL")
+                        cr.commit()
+                        self._prepared[cr] = set()
+                except psycopg2.Error:
+                    # the connection is broken, it will be discarded
+                    pass
+            self._release(dbname, cr)
+
+    def close_at_exit(self):
+        """
+        Close the connections of the current worker process when it exits.
+
+        To call in the initializer of the worker processes of `multiprocessing`, which end
+        with `os._exit`, thus without running the `atexit` hooks.
+        """
+        mp_util.Finalize(None, self._close_process_connections, exitpriority=0)
+
+    def _close_process_connections(self):
+        self.close_all()
+        # the cursors only give their connections back to the pool of Odoo
+        sql_db.close_all()
+
+    def close_all(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            cursors = [cr for idle in self._idle.values() for cr in idle]
+            self._idle.clear()
+            self._configured.clear()
+            self._prepared.clear()
+        for cr in cursors:
+            try:  # noqa: SIM105
+                cr.close()
+            except psycopg2.Error:
+                pass
+
+
+def _parse_settings(value):
+    # "work_mem=256MB,jit=off" -> {"work_mem": "256MB", "jit": "off"}
+    settings = {}
+    for setting in value.split(","):
+        if not setting.strip():
+            continue
+        name, sep, val = setting.partition("=")
+        if not sep:
+            raise MigrationError("wrong parameter: expected `name=value` settings, got {!r}".format(setting))
+        settings[name.strip()] = val.strip()
+    return settings
+
+
+_worker_cursors = _WorkerCursorPool()
+atexit.register(_worker_cursors.close_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_worker_cursors._forget_inherited)
+
+
+def set_worker_settings(**settings):
+    """
+    Set the PostgreSQL session settings of the worker connections.
+
+    The worker connections are the ones used to execute the queries of
+    :func:`parallel_execute` and :func:`explode_execute` in parallel, and by the
+    processes converting data in parallel. The settings are applied once per connection.
+    They default to the value of the `WORKER_SESSION_SETTINGS` environment variable, a
+    comma-separated list of `name=value`.
+
+    .. example::
+        .. code-block:: python
+
+            util.set_worker_settings(work_mem="256MB", synchronous_commit="off", jit="off")
+
+    :param settings: values of the settings, `None` to restore the server default
+    """
+    new_settings = dict(_worker_cursors.settings)
+    for name, value in settings.items():
+        if value is None:
+            new_settings.pop(name, None)
+        else:
+            new_settings[name] = str(value)
+    _worker_cursors.settings = new_settings
+
+
+@contextmanager
+def worker_settings(cr, **settings):
+    """
+    Override PostgreSQL settings for the queries run inside the context.
+
+    The settings are applied to each transaction of the worker connections, and to the
+    session of `cr`, which is restored when leaving the context. Use it for heavy
+    operations, like index creation.
+
+    .. example::
+        .. code-block:: python
+
+            with util.worker_settings(cr, maintenance_work_mem="2GB", max_parallel_maintenance_workers=4):
+                util.parallel_execute(cr, index_queries)
+
+    :param settings: values of the settings to override
+    """
+    settings = {name: str(value) for name, value in settings.items()}
+    cr.execute("SELECT name, current_setting(name) FROM unnest(%s::text[]) AS name", [list(settings)])
+    previous = dict(cr.fetchall())
+    for name, value in settings.items():
+        cr.execute("SELECT set_config(%s, %s, false)", [name, value])
+    previous_overrides = _worker_cursors.overrides
+    _worker_cursors.overrides = dict(previous_overrides, **settings)
+    try:
+        yield
+    finally:
+        _worker_cursors.overrides = previous_overrides
+        try:
+            for name, value in previous.items():
+                cr.execute("SELECT set_config(%s, %s, false)", [name, value])
+        except psycopg2.InternalError as e:
+            # the session settings of an aborted transaction are reverted by its rollback
+            if e.pgcode != errorcodes.IN_FAILED_SQL_TRANSACTION:
+                raise
+
+
+class QueryTelemetry(object):
+    """
+    Collector of the executions of the queries run by `parallel_execute` and `explode_execute`.
+
+    See :func:`query_telemetry`.
+
+    :meta private: exclude from online docs
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = []
+
+    def record(self, **values):
+        with self._lock:
+            self.records.append(values)
+
+    def summary(self):
+        """Return, per qualifier, the number of queries, rows, errors, and the duration percentiles."""
+        by_qualifier = collections.defaultdict(list)
+        for record in self.records:
+            by_qualifier[record["qualifier"]].append(record)
+        result = {}
+        for qualifier, records in by_qualifier.items():
+            durations = sorted(r["duration"] for r in records)
+
+            def percentile(p, durations=durations):
+                return durations[int(p * (len(durations) - 1) + 0.5)]
+
+            statuses = collections.Counter(r["status"] for r in records)
+            result[qualifier] = {
+                "queries": len(records),
+                "rows": sum(r["rowcount"] for r in records if r["rowcount"] and r["rowcount"] > 0),
+                "retries": sum(1 for r in records if r["attempt"]),
+                "conflicts": statuses["conflict"],
+                "errors": statuses["error"],
+                "prepared": sum(1 for r in records if r.get("prepared")),
+                "total": sum(durations),
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": durations[-1],
+            }
+        return result
+
+    def dumps(self):
+        return json.dumps({"summary": self.summary(), "queries": self.records}, sort_keys=True)
+
+    def log_summary(self, logger=_logger):
+        for qualifier, stats in sorted(self.summary().items()):
+            logger.info(
+                "%(queries)d %(qualifier)s (%(prepared)d prepared, %(retries)d retries, %(conflicts)d conflicts, "
+                "%(errors)d errors) affected %(rows)d rows in %(total).1fs: p50=%(p50).3fs p95=%(p95).3fs max=%(max).3fs",
+                dict(stats, qualifier=qualifier),
+            )
+
+
+_query_telemetry = QueryTelemetry() if os.getenv("QUERY_TELEMETRY") else None
+
+
+@atexit.register
+def _dump_query_telemetry():
+    path = os.getenv("QUERY_TELEMETRY")
+    if path and _query_telemetry is not None and _query_telemetry.records:
+        with open(path, "w") as fp:
+            fp.write(_query_telemetry.dumps())
+
+
+@contextmanager
+def query_telemetry(path=None, logger=_logger):
+    """
+    Record the executions of the queries run by `parallel_execute` and `explode_execute`.
+
+    The duration, rowcount, worker, attempt, and status (`ok`, `conflict`, `error`) of each
+    query are recorded. When leaving the context, a summary with the p50/p95/max durations
+    is logged per qualifier, and if `path` is set, all the records are dumped there as JSON.
+
+    The telemetry can also be recorded for the whole upgrade by setting the
+    `QUERY_TELEMETRY` environment variable to the path of the JSON file to write at exit.
+
+    .. example::
+        .. code-block:: python
+
+            with util.query_telemetry("/tmp/telemetry.json"):
+                util.explode_execute(cr, query, table="account_move_line")
+
+    :param str path: path of the file to dump the records into
+    :param logger: logger used to log the summary
+    :type logger: :class:`logging.Logger`
+    :return: the collector, holding the recorded queries in its `records` attribute
+    """
+    global _query_telemetry  # noqa: PLW0603
+    previous = _query_telemetry
+    telemetry = _query_telemetry = QueryTelemetry()
+    try:
+        yield telemetry
+    finally:
+        _query_telemetry = previous
+        if previous is not None:
+            previous.records.extend(telemetry.records)
+        telemetry.log_summary(logger)
+        if path:
+            with open(path, "w") as fp:
+                fp.write(telemetry.dumps())
+
+
+def _execute_query(cr, query, qualifier="queries", attempt=0):
+    statement = _worker_cursors.statement(cr, query)
+    telemetry = _query_telemetry
+    if telemetry is None:
+        cr.execute(statement or query)
+        rowcount = cr.rowcount
+    else:
+        t0 = time.time()
+        status = "ok"
+        rowcount = None
+        try:
+            cr.execute(statement or query)
+            rowcount = cr.rowcount
+        except psycopg2.Error as exc:
+            status = "conflict" if exc.pgcode in CONCURRENCY_ERRORCODES else "error"
+            raise
+        finally:
+            telemetry.record(
+                qualifier=qualifier,
+                query=_query_label(query),
+                duration=time.time() - t0,
+                rowcount=rowcount,
+                worker=threading.current_thread().name,
+                attempt=attempt,
+                status=status,
+                prepared=statement is not None,
+            )
+    after = getattr(query, "after", None)
+    if after:
+        # bookkeeping that must be committed in the same transaction as the query
+        cr.execute(after)
+    return rowcount
+
+
+def _query_label(query):
+    if isinstance(query, _BucketQuery):
+        return "{} {} to {}".format(query.unit, query.lower, query.upper)
+    query = " ".join(query.split())
+    return query if len(query) <= 80 else query[:77] + "..."
+
+
+def _split_query(cr, query):
+    if not isinstance(query, _BucketQuery) or query.lower >= query.upper:
+        return [query]
+    middle = (query.lower + query.upper) // 2
+    return [query.restrict(cr, query.lower, middle), query.restrict(cr, middle + 1, query.upper)]
+
+
+def _parallel_execute_serial(cr, queries, logger=_logger, qualifier="queries", attempt=0):
     cnt = 0
     for query in log_progress(queries, logger, qualifier=qualifier, size=len(queries)):
-        cr.execute(query)
-        cnt += cr.rowcount
+        cnt += _execute_query(cr, query, qualifier, attempt)
     return cnt
 
 
 if ThreadPoolExecutor is not None:
 
-    def _parallel_execute_threaded(cr, queries, logger=_logger, qualifier="queries"):
-        if not queries:
-            return None
+    def _execute_concurrently(cr, queries, max_workers, logger, qualifier, jitter=0, attempt=0):
+        """
+        Execute queries with worker cursors.
 
-        if len(queries) == 1:
-            # No need to spawn other threads
-            cr.execute(queries[0])
-            return cr.rowcount
+        Return the sum of the rowcounts and the list of queries that failed due to
+        concurrency issues. Each query waits a random delay of up to `jitter` seconds before
+        being executed.
 
-        max_workers = min(get_max_workers(), len(queries))
-        cursor = db_connect(cr.dbname).cursor
+        :meta private: exclude from online docs
+        """
+        limiter = _concurrency_limiter(max_workers)
 
         def execute(query):
-            with cursor() as tcr:
-                tcr.execute(query)
-                return tcr.rowcount
-
-        cr.commit()
+            if jitter:
+                time.sleep(random.uniform(0, jitter))
+            with limiter.slot(), _worker_cursors.cursor(cr.dbname) as tcr:
+                return _execute_query(tcr, query, qualifier, attempt)
 
-        CONCURRENCY_ERRORCODES = {
-            errorcodes.DEADLOCK_DETECTED,
-            errorcodes.SERIALIZATION_FAILURE,
-        }
         failed_queries = []
         tot_cnt = 0
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
@@ -138,21 +667,95 @@ if ThreadPoolExecutor is not None:
                 except psycopg2.OperationalError as exc:
                     if exc.pgcode not in CONCURRENCY_ERRORCODES:
                         raise
-
-                    # to be retried without concurrency
                     failed_queries.append(future_queries[future])
+        if limiter.history:
+            logger.debug("Adaptive concurrency (workers, queries/s): %s", limiter.history)
+        return tot_cnt, failed_queries
 
-        if failed_queries:
+    def _retry_concurrency_failures(cr, queries, logger, qualifier):
+        """
+        Retry queries that failed due to concurrency issues.
+
+        Each retry round splits the failing bucket queries in two halves, and executes them
+        with half as many workers as the previous round, after a jittered exponential
+        backoff. Queries still failing after `CONCURRENCY_RETRIES` rounds are executed
+        serially.
+
+        :meta private: exclude from online docs
+        """
+        conflicts = collections.Counter()
+        tot_cnt = 0
+        workers = get_max_workers()
+        for attempt in range(CONCURRENCY_RETRIES):
+            if not queries:
+                break
+            conflicts.update(_query_label(q) for q in queries)
+            workers = max(1, workers // 2)
+            queries = [part for q in queries for part in _split_query(cr, q)]
+            logger.info(
+                "Retry %d %s that failed due to concurrency issues with %d workers", len(queries), qualifier, workers
+            )
+            time.sleep(random.uniform(0.5, 1.5) * 2**attempt)
+            cnt, queries = _execute_concurrently(
+                cr,
+                queries,
+                min(workers, len(queries)),
+                logger,
+                qualifier,
+                jitter=0.1 * 2**attempt,
+                attempt=attempt + 1,
+            )
+            tot_cnt += cnt
+
+        if queries:
+            conflicts.update(_query_label(q) for q in queries)
             logger.warning("Serialize queries that failed due to concurrency issues")
-            tot_cnt += _parallel_execute_serial(cr, failed_queries, logger=logger)
+            tot_cnt += _parallel_execute_serial(
+                cr, queries, logger=logger, qualifier=qualifier, attempt=CONCURRENCY_RETRIES + 1
+            )
             cr.commit()
 
+        logger.warning(
+            "%d %s failed due to concurrency issues:\n%s",
+            len(conflicts),
+            qualifier,
+            "\n".join(" - {} ({} conflicts)".format(label, n) for label, n in conflicts.most_common()),
+        )
+        return tot_cnt
+
+    def _parallel_execute_threaded(cr, queries, logger=_logger, qualifier="queries"):
+        if not queries:
+            return None
+
+        if len(queries) == 1:
+            # No need to spawn other threads
+            return _execute_query(cr, queries[0], qualifier)
+
+        max_workers = min(_probe_max_workers(cr), len(queries))
+        cr.commit()
+
+        tot_cnt, failed_queries = _execute_concurrently(cr, queries, max_workers, logger, qualifier)
+        if failed_queries:
+            tot_cnt += _retry_concurrency_failures(cr, failed_queries, logger, qualifier)
+
+        logger.debug(
+            "Worker cursors: %(created)d created, %(reused)d reused, %(discarded)d discarded", _worker_cursors.stats
+        )
         return tot_cnt
 
 else:
     _parallel_execute_threaded = _parallel_execute_serial
 
 
+def _parallel_execute_impl():
+    return (
+        _parallel_execute_serial
+        if getattr(threading.current_thread(), "testing", False)
+        or (odoo_module is not None and getattr(odoo_module, "current_test", False))
+        else _parallel_execute_threaded
+    )
+
+
 def parallel_execute(cr, queries, logger=_logger, qualifier="queries"):
     """
     Execute queries in parallel.
@@ -179,15 +782,12 @@ def parallel_execute(cr, queries, logger=_logger, qualifier="queries"):
        - As a side effect, the cursor will be committed.
 
     .. note::
-       If a concurrency issue occurs, the *failing* queries will be retried sequentially.
+       If a concurrency issue occurs, the *failing* queries are retried with less workers
+       after a random delay, up to `CONCURRENCY_RETRIES` times (3 by default). Queries
+       produced by :func:`~odoo.upgrade.util.pg.explode_query_range` are split in smaller
+       ones on each retry. The remaining failing queries are then retried sequentially.
     """
-    parallel_execute_impl = (
-        _parallel_execute_serial
-        if getattr(threading.current_thread(), "testing", False)
-        or (odoo_module is not None and getattr(odoo_module, "current_test", False))
-        else _parallel_execute_threaded
-    )
-    return parallel_execute_impl(cr, queries, logger=_logger, qualifier=qualifier)
+    return _parallel_execute_impl()(cr, queries, logger=_logger, qualifier=qualifier)
 
 
 def format_query(cr, query, *args, **kwargs):
@@ -299,24 +899,110 @@ def explode_query(cr, query, alias=None, num_buckets=8, prefix=None):
     return [cr.mogrify(query, [num_buckets, index]).decode() for index in range(num_buckets)]
 
 
-def explode_query_range(cr, query, table, alias=None, bucket_size=DEFAULT_BUCKET_SIZE, prefix=None):
+class _BucketQuery(unicode):
     """
-    Explode a query to multiple queries that can be executed in parallel.
+    Query restricted to a range of ids.
 
-    Use between strategy to separate queries in buckets
+    It is the query string itself, but also remembers its bounds and the template it was
+    built from, so it can be rebuilt for another range. When set, `statement` holds the
+    name and the body of the prepared statement equivalent to the template.
 
     :meta private: exclude from online docs
     """
-    if prefix is not None:
-        if alias is not None:
-            raise ValueError("Cannot use both `alias` and deprecated `prefix` arguments.")
-        _logger.getChild("explode_query_range").warning(
-            "The `prefix` argument is deprecated. Use the `alias` argument instead."
-        )
-        alias = prefix.rstrip(".")
 
-    alias = alias or table
+    unit = "ids"
+    preparable = True
+
+    def __new__(cls, cr, template, lower, upper):
+        query = cr.mogrify(template, {"lower-bound": lower, "upper-bound": upper}).decode()
+        self = super(_BucketQuery, cls).__new__(cls, query)
+        self.template = template
+        self.lower = lower
+        self.upper = upper
+        self.after = self.fingerprint = self.statement = None
+        return self
+
+    def restrict(self, cr, lower, upper):
+        query = type(self)(cr, self.template, lower, upper)
+        query.statement = self.statement
+        return _checkpointed(cr, query, self.fingerprint) if self.fingerprint else query
+
+
+class _CtidBucketQuery(_BucketQuery):
+    """
+    Query restricted to a range of pages of the table.
+
+    :meta private: exclude from online docs
+    """
+
+    unit = "pages"
+    # the bounds are inside `tid` literals, they cannot be parameters
+    preparable = False
+
+
+def _bucket_statement(cr, template, lower, upper):
+    """
+    Return the name and the body of the prepared statement for a bucket query template.
+
+    The bounds become the parameters of the statement, which is then planned once per
+    connection. After a few executions, PostgreSQL may switch to a generic plan, built
+    without knowing the bounds. When the estimated cost of the generic plan exceeds the
+    cost of the plan for the given bounds by more than `GENERIC_PLAN_TOLERANCE`, return
+    `None` so literal queries are used instead.
 
+    :meta private: exclude from online docs
+    """
+    if re.search(r"\$\d", template):
+        return None
+    body = template % {"lower-bound": "$1", "upper-bound": "$2"}
+    name = "_upgrade_bucket_{}".format(hashlib.sha1(body.encode("utf-8")).hexdigest()[:16])
+    if cr._cnx.server_version < 120000:
+        # no `plan_cache_mode` to compare the plans, rely on the choice of the server
+        return name, body
+
+    cr.execute("SELECT current_setting('plan_cache_mode')")
+    (plan_cache_mode,) = cr.fetchone()
+    costs = []
+    prepared = False
+    try:
+        with savepoint(cr):
+            cr.execute("PREPARE {} AS {}".format(name, body))
+            prepared = True
+            for mode in ["force_custom_plan", "force_generic_plan"]:
+                cr.execute("SELECT set_config('plan_cache_mode', %s, true)", [mode])
+                cr.execute("EXPLAIN (FORMAT JSON) EXECUTE {}(%s, %s)".format(name), [lower, upper])
+                plan = cr.fetchone()[0]
+                if not isinstance(plan, list):
+                    plan = json.loads(plan)
+                costs.append(plan[0]["Plan"]["Total Cost"])
+    except psycopg2.Error:
+        _logger.debug("Cannot prepare the statement of the bucket query %s", body, exc_info=True)
+    finally:
+        # prepared statements are not transactional, they survive the rollback of the savepoint
+        if prepared:
+            cr.execute("DEALLOCATE {}".format(name))
+        cr.execute("SELECT set_config('plan_cache_mode', %s, true)", [plan_cache_mode])
+
+    if len(costs) != 2:
+        return None
+    custom, generic = costs
+    if generic > GENERIC_PLAN_TOLERANCE * max(custom, 1):
+        _logger.debug("Generic plan of the bucket query too costly (%s > %s), use literal queries", generic, custom)
+        return None
+    return name, body
+
+
+def _prepare_bucket_queries(cr, queries):
+    statements = {}
+    for query in queries:
+        if isinstance(query, _BucketQuery) and query.preparable:
+            if query.template not in statements:
+                statements[query.template] = _bucket_statement(cr, query.template, query.lower, query.upper)
+            query.statement = statements[query.template]
+    return queries
+
+
+def _ensure_parallel_filter(query):
     if "{parallel_filter}" not in query:
         if re.search(r"\bOR\b", query, re.I):
             _logger.getChild("explode_query_range").warning(
@@ -324,79 +1010,643 @@ def explode_query_range(cr, query, table, alias=None, bucket_size=DEFAULT_BUCKET
             )
         sep_kw = " AND " if re.search(r"\sWHERE\s", query, re.M | re.I) else " WHERE "
         query += sep_kw + "{parallel_filter}"
+    return query
 
-    cr.execute(format_query(cr, "SELECT min(id), max(id) FROM {}", table))
-    min_id, max_id = cr.fetchone()
-    if min_id is None:
-        # empty table
-        if on_CI():
-            # Even if there are any records, return one query to be executed to validate its correctness and avoid
-            # scripts that pass the CI but fail in production.
-            parallel_filter = "{alias}.id IS NOT NULL".format(alias=alias)
-            return [_explode_format(query, parallel_filter=parallel_filter)]
-        else:
-            return []
-
-    count = (max_id + 1 - min_id) // bucket_size
-    if count > MAX_BUCKETS:
-        _logger.getChild("explode_query_range").warning(
-            "High number of queries generated (%s); switching to a precise bucketing strategy", count
-        )
-        cr.execute(
-            format_query(
-                cr,
-                """
-                WITH t AS (
-                    SELECT id,
-                           mod(row_number() OVER(ORDER BY id) - 1, %s) AS g
-                      FROM {table}
-                     ORDER BY id
-                ) SELECT array_agg(id ORDER BY id) FILTER (WHERE g=0),
-                         min(id),
-                         max(id)
-                    FROM t
-                """,
-                table=table,
-            ),
-            [bucket_size],
-        )
-        ids, min_id, max_id = cr.fetchone()
-    else:
-        ids = list(range(min_id, max_id + 1, bucket_size))
 
-    assert min_id == ids[0] and max_id + 1 != ids[-1]  # sanity checks
-    ids.append(max_id + 1)  # ensure last bucket covers whole range
-    # `ids` holds a list of values marking the interval boundaries for all buckets
+def _explode_bounds_from_range(cr, table, bucket_size, min_id, max_id, only=False):
+    """
+    Compute the boundaries of buckets spanning `bucket_size` ids.
 
-    if (max_id - min_id + 1) <= 1.1 * bucket_size or (len(ids) == 3 and ids[2] - ids[1] <= 0.1 * bucket_size):
-        # If we return one query `parallel_execute` skip spawning new threads. Thus we return only one query if we have
-        # only two buckets and the second would have at most 10% of bucket_size records.
-        # Still, since the query may only be valid if there is no split, we force the usage of `prefix` in the query to
-        # validate its correctness and avoid scripts that pass the CI but fail in production.
-        parallel_filter = "{alias}.id IS NOT NULL".format(alias=alias)
-        return [_explode_format(query, parallel_filter=parallel_filter)]
+    With `only`, the rows of the inheritance children of `table` are ignored.
 
-    parallel_filter = "{alias}.id BETWEEN %(lower-bound)s AND %(upper-bound)s".format(alias=alias)
-    query = _explode_format(query.replace("%", "%%"), parallel_filter=parallel_filter)
+    :meta private: exclude from online docs
+    """
+    count = (max_id + 1 - min_id) // bucket_size
+    if count <= MAX_BUCKETS:
+        return list(range(min_id, max_id + 1, bucket_size))
 
-    return [
-        cr.mogrify(query, {"lower-bound": ids[i], "upper-bound": ids[i + 1] - 1}).decode() for i in range(len(ids) - 1)
-    ]
+    _logger.getChild("explode_query_range").warning(
+        "High number of queries generated (%s); switching to a precise bucketing strategy", count
+    )
+    cr.execute(
+        format_query(
+            cr,
+            """
+            WITH t AS (
+                SELECT id,
+                       mod(row_number() OVER(ORDER BY id) - 1, %s) AS g
+                  FROM {only} {table}
+                 ORDER BY id
+            ) SELECT array_agg(id ORDER BY id) FILTER (WHERE g=0)
+                FROM t
+            """,
+            only=SQLStr("ONLY" if only else ""),
+            table=table,
+        ),
+        [bucket_size],
+    )
+    return cr.fetchone()[0]
 
 
-def explode_execute(cr, query, table, alias=None, bucket_size=DEFAULT_BUCKET_SIZE, logger=_logger, qualifier="queries"):
+def _explode_bounds_from_stats(cr, table, bucket_size, min_id, max_id, sample=False, only=False):
     """
-    Execute a query in parallel.
+    Compute the boundaries of buckets holding roughly `bucket_size` rows.
 
-    The query is split by buckets of ids, then processed in parallel by workers. If the
-    query does not include the special `{parallel_filter}` value, it is added to the last
-    `WHERE` clause, possibly also adding it if none found. When the query already has the
-    filter nothing is done. The filter always expands to the splitting strategy. The split
-    is done into buckets where no more than `bucket_size` IDs are updated on each
-    individual query.
+    The histogram of the `id` column splits the table in ranges holding the same number of
+    rows. Interpolating inside those ranges gives boundaries following the real distribution
+    of the ids, gaps included, without scanning the table. When `sample` is set, the
+    boundaries are picked from a `TABLESAMPLE` of the table instead. With `only`, the rows
+    of the inheritance children of `table` are ignored.
 
-    .. example::
-       .. code-block:: python
+    Return `None` when no statistics are available.
+
+    :meta private: exclude from online docs
+    """
+    query = """
+        SELECT c.reltuples, s.histogram_bounds::text::bigint[]
+          FROM pg_class c
+     LEFT JOIN pg_stats s
+            ON s.schemaname = current_schema()
+           AND s.tablename = c.relname
+           AND s.attname = 'id'
+           AND NOT s.inherited
+         WHERE c.oid = %s::regclass
+    """
+    cr.execute(query, [table])
+    reltuples, bounds = cr.fetchone()
+    if reltuples <= 0 or not bounds:
+        # never analyzed; sampling the `id` column alone is cheap
+        cr.execute(format_query(cr, "ANALYZE {}(id)", table))
+        cr.execute(query, [table])
+        reltuples, bounds = cr.fetchone()
+        if reltuples <= 0 or not bounds:
+            return None
+
+    nb_buckets = min(MAX_BUCKETS, max(1, int(reltuples // bucket_size)))
+    if nb_buckets == 1:
+        return [min_id]
+
+    if sample and cr._cnx.server_version >= 90500:
+        # aim for ~20 sampled ids per bucket; SYSTEM sampling only reads the sampled pages
+        percent = min(100.0, 100.0 * 20 * nb_buckets / reltuples)
+        cr.execute(
+            format_query(
+                cr,
+                "SELECT id FROM {} {} TABLESAMPLE SYSTEM (%s) ORDER BY id",
+                SQLStr("ONLY" if only else ""),
+                table,
+            ),
+            [percent],
+        )
+        sampled = [id_ for (id_,) in cr.fetchall()]
+        if len(sampled) >= nb_buckets:
+            step = float(len(sampled)) / nb_buckets
+            ids = [min_id] + [sampled[int(i * step)] for i in range(1, nb_buckets)]
+            return sorted(i for i in set(ids) if min_id <= i <= max_id)
+        # sample too small to be meaningful, use the histogram
+
+    # knots of the cumulative distribution: (id, number of rows with a lower id)
+    per_bin = float(reltuples) / (len(bounds) - 1)
+    density = float(reltuples) / max(1, bounds[-1] - bounds[0])
+    knots = [(b, i * per_bin) for i, b in enumerate(bounds)]
+    if min_id < knots[0][0]:
+        # stale statistics; assume the average density outside of the histogram
+        knots = [(min_id, -(knots[0][0] - min_id) * density)] + knots
+    if max_id + 1 > knots[-1][0]:
+        knots.append((max_id + 1, knots[-1][1] + (max_id + 1 - knots[-1][0]) * density))
+    origin, total = knots[0][1], knots[-1][1]
+    step = (total - origin) / nb_buckets
+
+    ids = [min_id]
+    k = 0
+    for i in range(1, nb_buckets):
+        target = origin + i * step
+        while knots[k + 1][1] < target:
+            k += 1
+        (lo_id, lo_cnt), (hi_id, hi_cnt) = knots[k], knots[k + 1]
+        boundary = int(lo_id + (hi_id - lo_id) * (target - lo_cnt) / max(hi_cnt - lo_cnt, 1e-9))
+        if ids[-1] < boundary <= max_id:
+            ids.append(boundary)
+    return ids
+
+
+def _explode_query_ctid(cr, query, table, alias, bucket_size, restrict=""):
+    """
+    Explode a query on a table without `id` column by ranges of pages.
+
+    The pages are read by TID range scans, only available since PostgreSQL 14; on older
+    versions a single query is returned. Updated rows get a new `ctid`, possibly in a page
+    handled by another bucket, so the buckets ignore the row versions created after the
+    split. The cursor is committed, then their `xmin` is compared with the `xmax` of the
+    current snapshot: all the transactions and subtransactions that wrote the rows to
+    process are below it. This requires each query to run in its own transaction, as done
+    by the threaded `parallel_execute`; a single query is returned when the queries would be
+    executed serially.
+
+    :meta private: exclude from online docs
+    """
+    cr.execute(
+        """
+        SELECT pg_relation_size(oid) / current_setting('block_size')::int, relpages, reltuples
+          FROM pg_class
+         WHERE oid = %s::regclass
+        """,
+        [table],
+    )
+    pages, relpages, reltuples = cr.fetchone()
+    if pages and (relpages <= 0 or reltuples <= 0):
+        # never analyzed
+        cr.execute(format_query(cr, "ANALYZE {}", table))
+        cr.execute("SELECT relpages, reltuples FROM pg_class WHERE oid = %s::regclass", [table])
+        relpages, reltuples = cr.fetchone()
+
+    rows_per_page = max(float(reltuples) / relpages, 1.0) if relpages > 0 and reltuples > 0 else 1.0
+    pages_per_bucket = max(int(bucket_size / rows_per_page), 1)
+
+    if (
+        not pages
+        or pages <= 1.1 * pages_per_bucket
+        or cr._cnx.server_version < 140000
+        or _parallel_execute_impl() is _parallel_execute_serial
+    ):
+        if not pages and not on_CI():
+            return []
+        parallel_filter = "{restrict}{alias}.ctid IS NOT NULL".format(restrict=restrict, alias=alias)
+        return [_explode_format(query, parallel_filter=parallel_filter)]
+
+    # the xids of the savepoints of the current transaction are only below the xmax of the
+    # snapshots once it is committed
+    cr.commit()
+    cr.execute("SELECT pg_snapshot_xmax(pg_current_snapshot())::text::bigint % (2^32)::bigint")
+    (xmax,) = cr.fetchone()
+    parallel_filter = (
+        "{restrict}{alias}.ctid BETWEEN '(%(lower-bound)s,0)'::tid AND '(%(upper-bound)s,65535)'::tid"
+        " AND age({alias}.xmin) > age('{xmax}'::xid)"
+    ).format(restrict=restrict, alias=alias, xmax=xmax)
+    query = _explode_format(query.replace("%", "%%"), parallel_filter=parallel_filter)
+
+    return [
+        _CtidBucketQuery(cr, query, lower, min(lower + pages_per_bucket, pages) - 1)
+        for lower in range(0, pages, pages_per_bucket)
+    ]
+
+
+def explode_query_range(
+    cr, query, table, alias=None, bucket_size=DEFAULT_BUCKET_SIZE, prefix=None, planner=DEFAULT_EXPLODE_PLANNER
+):
+    """
+    Explode a query to multiple queries that can be executed in parallel.
+
+    Use between strategy to separate queries in buckets. The boundaries of the buckets are
+    determined by the `planner`:
+
+    - *range*: split the `[min(id), max(id)]` range in equal parts, switching to a precise
+      (but costly) scan of the ids when there are too many of them.
+    - *stats*: split the ids in buckets holding the same number of rows, according to the
+      PostgreSQL statistics of the table. Best suited for tables with big gaps in their ids.
+    - *sample*: as *stats*, but the distribution of the ids is read from a `TABLESAMPLE`.
+
+    Tables without `id` column, like the ones of many2many fields, are split by ranges of
+    pages instead, whatever the `planner`. In this case, the cursor is committed when the
+    query is split.
+
+    The rows of partitioned tables, or tables with inheritance children, are split per
+    partition. Partitions excluded by the query predicates are skipped, and the buckets of
+    the different partitions are interleaved so concurrent workers spread over them. The
+    query must not move rows between partitions, they could be processed twice.
+
+    :meta private: exclude from online docs
+    """
+    if planner not in EXPLODE_PLANNERS:
+        raise ValueError("Invalid planner {!r}".format(planner))
+
+    if prefix is not None:
+        if alias is not None:
+            raise ValueError("Cannot use both `alias` and deprecated `prefix` arguments.")
+        _logger.getChild("explode_query_range").warning(
+            "The `prefix` argument is deprecated. Use the `alias` argument instead."
+        )
+        alias = prefix.rstrip(".")
+
+    return _explode_query_range(cr, query, table, alias, bucket_size, planner)
+
+
+def _explode_partitions(cr, query, table):
+    """
+    Return the oid and name of the partitions of `table` that the `query` may read.
+
+    The partitions are the tables holding the rows of `table` and of its inheritance
+    children, recursively. Return `None` when `table` has no children.
+
+    :meta private: exclude from online docs
+    """
+    cr.execute(
+        """
+        WITH RECURSIVE tree AS (
+            SELECT %s::regclass::oid AS oid
+             UNION
+            SELECT i.inhrelid
+              FROM pg_inherits i
+              JOIN tree
+                ON i.inhparent = tree.oid
+        )
+        SELECT c.oid, c.relname
+          FROM tree
+          JOIN pg_class c
+            ON c.oid = tree.oid
+         WHERE c.relkind = 'r'
+         ORDER BY c.relname
+        """,
+        [table],
+    )
+    partitions = cr.fetchall()
+    if [name for _, name in partitions] in ([], [table]):
+        return None
+
+    # skip the partitions pruned by the planner; the literal `%` are escaped in the query
+    explain = "EXPLAIN (FORMAT JSON, VERBOSE) " + _explode_format(query, parallel_filter="true").replace("%%", "%")
+    try:
+        with savepoint(cr):
+            cr.execute(explain)
+            plan = cr.fetchone()[0]
+    except psycopg2.Error:
+        _logger.debug("Cannot prune the partitions of %r for query %s", table, query, exc_info=True)
+        return partitions
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+
+    scanned = set()
+    nodes = [node["Plan"] for node in plan]
+    while nodes:
+        node = nodes.pop()
+        if "Relation Name" in node:
+            scanned.add((node["Schema"], node["Relation Name"]))
+        nodes.extend(node.get("Plans", []))
+    if not scanned:
+        return []
+    schemas, names = zip(*scanned)
+    cr.execute(
+        "SELECT to_regclass(format('%%I.%%I', s, n))::oid FROM unnest(%s::text[], %s::text[]) AS x(s, n)",
+        [list(schemas), list(names)],
+    )
+    scanned_oids = {oid for (oid,) in cr.fetchall()}
+    return [(oid, name) for oid, name in partitions if oid in scanned_oids]
+
+
+def _explode_query_range(cr, query, table, alias, bucket_size, planner, partitioned=True):
+    alias = alias or table
+    query = _ensure_parallel_filter(query)
+
+    partitions = _explode_partitions(cr, query, table) if partitioned else None
+    if partitions is None:
+        return _explode_query_table(cr, query, table, alias, bucket_size, planner)
+
+    buckets = []
+    for j, (oid, name) in enumerate(partitions):
+        restrict = "{alias}.tableoid = {oid} AND ".format(alias=alias, oid=oid)
+        queries = _explode_query_table(cr, query, name, alias, bucket_size, planner, restrict)
+        buckets.extend((i, j, q) for i, q in enumerate(queries))
+    # interleave the buckets of the partitions
+    return [q for _, _, q in sorted(buckets, key=lambda b: b[:2])]
+
+
+def _explode_query_table(cr, query, table, alias, bucket_size, planner, restrict=""):
+    if not column_exists(cr, table, "id"):
+        return _explode_query_ctid(cr, query, table, alias, bucket_size, restrict)
+
+    # when restricted to a partition, ignore the rows of its own children
+    only = bool(restrict)
+    cr.execute(format_query(cr, "SELECT min(id), max(id) FROM {} {}", SQLStr("ONLY" if only else ""), table))
+    min_id, max_id = cr.fetchone()
+    if min_id is None:
+        # empty table
+        if on_CI():
+            # Even if there are any records, return one query to be executed to validate its correctness and avoid
+            # scripts that pass the CI but fail in production.
+            parallel_filter = "{restrict}{alias}.id IS NOT NULL".format(restrict=restrict, alias=alias)
+            return [_explode_format(query, parallel_filter=parallel_filter)]
+        else:
+            return []
+
+    ids = None
+    if planner != "range":
+        ids = _explode_bounds_from_stats(cr, table, bucket_size, min_id, max_id, sample=planner == "sample", only=only)
+    if ids is None:
+        ids = _explode_bounds_from_range(cr, table, bucket_size, min_id, max_id, only=only)
+
+    assert min_id == ids[0] and max_id + 1 != ids[-1]  # sanity checks
+    ids.append(max_id + 1)  # ensure last bucket covers whole range
+    # `ids` holds a list of values marking the interval boundaries for all buckets
+
+    if (max_id - min_id + 1) <= 1.1 * bucket_size or (len(ids) == 3 and ids[2] - ids[1] <= 0.1 * bucket_size):
+        # If we return one query `parallel_execute` skip spawning new threads. Thus we return only one query if we have
+        # only two buckets and the second would have at most 10% of bucket_size records.
+        # Still, since the query may only be valid if there is no split, we force the usage of `prefix` in the query to
+        # validate its correctness and avoid scripts that pass the CI but fail in production.
+        parallel_filter = "{restrict}{alias}.id IS NOT NULL".format(restrict=restrict, alias=alias)
+        return [_explode_format(query, parallel_filter=parallel_filter)]
+
+    parallel_filter = "{restrict}{alias}.id BETWEEN %(lower-bound)s AND %(upper-bound)s".format(
+        restrict=restrict, alias=alias
+    )
+    query = _explode_format(query.replace("%", "%%"), parallel_filter=parallel_filter)
+
+    return [_BucketQuery(cr, query, ids[i], ids[i + 1] - 1) for i in range(len(ids) - 1)]
+
+
+_CHECKPOINTS_TABLE = "_upgrade_explode_checkpoints"
+
+
+def _subtract_ranges(ranges, removed):
+    """
+    Return the parts of the (inclusive) `ranges` not covered by the `removed` ones.
+
+    :meta private: exclude from online docs
+    """
+    removed = sorted(removed)
+    result = []
+    for lower, upper in ranges:
+        start = lower
+        for r_lower, r_upper in removed:
+            if r_upper < start or r_lower > upper:
+                continue
+            if r_lower > start:
+                result.append((start, r_lower - 1))
+            start = max(start, r_upper + 1)
+            if start > upper:
+                break
+        if start <= upper:
+            result.append((start, upper))
+    return result
+
+
+def _explode_checkpoints(cr, table, query):
+    """
+    Return the fingerprint of an exploded query and the ranges already processed.
+
+    :meta private: exclude from online docs
+    """
+    fingerprint = hashlib.sha256("{}\0{}".format(table, query).encode("utf-8")).hexdigest()
+    cr.execute(
+        format_query(
+            cr,
+            """
+            CREATE TABLE IF NOT EXISTS {}(
+                fingerprint varchar NOT NULL,
+                lower_bound bigint NOT NULL,
+                upper_bound bigint NOT NULL,
+                PRIMARY KEY (fingerprint, lower_bound)
+            )
+            """,
+            _CHECKPOINTS_TABLE,
+        )
+    )
+    cr.execute(
+        format_query(cr, "SELECT lower_bound, upper_bound FROM {} WHERE fingerprint = %s", _CHECKPOINTS_TABLE),
+        [fingerprint],
+    )
+    return fingerprint, cr.fetchall()
+
+
+def _resume_queries(cr, queries, fingerprint, done):
+    result = []
+    for query in queries:
+        if not isinstance(query, _BucketQuery):
+            # not split, nothing to resume
+            result.append(query)
+            continue
+        _checkpointed(cr, query, fingerprint)
+        result.extend(
+            query.restrict(cr, lower, upper) for lower, upper in _subtract_ranges([(query.lower, query.upper)], done)
+        )
+    return result
+
+
+def _checkpointed(cr, query, fingerprint):
+    query.fingerprint = fingerprint
+    query.after = cr.mogrify(
+        format_query(
+            cr, "INSERT INTO {}(fingerprint, lower_bound, upper_bound) VALUES (%s, %s, %s)", _CHECKPOINTS_TABLE
+        ),
+        [fingerprint, query.lower, query.upper],
+    ).decode()
+    return query
+
+
+class _RangeScheduler(object):
+    """
+    Hand out ranges of ids on demand.
+
+    The width of the ranges adapts to the time taken to process the previous ones: it is
+    halved when a range exceeds the time budget, and doubled when ranges are processed much
+    faster. Near the end, ranges are narrowed so the remaining work is spread over all the
+    workers.
+
+    :meta private: exclude from online docs
+    """
+
+    def __init__(self, intervals, step, workers, time_budget):
+        self._remaining = collections.deque(intervals)
+        self._remaining_span = sum(upper - lower + 1 for lower, upper in intervals)
+        self.total_span = self._remaining_span
+        self._workers = workers
+        self._time_budget = time_budget
+        self._step = step
+        self._min_step = max(1, step // 16)
+        self._max_step = step * 16
+        self._lock = threading.Lock()
+        self.done_span = 0
+        self.nb_ranges = 0
+
+    def next_range(self):
+        with self._lock:
+            if not self._remaining:
+                return None
+            lower, upper = self._remaining[0]
+            step = min(self._step, max(self._min_step, self._remaining_span // self._workers))
+            if upper - lower + 1 <= step:
+                self._remaining.popleft()
+            else:
+                upper = lower + step - 1
+                self._remaining[0] = (upper + 1, self._remaining[0][1])
+            self._remaining_span -= upper - lower + 1
+            return lower, upper
+
+    def done(self, lower, upper, duration):
+        with self._lock:
+            self.done_span += upper - lower + 1
+            self.nb_ranges += 1
+            if duration > self._time_budget:
+                self._step = max(self._min_step, self._step // 2)
+            elif duration < self._time_budget / 4:
+                self._step = min(self._max_step, self._step * 2)
+
+    def abort(self):
+        with self._lock:
+            self._remaining.clear()
+            self._remaining_span = 0
+
+
+def _explode_execute_dynamic(
+    cr, query, table, alias, bucket_size, logger, qualifier, intervals, fingerprint=None, prepare=False
+):
+    if not intervals:
+        return 0
+    workers = _probe_max_workers(cr)
+    limiter = _concurrency_limiter(workers)
+    scheduler = _RangeScheduler(intervals, bucket_size, workers, DEFAULT_BUCKET_TIME_BUDGET)
+    parallel_filter = "{alias}.id BETWEEN %(lower-bound)s AND %(upper-bound)s".format(alias=alias or table)
+    template = _explode_format(_ensure_parallel_filter(query).replace("%", "%%"), parallel_filter=parallel_filter)
+    failed_ranges = []
+    lower = intervals[0][0]
+    statement = _bucket_statement(cr, template, lower, lower + bucket_size - 1) if prepare else None
+
+    def bucket_query(cr, bounds):
+        query = _BucketQuery(cr, template, *bounds)
+        query.statement = statement
+        return _checkpointed(cr, query, fingerprint) if fingerprint else query
+
+    def work():
+        cnt = 0
+        while True:
+            with limiter.slot():
+                bounds = scheduler.next_range()
+                if bounds is None:
+                    return cnt
+                t0 = time.time()
+                try:
+                    with _worker_cursors.cursor(cr.dbname) as tcr:
+                        cnt += _execute_query(tcr, bucket_query(tcr, bounds), qualifier)
+                except psycopg2.OperationalError as exc:
+                    if exc.pgcode not in CONCURRENCY_ERRORCODES:
+                        scheduler.abort()
+                        raise
+                    failed_ranges.append(bounds)
+                except Exception:
+                    scheduler.abort()
+                    raise
+                scheduler.done(bounds[0], bounds[1], time.time() - t0)
+
+    cr.commit()
+    tot_cnt = 0
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(work) for _ in range(workers)]
+        not_done = futures
+        while not_done:
+            _, not_done = concurrent.futures.wait(not_done, timeout=60)
+            if not_done:
+                logger.info(
+                    "[%6.02f%%] %d %s processed in %ds",
+                    100.0 * scheduler.done_span / scheduler.total_span,
+                    scheduler.nb_ranges,
+                    qualifier,
+                    time.time() - t0,
+                )
+        for future in futures:
+            tot_cnt += future.result() or 0
+
+    if failed_ranges:
+        queries = [bucket_query(cr, bounds) for bounds in failed_ranges]
+        tot_cnt += _retry_concurrency_failures(cr, queries, logger, qualifier)
+
+    return tot_cnt
+
+
+# per database, several can be upgraded by the same process
+_modified_rows = collections.defaultdict(collections.Counter)
+
+
+def _track_modified_rows(cr, table, rowcount):
+    if rowcount and rowcount > 0:
+        _modified_rows[cr.dbname][table] += rowcount
+
+
+def _stale_tables(cr, tables, scale_factor=ANALYZE_SCALE_FACTOR):
+    # like autovacuum, a table is stale once the modified rows exceed a fraction of its size
+    cr.execute(
+        "SELECT relname, greatest(reltuples, 0) FROM pg_class WHERE relname = ANY(%s) AND relkind IN ('r', 'p', 'm')",
+        [list(tables)],
+    )
+    return sorted(
+        table
+        for table, reltuples in cr.fetchall()
+        if _modified_rows[cr.dbname][table] > ANALYZE_THRESHOLD + scale_factor * reltuples
+    )
+
+
+def analyze_modified_tables(cr, vacuum=False, logger=_logger):
+    """
+    Refresh the statistics of the tables heavily modified through the util helpers.
+
+    The rows modified by :func:`explode_execute` and :func:`remove_records` (and the
+    helpers using them) are counted per database and table. Tables whose count exceeds
+    `ANALYZE_THRESHOLD` (10000) plus `ANALYZE_SCALE_FACTOR` (0.1) times their number of
+    rows are analyzed in parallel. Stale tables are also analyzed before being processed
+    again by :func:`explode_execute`.
+
+    Call it at the end of an upgrade script rewriting big tables so the following scripts
+    get sensible query plans.
+
+    :param bool vacuum: whether to also `VACUUM` the tables whose modified rows exceed
+                        `VACUUM_SCALE_FACTOR` (0.2) times their number of rows. It commits
+                        the cursor.
+    :param logger: logger used to report the progress
+    :type logger: :class:`logging.Logger`
+    :return: the names of the tables analyzed
+    :rtype: list(str)
+    """
+    tables = _stale_tables(cr, list(_modified_rows[cr.dbname]))
+    if not tables:
+        return []
+    to_vacuum = _stale_tables(cr, tables, VACUUM_SCALE_FACTOR) if vacuum else []
+    logger.info("Analyze %d modified tables: %s", len(tables), ", ".join(tables))
+    parallel_execute(
+        cr,
+        [format_query(cr, "ANALYZE {}", table) for table in tables if table not in to_vacuum],
+        logger=logger,
+        qualifier="tables",
+    )
+    if to_vacuum:
+        # VACUUM cannot run inside a transaction
+        cr.commit()
+        with db_connect(cr.dbname).cursor() as vcr:
+            vcr._cnx.autocommit = True
+            try:
+                for table in to_vacuum:
+                    vcr.execute(format_query(cr, "VACUUM (ANALYZE) {}", table))
+            finally:
+                vcr._cnx.autocommit = False
+    for table in tables:
+        del _modified_rows[cr.dbname][table]
+    return tables
+
+
+def explode_execute(
+    cr,
+    query,
+    table,
+    alias=None,
+    bucket_size=DEFAULT_BUCKET_SIZE,
+    logger=_logger,
+    qualifier="queries",
+    planner=DEFAULT_EXPLODE_PLANNER,
+    dynamic=False,
+    checkpoint=False,
+    prepare=PREPARE_BUCKET_QUERIES,
+):
+    """
+    Execute a query in parallel.
+
+    The query is split by buckets of ids, then processed in parallel by workers. If the
+    query does not include the special `{parallel_filter}` value, it is added to the last
+    `WHERE` clause, possibly also adding it if none found. When the query already has the
+    filter nothing is done. The filter always expands to the splitting strategy. The split
+    is done into buckets where no more than `bucket_size` IDs are updated on each
+    individual query.
+
+    .. example::
+       .. code-block:: python
 
           util.explode_execute(
               cr,
@@ -417,6 +1667,29 @@ def explode_execute(cr, query, table, alias=None, bucket_size=DEFAULT_BUCKET_SIZ
     :param logger: logger used to report the progress
     :type logger: :class:`logging.Logger`
     :param str qualifier: qualifier of the queries. Used in the progression log
+    :param str planner: how the bucket boundaries are determined, one of `range`,
+                        `stats` or `sample`. `stats` and `sample` use the table statistics
+                        to get buckets with the same number of rows, which balances the
+                        work when there are big gaps in the ids. The default can be set
+                        via the `EXPLODE_PLANNER` environment variable.
+    :param bool dynamic: hand out ranges of ids to the workers on demand instead of
+                         precomputing the buckets. The width of the ranges adapts to keep
+                         each query under `BUCKET_TIME_BUDGET` seconds (10 by default), so
+                         slow buckets don't leave the other workers idle. The `planner` is
+                         ignored in this mode.
+    :param bool checkpoint: record the ranges of ids processed by the committed queries.
+                            When the same query is executed again on the same table, after
+                            a crash for instance, the ranges already processed are skipped.
+                            The records are removed once the whole query is done. Not
+                            available on tables without `id` column.
+    :param bool prepare: prepare the statement of the buckets once per worker connection,
+                         then only pass the bounds of each bucket, to save parsing and
+                         planning them. Literal queries are kept when the generic plan of
+                         the statement is estimated too costly. Experimental, disabled by
+                         default: the gain has not been measured yet. It can be enabled
+                         via the `PREPARE_BUCKET_QUERIES` environment variable; compare
+                         the planning times recorded with `QUERY_TELEMETRY` with and
+                         without it.
     :return: the sum of `cr.rowcount` for each query run
     :rtype: int
 
@@ -426,98 +1699,506 @@ def explode_execute(cr, query, table, alias=None, bucket_size=DEFAULT_BUCKET_SIZ
        tables with self references due to the potential `ON DELETE` effects.
        For more details see :func:`~odoo.upgrade.util.pg.parallel_execute`.
     """
-    return parallel_execute(
-        cr,
-        explode_query_range(cr, query, table, alias=alias, bucket_size=bucket_size),
-        logger=logger,
-        qualifier=qualifier,
-    )
+    if _modified_rows[cr.dbname][table] and _stale_tables(cr, [table]):
+        cr.execute(format_query(cr, "ANALYZE {}", table))
+        del _modified_rows[cr.dbname][table]
+
+    has_id = column_exists(cr, table, "id")
+    if checkpoint and not has_id:
+        # the `ctid` of the rows change when updated, ranges of pages cannot be resumed
+        raise ValueError("Cannot checkpoint queries on table {!r} without `id` column".format(table))
+
+    fingerprint, done = _explode_checkpoints(cr, table, query) if checkpoint else (None, [])
+    if done:
+        logger.info("Resuming %s: %d ranges of ids already processed", qualifier, len(done))
+
+    result = None
+    if dynamic and has_id and ThreadPoolExecutor is not None and _parallel_execute_impl() is _parallel_execute_threaded:
+        cr.execute(format_query(cr, "SELECT min(id), max(id) FROM {}", table))
+        min_id, max_id = cr.fetchone()
+        # when too small to be worth spawning workers, let the static path handle it
+        if min_id is not None and max_id - min_id + 1 > 1.1 * bucket_size:
+            intervals = _subtract_ranges([(min_id, max_id)], done)
+            result = _explode_execute_dynamic(
+                cr, query, table, alias, bucket_size, logger, qualifier, intervals, fingerprint, prepare
+            )
+
+    if result is None:
+        # checkpoints record ranges of ids of the whole table, not per partition
+        queries = _explode_query_range(cr, query, table, alias, bucket_size, planner, partitioned=not checkpoint)
+        if checkpoint:
+            queries = _resume_queries(cr, queries, fingerprint, done)
+        if prepare:
+            queries = _prepare_bucket_queries(cr, queries)
+        result = parallel_execute(cr, queries, logger=logger, qualifier=qualifier)
+
+    if checkpoint:
+        cr.execute(format_query(cr, "DELETE FROM {} WHERE fingerprint = %s", _CHECKPOINTS_TABLE), [fingerprint])
+    _track_modified_rows(cr, table, result)
+    return result
+
+
+def _explode_execute_m2m(cr, query, table, alias):
+    """
+    Execute a query on a table without `id` column, split by ranges of pages when big.
+
+    Only tables estimated to hold more than `EXPLODE_M2M_THRESHOLD` rows (1M by default)
+    are processed by :func:`explode_execute`, which commits the cursor. Smaller tables are
+    updated by a single query, in the current transaction.
+
+    :meta private: exclude from online docs
+    """
+    cr.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [table])
+    [reltuples] = cr.fetchone()
+    if reltuples > EXPLODE_M2M_THRESHOLD:
+        return explode_execute(cr, query, table=table, alias=alias)
+    cr.execute(_explode_format(_ensure_parallel_filter(query), parallel_filter="true"))
+    _track_modified_rows(cr, table, cr.rowcount)
+    return cr.rowcount
+
+
+def pg_array_uniq(a, drop_null=False):
+    dn = "WHERE x IS NOT NULL" if drop_null else ""
+    return SQLStr("ARRAY(SELECT x FROM unnest({0}) x {1} GROUP BY x)".format(a, dn))
+
+
+def pg_replace(s, replacements):
+    q = lambda s: psycopg2.extensions.QuotedString(s).getquoted().decode("utf-8")
+
+    def replace(s, r):
+        func = "regexp_replace({}, {}, {}, 'g')" if isinstance(r[0], PGRegexp) else "replace({}, {}, {})"
+        return func.format(s, q(r[0]), q(r[1]))
+
+    return SQLStr(reduce(replace, replacements, s))
+
+
+def pg_html_escape(s, quote=True):
+    """
+    Generate the SQL expression to HTML escape a string.
+
+    SQL version of `html.escape`.
+
+    :meta private: exclude from online docs
+    """
+    replacements = [
+        ("&", "&amp;"),  # Must be done first!
+        ("<", "&lt;"),
+        (">", "&gt;"),
+    ]
+    if quote:
+        replacements += [
+            ('"', "&quot;"),
+            ("'", "&#x27;"),
+        ]
+    return pg_replace(s, replacements)
+
+
+def pg_text2html(s, wrap="p"):
+    return SQLStr(
+        r"""
+        CASE WHEN TRIM(COALESCE({src}, '')) ~ '^<.+</\w+>$' THEN {src}
+             ELSE CONCAT(
+                '{opening_tag}',
+                replace(
+                    replace(REGEXP_REPLACE({esc},
+                                           -- regex from https://blog.codinghorror.com/the-problem-with-urls/
+                                           -- double the %% to allow this code chunk to be used in parameterized queries
+                                           'https?://[-A-Za-z0-9+&@#/%%?=~_()|!:,.;]*[-A-Za-z0-9+&@#/%%=~_()|]',
+                                           '<a href="\&" target="_blank" rel="noreferrer noopener">\&</a>',
+                                           'g'),
+                            E'\n',
+                            '<br>'),
+                    E'\t',
+                    '&Tab;'),
+                '{closing_tag}')
+         END
+        """.format(
+            opening_tag="<{}>".format(wrap) if wrap else "",
+            closing_tag="</{}>".format(wrap) if wrap else "",
+            src=s,
+            esc=pg_html_escape(s, quote=False),
+        )
+    )
+
+
+_JSONB_COLUMNS = {}
+if version_gte("17.0"):  # switched to jsonb in 16.0
+    _JSONB_COLUMNS[("ir_ui_view", "arch_db")] = True
+    _JSONB_COLUMNS[("ir_act_server", "name")] = True
+    _JSONB_COLUMNS[("ir_model", "name")] = True
+
+
+def get_value_or_en_translation(cr, table, column):
+    is_jsonb = (
+        _JSONB_COLUMNS[(table, column)]
+        if (table, column) in _JSONB_COLUMNS
+        else column_type(cr, table, column) == "jsonb"
+    )
+    fmt = "{}->>'en_US'" if is_jsonb else "{}"
+    return format_query(cr, fmt, column)
+
+
+_PG_SYSTEM_COLUMNS = frozenset(("tableoid", "xmin", "cmin", "xmax", "cmax", "ctid", "oid"))
+_schema_caches = {}
+
+
+class _SchemaCache(object):
+    """
+    Per cursor cache of the catalog metadata.
+
+    In `bulk` mode, the columns of the relations of the current schema and all foreign keys
+    are loaded at once on first use, other relations are loaded (and memoized) one by one on
+    demand. The :class:`DependencyGraph` is also loaded in bulk on first use.
+
+    Otherwise, only the columns of the relations are cached, loaded one relation at a time
+    on demand; foreign keys and indexes are queried on each call.
+
+    :meta private: exclude from online docs
+    """
+
+    def __init__(self, bulk=True):
+        self.bulk = bulk
+        self._relations = None
+        self._foreign_keys = None
+        self._graph = None
+        self.stats = collections.Counter()
+
+    def _load_relations(self, cr, table=None):
+        # -> dict[str, tuple[bool, dict[str, tuple[str, int | None, bool, bool]]]]
+        self.stats["loads"] += 1
+        if table is None:
+            where = sql.SQL(
+                "c.relnamespace = (SELECT oid FROM pg_namespace WHERE nspname = current_schema())"
+                " AND c.relkind IN ('r', 'p', 'v', 'm', 'f')"
+            )
+        else:
+            where = sql.SQL(
+                "c.relname = {}"
+                " AND c.relnamespace IN ((SELECT oid FROM pg_namespace WHERE nspname = current_schema()),"
+                "                        pg_my_temp_schema())"
+            ).format(sql.Literal(table))
+        cr.execute(
+            format_query(
+                cr,
+                """
+                SELECT c.relname,
+                       c.relkind IN ('r', 'p') AND c.relnamespace != pg_my_temp_schema() AS is_table,
+                       a.attname,
+                       COALESCE(bt.typname, t.typname) AS udt_name,
+                       information_schema._pg_char_max_length(
+                            information_schema._pg_truetypid(a.*, t.*),
+                           information_schema._pg_truetypmod(a.*, t.*)
+                       ) AS char_max_length,
+                       NOT (a.attnotnull OR t.typtype = 'd' AND t.typnotnull) AS is_nullable,
+                       (   c.relkind IN ('r','p','v','f')
+                       AND pg_column_is_updatable(c.oid::regclass, a.attnum, false)
+                       ) AS is_updatable
+                  FROM pg_class c
+             LEFT JOIN pg_attribute a
+                    ON a.attrelid = c.oid
+                   AND a.attnum > 0
+                   AND NOT a.attisdropped
+             LEFT JOIN pg_type t
+                    ON a.atttypid = t.oid
+             LEFT JOIN pg_type bt
+                    ON t.typtype = 'd'
+                   AND t.typbasetype = bt.oid
+                 WHERE {}
+                """,
+                where,
+            )
+        )
+        relations = {}
+        for relname, is_table, attname, udt_name, char_max_length, is_nullable, is_updatable in cr.fetchall():
+            was_table, columns = relations.get(relname, (False, {}))
+            if attname is not None:
+                columns[attname] = (udt_name, char_max_length, is_nullable, is_updatable)
+            relations[relname] = (was_table or is_table, columns)
+        return relations
+
+    def _relation(self, cr, table):
+        if self._relations is None:
+            self._relations = self._load_relations(cr) if self.bulk else {}
+        relation = self._relations.get(table)
+        if relation is None:
+            self.stats["misses"] += 1
+            relation = self._relations[table] = self._load_relations(cr, table).get(table, (False, {}))
+        else:
+            self.stats["hits"] += 1
+        return relation
+
+    def column_info(self, cr, table, column):
+        return self._relation(cr, table)[1].get(column)
+
+    def table_exists(self, cr, table):
+        return self._relation(cr, table)[0]
+
+    def foreign_keys(self, cr):
+        # -> list[tuple[str, ...]]: raw names, delete action code, then quoted names
+        if self._foreign_keys is None:
+            self.stats["loads"] += 1
+            cr.execute(
+                """
+                SELECT cl1.relname, att1.attname, con.conname, cl2.relname, att2.attname, con.confdeltype,
+                       quote_ident(cl1.relname), quote_ident(att1.attname), quote_ident(con.conname),
+                       quote_ident(cl2.relname), quote_ident(att2.attname)
+                  FROM pg_constraint con
+                  JOIN pg_class cl1
+                    ON con.conrelid = cl1.oid
+                  JOIN pg_attribute att1
+                    ON array_lower(con.conkey, 1) = 1
+                   AND con.conkey[1] = att1.attnum
+                   AND att1.attrelid = cl1.oid
+                  JOIN pg_class cl2
+                    ON con.confrelid = cl2.oid
+                  JOIN pg_attribute att2
+                    ON array_lower(con.confkey, 1) = 1
+                   AND con.confkey[1] = att2.attnum
+                   AND att2.attrelid = cl2.oid
+                 WHERE con.contype = 'f'
+                """
+            )
+            self._foreign_keys = cr.fetchall()
+        else:
+            self.stats["hits"] += 1
+        return self._foreign_keys
+
+    def graph(self, cr):
+        if self._graph is None:
+            self._graph = DependencyGraph(cr, self.foreign_keys(cr))
+            self.stats["loads"] += 1
+        else:
+            self.stats["hits"] += 1
+        return self._graph
+
+    def invalidate(self, table=None):
+        """
+        Forget the cached metadata of `table`, or of all relations if `table` is not set.
+
+        Foreign keys and the dependency graph are always forgotten as they involve more
+        than one table.
+        """
+        self.stats["invalidations"] += 1
+        self._foreign_keys = self._graph = None
+        if table is None:
+            self._relations = None
+        elif self._relations is not None:
+            self._relations.pop(table, None)
+
+
+class DependencyGraph(object):
+    """
+    Dependencies between the relations of the database.
+
+    Holds the foreign keys, in both directions, the unique indexes, and the views depending
+    on the columns of the tables. Everything is read from the catalog at once when the
+    graph is built. See :func:`dependency_graph`.
+
+    The foreign keys are tuples of the raw names of the table, column, constraint, target
+    table and target column, the delete action code, then the quoted names of the same
+    five elements.
+    """
+
+    def __init__(self, cr, foreign_keys):
+        self.foreign_keys = foreign_keys
+        self._referencing = collections.defaultdict(list)
+        self._referenced = collections.defaultdict(list)
+        for fk in foreign_keys:
+            self._referencing[fk[3]].append(fk)
+            self._referenced[fk[0]].append(fk)
+
+        self._unique_indexes = collections.defaultdict(list)
+        self._views = collections.defaultdict(list)
+        self._two_columns = set()
+        cr.execute(
+            """
+            SELECT 'u', c.relname, array_agg(a.attname::text), quote_ident(i.relname), NULL::text
+              FROM (SELECT *, unnest(indkey) AS unnest_indkey FROM pg_index) x
+              JOIN pg_class c
+                ON c.oid = x.indrelid
+              JOIN pg_class i
+                ON i.oid = x.indexrelid
+              JOIN pg_attribute a
+                ON a.attrelid = c.oid
+               AND a.attnum = x.unnest_indkey
+             WHERE c.relkind IN ('r', 'm')
+               AND i.relkind = 'i'
+               AND x.indisunique
+          GROUP BY c.relname, i.relname
+
+         UNION ALL
+
+            SELECT DISTINCT 'v', dependent.relname, ARRAY[a.attname::text], quote_ident(dependee.relname),
+                   dependee.relkind::text
+              FROM pg_depend d
+              JOIN pg_rewrite r
+                ON d.objid = r.oid
+              JOIN pg_class dependee
+                ON r.ev_class = dependee.oid
+              JOIN pg_class dependent
+                ON d.refobjid = dependent.oid
+              JOIN pg_attribute a
+                ON d.refobjid = a.attrelid
+               AND d.refobjsubid = a.attnum
+             WHERE a.attnum > 0
+               AND dependee.relkind IN ('v', 'm')
+
+         UNION ALL
+
+            SELECT 'm', t.relname, NULL, NULL, NULL
+              FROM pg_class t
+              JOIN pg_attribute a
+                ON a.attrelid = t.oid
+             WHERE t.relkind = 'r'
+               AND a.attnum > 0
+          GROUP BY t.relname
+            HAVING count(*) = 2
+            """
+        )
+        for kind, table, columns, name, relkind in cr.fetchall():
+            if kind == "u":
+                self._unique_indexes[table].append((name, columns))
+            elif kind == "v":
+                self._views[table, columns[0]].append((name, relkind))
+            else:
+                self._two_columns.add(table)
+
+    def referencing(self, table):
+        """Return the foreign keys pointing to `table`."""
+        return self._referencing.get(table, [])
+
+    def referenced(self, table):
+        """Return the foreign keys of `table`."""
+        return self._referenced.get(table, [])
+
+    def unique_indexes(self, table, *columns):
+        """Return the quoted name and the columns of the unique indexes of `table` on at least `columns`."""
+        return [(name, attrs) for name, attrs in self._unique_indexes.get(table, []) if set(columns) <= set(attrs)]
+
+    def depending_views(self, table, column):
+        """Return the quoted name and the kind of the views depending on the `column` of `table`."""
+        return list(self._views.get((table, column), []))
+
+    def m2m_on(self, table):
+        """
+        Return the m2m tables associated with `table`.
+
+        See :func:`get_m2m_on`.
+        """
+        result = []
+        for fk in self.referencing(table):
+            m2m = fk[0]
+            if m2m not in self._two_columns:
+                continue
+            result.extend(
+                (m2m, fk[1], other[1], other[3])
+                for other in self.referenced(m2m)
+                if other[1] != fk[1] and other[3] != table
+            )
+        return result
+
+
+def dependency_graph(cr):
+    """
+    Return the graph of the dependencies between the relations.
+
+    Inside a :func:`schema_cache` context, the graph is built once and kept until the cache
+    is invalidated. Otherwise a new graph is built on each call.
+
+    .. example::
+        .. code-block:: python
+
+            with util.schema_cache(cr):
+                graph = util.dependency_graph(cr)
+                for fk in graph.referencing("res_partner"):
+                    table, column = fk[:2]
+                    ...
+
+    :rtype: :class:`DependencyGraph`
+    """
+    cache = _schema_caches.get(cr)
+    if cache is not None and cache.bulk:
+        return cache.graph(cr)
+    return DependencyGraph(cr, _SchemaCache().foreign_keys(cr))
 
 
-def pg_array_uniq(a, drop_null=False):
-    dn = "WHERE x IS NOT NULL" if drop_null else ""
-    return SQLStr("ARRAY(SELECT x FROM unnest({0}) x {1} GROUP BY x)".format(a, dn))
+@contextmanager
+def schema_cache(cr):
+    """
+    Cache the catalog metadata used by the column, table, and foreign key helpers.
 
+    While active, :func:`column_exists`, :func:`column_type`, :func:`table_exists`,
+    :func:`get_fk`, :func:`target_of`, and friends are answered from a cache loaded in
+    bulk instead of querying the catalog on each call. The cache is invalidated by the
+    DDL helpers of this module (:func:`create_column`, :func:`remove_column`,
+    :func:`rename_table`, :func:`alter_column_type`, ...).
 
-def pg_replace(s, replacements):
-    q = lambda s: psycopg2.extensions.QuotedString(s).getquoted().decode("utf-8")
+    Nested calls reuse the already active cache of `cr`.
 
-    def replace(s, r):
-        func = "regexp_replace({}, {}, {}, 'g')" if isinstance(r[0], PGRegexp) else "replace({}, {}, {})"
-        return func.format(s, q(r[0]), q(r[1]))
+    .. warning::
+       DDL queries executed directly on the cursor are *not* tracked. Call the
+       `invalidate` method of the yielded cache after executing them.
 
-    return SQLStr(reduce(replace, replacements, s))
+    .. example::
+        .. code-block:: python
 
+            with util.schema_cache(cr) as cache:
+                tables = [t for t in tables if util.column_exists(cr, t, "company_id")]
+                cr.execute("ALTER TABLE res_partner ADD COLUMN x_foo varchar")
+                cache.invalidate("res_partner")
+            _logger.info("%(hits)s hits, %(misses)s misses", cache.stats)
 
-def pg_html_escape(s, quote=True):
+    :return: the cache, exposing hits, misses, loads, and invalidations counters in its
+             `stats` attribute
     """
-    Generate the SQL expression to HTML escape a string.
+    with _schema_cache_scope(cr, bulk=True) as cache:
+        yield cache
 
-    SQL version of `html.escape`.
 
-    :meta private: exclude from online docs
+@contextmanager
+def _schema_cache_scope(cr, bulk):
+    cache = _schema_caches.get(cr)
+    if cache is not None:
+        yield cache
+        return
+    cache = _schema_caches[cr] = _SchemaCache(bulk=bulk)
+    try:
+        yield cache
+    finally:
+        del _schema_caches[cr]
+        _logger.debug("schema cache statistics: %s", dict(cache.stats))
+
+
+def _schema_cached(func):
     """
-    replacements = [
-        ("&", "&amp;"),  # Must be done first!
-        ("<", "&lt;"),
-        (">", "&gt;"),
-    ]
-    if quote:
-        replacements += [
-            ('"', "&quot;"),
-            ("'", "&#x27;"),
-        ]
-    return pg_replace(s, replacements)
+    Run `func` with a cache of the columns of the relations, loaded one by one on demand.
 
+    Unlike :func:`schema_cache`, nothing is loaded in bulk: the cache only saves the
+    repeated lookups of the same relations.
 
-def pg_text2html(s, wrap="p"):
-    return SQLStr(
-        r"""
-        CASE WHEN TRIM(COALESCE({src}, '')) ~ '^<.+</\w+>$' THEN {src}
-             ELSE CONCAT(
-                '{opening_tag}',
-                replace(
-                    replace(REGEXP_REPLACE({esc},
-                                           -- regex from https://blog.codinghorror.com/the-problem-with-urls/
-                                           -- double the %% to allow this code chunk to be used in parameterized queries
-                                           'https?://[-A-Za-z0-9+&@#/%%?=~_()|!:,.;]*[-A-Za-z0-9+&@#/%%=~_()|]',
-                                           '<a href="\&" target="_blank" rel="noreferrer noopener">\&</a>',
-                                           'g'),
-                            E'\n',
-                            '<br>'),
-                    E'\t',
-                    '&Tab;'),
-                '{closing_tag}')
-         END
-        """.format(
-            opening_tag="<{}>".format(wrap) if wrap else "",
-            closing_tag="</{}>".format(wrap) if wrap else "",
-            src=s,
-            esc=pg_html_escape(s, quote=False),
-        )
-    )
+    :meta private: exclude from online docs
+    """
 
+    @wraps(func)
+    def wrapper(cr, *args, **kwargs):
+        with _schema_cache_scope(cr, bulk=False):
+            return func(cr, *args, **kwargs)
 
-_JSONB_COLUMNS = {}
-if version_gte("17.0"):  # switched to jsonb in 16.0
-    _JSONB_COLUMNS[("ir_ui_view", "arch_db")] = True
-    _JSONB_COLUMNS[("ir_act_server", "name")] = True
-    _JSONB_COLUMNS[("ir_model", "name")] = True
+    return wrapper
 
 
-def get_value_or_en_translation(cr, table, column):
-    is_jsonb = (
-        _JSONB_COLUMNS[(table, column)]
-        if (table, column) in _JSONB_COLUMNS
-        else column_type(cr, table, column) == "jsonb"
-    )
-    fmt = "{}->>'en_US'" if is_jsonb else "{}"
-    return format_query(cr, fmt, column)
+def _invalidate_schema_cache(cr, table=None):
+    cache = _schema_caches.get(cr)
+    if cache is not None:
+        cache.invalidate(table)
 
 
 def _column_info(cr, table, column):
     # -> tuple[str, int | None, bool, bool] | None
     _validate_table(table)
+    cache = _schema_caches.get(cr)
+    if cache is not None and column not in _PG_SYSTEM_COLUMNS:
+        return cache.column_info(cr, table, column)
     cr.execute(
         """
         SELECT COALESCE(bt.typname, t.typname) AS udt_name,
@@ -716,6 +2397,7 @@ def create_column(cr, table, column, definition, **kwargs):
     else:
         cr.execute(create_query + " DEFAULT %s", [default])
         cr.execute("""ALTER TABLE "%s" ALTER COLUMN "%s" DROP DEFAULT""" % (table, column))
+    _invalidate_schema_cache(cr, table)
     return True
 
 
@@ -767,6 +2449,7 @@ def create_fk(cr, table, column, fk_table, on_delete_action="NO ACTION"):
         sql.Identifier(table), sql.Identifier(column), sql.Identifier(fk_table), sql.SQL(on_delete_action)
     )
     cr.execute(query)
+    _invalidate_schema_cache(cr, table)
 
 
 def remove_column(cr, table, column, cascade=False):
@@ -774,6 +2457,7 @@ def remove_column(cr, table, column, cascade=False):
         drop_depending_views(cr, table, column)
         drop_cascade = " CASCADE" if cascade else ""
         cr.execute('ALTER TABLE "{0}" DROP COLUMN "{1}"{2}'.format(table, column, drop_cascade))
+        _invalidate_schema_cache(cr, None if cascade else table)
 
 
 def alter_column_type(cr, table, column, type, using=None, where=None, logger=_logger):
@@ -826,6 +2510,9 @@ def alter_column_type(cr, table, column, type, using=None, where=None, logger=_l
         if null_frac <= 0.70:
             # Simple case. Use general SQL syntax
             cr.execute(format_query(cr, "ALTER TABLE {} ALTER COLUMN {} TYPE {}", table, column, sql.SQL(type)))
+            _invalidate_schema_cache(cr, table)
+            # the statistics of the column are dropped with its former type
+            cr.execute(format_query(cr, "ANALYZE {}({})", table, column))
             return
 
         using = "{{0}}::{}".format(type)
@@ -834,6 +2521,7 @@ def alter_column_type(cr, table, column, type, using=None, where=None, logger=_l
     tmp_column = "_{}_upg".format(column)
     cr.execute(format_query(cr, "ALTER TABLE {} RENAME COLUMN {} TO {}", table, column, tmp_column))
     cr.execute(format_query(cr, "ALTER TABLE {} ADD COLUMN {} {}", table, column, sql.SQL(type)))
+    _invalidate_schema_cache(cr, table)
 
     using = format_query(cr, using, tmp_column)
     if where is None:
@@ -851,10 +2539,14 @@ def alter_column_type(cr, table, column, type, using=None, where=None, logger=_l
     )
 
     cr.execute(format_query(cr, "ALTER TABLE {} DROP COLUMN {} CASCADE", table, tmp_column))
+    _invalidate_schema_cache(cr)
 
 
 def table_exists(cr, table):
     _validate_table(table)
+    cache = _schema_caches.get(cr)
+    if cache is not None:
+        return cache.table_exists(cr, table)
     cr.execute(
         """
             SELECT 1
@@ -903,6 +2595,7 @@ def remove_constraint(cr, table, name, cascade=False, warn=True):
     log = _logger.warning if warn else _logger.info
     cascade = SQLStr("CASCADE" if cascade else "")
     cr.execute(format_query(cr, "ALTER TABLE {} DROP CONSTRAINT IF EXISTS {} {}", table, name, cascade))
+    _invalidate_schema_cache(cr, table)
     # Exceptionally remove Odoo records, even if we are in PG land on this file. This is somehow
     # valid because ir.model.constraint are ORM low-level objects that relate directly to table
     # constraints.
@@ -932,6 +2625,13 @@ def get_fk(cr, table, quote_ident=True):
     :meta private: exclude from online docs
     """
     _validate_table(table)
+    cache = _schema_caches.get(cr)
+    if cache is not None and cache.bulk:
+        return [
+            (fk[6], fk[7], fk[8], fk[5]) if quote_ident else (fk[0], fk[1], fk[2], fk[5])
+            for fk in cache.graph(cr).referencing(table)
+            if fk[4] == "id"
+        ]
     funk = "quote_ident" if quote_ident else "concat"
     q = """SELECT {funk}(cl1.relname) as table,
                   {funk}(att1.attname) as column,
@@ -964,6 +2664,12 @@ def target_of(cr, table, column):
 
     :meta private: exclude from online docs
     """
+    cache = _schema_caches.get(cr)
+    if cache is not None and cache.bulk:
+        for fk in cache.graph(cr).referenced(table):
+            if fk[1] == column:
+                return (fk[9], fk[10], fk[8])
+        return None
     cr.execute(
         """
         SELECT quote_ident(cl2.relname) as table,
@@ -995,6 +2701,7 @@ class IndexInfo(collections.namedtuple("IndexInfo", "name on isunique isconstrai
             remove_constraint(cr, self.on, self.name, warn=False)
         else:
             cr.execute('DROP INDEX "%s"' % self.name)
+            _invalidate_schema_cache(cr, self.on)
 
 
 def get_index_on(cr, table, *columns):
@@ -1054,6 +2761,9 @@ def _get_unique_indexes_with(cr, table, *columns):
     """
     _validate_table(table)
     assert columns
+    cache = _schema_caches.get(cr)
+    if cache is not None and cache.bulk:
+        return cache.graph(cr).unique_indexes(table, *columns)
     cr.execute(
         """
         SELECT name, attrs
@@ -1087,10 +2797,121 @@ def create_index(cr, name, table_name, *columns):
                 index_name=name, table_name=table_name, columns=",".join(columns)
             )
         )
+        _invalidate_schema_cache(cr, table_name)
         return True
     return False
 
 
+_TABLE_NAME_RE = r'((?:"[^"]+"|\w+)(?:\.(?:"[^"]+"|\w+))?)'
+_CREATE_INDEX_RE = re.compile(r"^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\b.*?\sON\s+(?:ONLY\s+)?" + _TABLE_NAME_RE, re.I | re.S)
+_ALTER_TABLE_RE = re.compile(r"^\s*ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?" + _TABLE_NAME_RE, re.I)
+
+
+def create_indexes(cr, definitions, maintenance_work_mem=None, logger=_logger):
+    """
+    Create indexes and constraints in parallel.
+
+    The definitions are `CREATE INDEX` and `ALTER TABLE` statements, grouped by table. The
+    tables are processed in parallel. When a table has `ALTER TABLE` statements, which lock
+    it exclusively, all its statements are executed one after the other, in the given
+    order, so a statement can rely on the ones before it on the same table. Otherwise, its
+    indexes are created in parallel. Statements on different tables must not depend on
+    each other.
+
+    The duration of each statement is logged.
+
+    .. example::
+        .. code-block:: python
+
+            util.create_indexes(
+                cr,
+                [
+                    "ALTER TABLE res_partner_rel ADD PRIMARY KEY (partner_id, rel_id)",
+                    "CREATE INDEX ON res_partner_rel (rel_id, partner_id)",
+                    "CREATE INDEX ON account_move_line (partner_id, date)",
+                ],
+                maintenance_work_mem="1GB",
+            )
+
+    .. warning::
+       As a side effect, the cursor will be committed.
+
+    :param list(str) definitions: statements creating the indexes and constraints
+    :param str maintenance_work_mem: memory used to build each index, the server setting
+                                     by default
+    :param logger: logger used to report the progress
+    :type logger: :class:`logging.Logger`
+    :return: the statements and their duration in seconds, in execution order
+    :rtype: list(tuple(str, float))
+    """
+    statements = collections.OrderedDict()
+    alter_tables = set()
+    for definition in definitions:
+        if re.search(r"\bCONCURRENTLY\b", definition, re.I):
+            raise ValueError("Cannot execute concurrent index creations in a transaction: {}".format(definition))
+        match = _CREATE_INDEX_RE.match(definition) or _ALTER_TABLE_RE.match(definition)
+        if not match:
+            raise ValueError("Not an index or constraint definition: {}".format(definition))
+        table = match.group(1).split(".")[-1]
+        table = table[1:-1] if table.startswith('"') else table.lower()
+        statements.setdefault(table, []).append(definition)
+        if match.re is _ALTER_TABLE_RE:
+            alter_tables.add(table)
+
+    groups = []
+    for table, table_statements in statements.items():
+        if table in alter_tables:
+            groups.append(table_statements)
+        else:
+            groups.extend([statement] for statement in table_statements)
+
+    settings = {"maintenance_work_mem": maintenance_work_mem} if maintenance_work_mem else {}
+    with worker_settings(cr, **settings):
+        timings = _execute_statement_groups(cr, groups, logger)
+    for table in statements:
+        _invalidate_schema_cache(cr, table)
+
+    for statement, duration in timings:
+        logger.info("%.1fs: %s", duration, _query_label(statement))
+    return timings
+
+
+def _execute_statements(cr, statements):
+    timings = []
+    for statement in statements:
+        t0 = time.time()
+        cr.execute(statement)
+        timings.append((statement, time.time() - t0))
+    return timings
+
+
+def _execute_statement_groups(cr, groups, logger):
+    """
+    Execute groups of statements in parallel, the statements of each group sequentially.
+
+    Return the statements and their duration.
+
+    :meta private: exclude from online docs
+    """
+    if not groups:
+        return []
+    if len(groups) == 1 or _parallel_execute_impl() is _parallel_execute_serial:
+        return [timing for statements in groups for timing in _execute_statements(cr, statements)]
+
+    def execute(statements):
+        with _worker_cursors.cursor(cr.dbname) as tcr:
+            return _execute_statements(tcr, statements)
+
+    cr.commit()
+    timings = []
+    with ThreadPoolExecutor(max_workers=min(get_max_workers(), len(groups))) as executor:
+        for result in log_progress(
+            executor.map(execute, groups), logger, qualifier="statements", size=len(groups), estimate=False
+        ):
+            timings.extend(result)
+    return timings
+
+
 @contextmanager
 def temp_index(cr, table, *columns):
     # create a temporary index that will be removed at the end of the contextmanager
@@ -1102,11 +2923,179 @@ def temp_index(cr, table, *columns):
         yield
     finally:
         cr.execute('DROP INDEX IF EXISTS "{}"'.format(name))
+        _invalidate_schema_cache(cr, table)
+
+
+@contextmanager
+def deferred_indexes(cr, table, foreign_keys=False, logger=_logger):
+    """
+    Drop the secondary indexes of a table while running mass updates on it.
+
+    The non-unique secondary indexes of `table` are dropped when entering the context
+    and recreated in parallel when leaving it. Indexes enforcing a constraint (primary
+    keys, unique, and exclusion constraints) are never dropped.
+
+    Optionally, the foreign keys of `table` are also dropped, then recreated as `NOT VALID`
+    and validated afterwards, which does not block writes on the referenced tables.
+
+    The definitions of the dropped indexes and foreign keys are saved in a table, in the
+    same transaction as the drops. Definitions left by an interrupted run, whose drops
+    were committed, are restored when entering the context again for the same table.
+
+    .. example::
+        .. code-block:: python
+
+            with util.deferred_indexes(cr, "account_move_line"):
+                util.explode_execute(cr, query, table="account_move_line")
+
+    .. warning::
+       Recreating the indexes commits the cursor. If an error occurs inside the context,
+       the indexes are recreated one by one, without committing, unless the transaction
+       is aborted. In that case, they are restored by the next call for the same table.
+
+    :param str table: table whose indexes are deferred
+    :param bool foreign_keys: whether to also defer the validation of the foreign keys
+    :param logger: logger used to report the progress
+    :type logger: :class:`logging.Logger`
+    """
+    _validate_table(table)
+    _restore_deferred_indexes(cr, table, logger)
+    cr.execute(
+        """
+        SELECT quote_ident(i.relname), pg_get_indexdef(x.indexrelid)
+          FROM pg_index x
+          JOIN pg_class i
+            ON i.oid = x.indexrelid
+         WHERE x.indrelid = %s::regclass
+           AND x.indisvalid
+           AND NOT x.indisunique
+           AND NOT x.indisprimary
+           AND NOT x.indisexclusion
+           AND NOT x.indisreplident
+           AND NOT EXISTS(SELECT 1 FROM pg_constraint t WHERE t.conindid = x.indexrelid)
+        """,
+        [table],
+    )
+    indexes = cr.fetchall()
+    fks = []
+    if foreign_keys:
+        cr.execute(
+            """
+            SELECT quote_ident(t.conname), pg_get_constraintdef(t.oid)
+              FROM pg_constraint t
+             WHERE t.conrelid = %s::regclass
+               AND t.contype = 'f'
+               AND t.convalidated
+            """,
+            [table],
+        )
+        fks = cr.fetchall()
+
+    copy_rows(
+        cr,
+        _DEFERRED_INDEXES_TABLE,
+        ["table_name", "kind", "name", "definition"],
+        [(table, "i", name, definition) for name, definition in indexes]
+        + [(table, "f", name, definition) for name, definition in fks],
+    )
+    for name, _ in indexes:
+        cr.execute(format_query(cr, "DROP INDEX {}", SQLStr(name)))
+    for name, _ in fks:
+        cr.execute(format_query(cr, "ALTER TABLE {} DROP CONSTRAINT {}", table, SQLStr(name)))
+    _invalidate_schema_cache(cr, table)
+    logger.info("Deferred %d indexes and %d foreign keys of table %r", len(indexes), len(fks), table)
+
+    try:
+        yield
+    except Exception:
+        if _transaction_failed(cr):
+            logger.error(  # noqa: TRY400
+                "Indexes and foreign keys of table %r have not been recreated, they will be restored by the next"
+                " call to `deferred_indexes` on it. Their definitions are saved in the %r table.",
+                table,
+                _DEFERRED_INDEXES_TABLE,
+            )
+        else:
+            _restore_deferred_indexes(cr, table, logger, parallel=False)
+        raise
+
+    _restore_deferred_indexes(cr, table, logger)
+
+
+_DEFERRED_INDEXES_TABLE = "_upgrade_deferred_indexes"
+
+
+def _transaction_failed(cr):
+    return cr._cnx.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR
+
+
+def _restore_deferred_indexes(cr, table, logger, parallel=True):
+    """
+    Recreate the indexes and foreign keys of `table` saved by :func:`deferred_indexes`.
+
+    The ones recreated by other means in the meantime are skipped.
+
+    :meta private: exclude from online docs
+    """
+    cr.execute(
+        format_query(
+            cr,
+            """
+            CREATE TABLE IF NOT EXISTS {}(
+                id serial PRIMARY KEY,
+                table_name varchar NOT NULL,
+                kind char NOT NULL,
+                name varchar NOT NULL,
+                definition text NOT NULL
+            )
+            """,
+            _DEFERRED_INDEXES_TABLE,
+        )
+    )
+    cr.execute(
+        format_query(
+            cr,
+            """
+            SELECT d.kind, d.name, d.definition
+              FROM {} d
+             WHERE d.table_name = %s
+               AND CASE d.kind
+                   WHEN 'i' THEN to_regclass(d.name) IS NULL
+                   ELSE NOT EXISTS(SELECT 1
+                                     FROM pg_constraint t
+                                    WHERE t.conrelid = %s::regclass
+                                      AND quote_ident(t.conname) = d.name)
+                    END
+          ORDER BY d.id
+            """,
+            _DEFERRED_INDEXES_TABLE,
+        ),
+        [table, table],
+    )
+    rows = cr.fetchall()
+    indexes = [definition for kind, _, definition in rows if kind == "i"]
+    fks = [(name, definition) for kind, name, definition in rows if kind == "f"]
+
+    for name, definition in fks:
+        cr.execute(
+            format_query(cr, "ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID", table, SQLStr(name), SQLStr(definition))
+        )
+    if parallel:
+        create_indexes(cr, indexes, logger=logger)
+    else:
+        _execute_statements(cr, indexes)
+    for name, _ in fks:
+        cr.execute(format_query(cr, "ALTER TABLE {} VALIDATE CONSTRAINT {}", table, SQLStr(name)))
+    cr.execute(format_query(cr, "DELETE FROM {} WHERE table_name = %s", _DEFERRED_INDEXES_TABLE), [table])
+    _invalidate_schema_cache(cr, table)
 
 
 def get_depending_views(cr, table, column):
     # http://stackoverflow.com/a/11773226/75349
     _validate_table(table)
+    cache = _schema_caches.get(cr)
+    if cache is not None and cache.bulk:
+        return cache.graph(cr).depending_views(table, column)
     q = """
         SELECT distinct quote_ident(dependee.relname), dependee.relkind
         FROM pg_depend
@@ -1325,6 +3314,8 @@ def rename_table(cr, old_table, new_table, remove_constraints=True):
         )
 
     cr.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(old_table), sql.Identifier(new_table)))
+    _invalidate_schema_cache(cr, old_table)
+    _invalidate_schema_cache(cr, new_table)
 
     # rename pkey sequence
     cr.execute(
@@ -1383,6 +3374,7 @@ def rename_table(cr, old_table, new_table, remove_constraints=True):
                 sql.Identifier(idx.replace(old_table, new_table)),
             )
         )
+    _invalidate_schema_cache(cr, new_table)
 
     if remove_constraints:
         # DELETE all constraints, except Primary/Foreign keys/not null checks, they will be re-created by the ORM
@@ -1430,6 +3422,7 @@ def rename_table(cr, old_table, new_table, remove_constraints=True):
                 sql.Identifier(new_table), sql.Identifier(old_const), sql.Identifier(new_const)
             )
         )
+        _invalidate_schema_cache(cr, new_table)
 
 
 def find_new_table_column_name(cr, table, name):
@@ -1449,6 +3442,7 @@ def drop_depending_views(cr, table, column):
     """
     for v, k in get_depending_views(cr, table, column):
         cr.execute("DROP {0} VIEW IF EXISTS {1} CASCADE".format("MATERIALIZED" if k == "m" else "", v))
+        _invalidate_schema_cache(cr)
 
 
 def create_m2m(cr, m2m, fk1, fk2, col1=None, col2=None):
@@ -1498,6 +3492,7 @@ def create_m2m(cr, m2m, fk1, fk2, col1=None, col2=None):
         fk2=fk2,
     )
     cr.execute(query)
+    _invalidate_schema_cache(cr, m2m)
 
     return m2m
 
@@ -1585,6 +3580,7 @@ def update_m2m_tables(cr, old_table, new_table, ignored_m2ms=()):
                 del_action=SQLStr("RESTRICT") if on_delete == "r" else SQLStr("CASCADE"),
             )
             cr.execute(query)
+            _invalidate_schema_cache(cr, m2m_table)
 
             cr.execute(
                 """
@@ -1611,6 +3607,22 @@ def update_m2m_tables(cr, old_table, new_table, ignored_m2ms=()):
 
 
 def fixup_m2m(cr, m2m, fk1, fk2, col1=None, col2=None):
+    """
+    Clean up a many2many table and ensure its constraints and indexes.
+
+    Rows with `NULL`, duplicated or dangling references are removed, then the columns are
+    set `NOT NULL`, the foreign keys and the indexes are created when missing.
+
+    .. warning::
+       When the table holds more than `EXPLODE_M2M_THRESHOLD` rows (1M by default), the
+       dangling rows are removed in parallel and, as a side effect, the cursor is committed.
+
+    :param str m2m: name of the many2many table
+    :param str fk1: table referenced by the first column
+    :param str fk2: table referenced by the second column
+    :param str col1: first column, `<fk1>_id` by default
+    :param str col2: second column, `<fk2>_id` by default
+    """
     if col1 is None:
         col1 = "%s_id" % fk1
     if col2 is None:
@@ -1625,20 +3637,24 @@ def fixup_m2m(cr, m2m, fk1, fk2, col1=None, col2=None):
 
     # cleanup
     fixup_m2m_cleanup(cr, m2m, col1, col2)
-    cr.execute(
+    deleted = _explode_execute_m2m(
+        cr,
         """
         DELETE FROM "{m2m}" t
-              WHERE NOT EXISTS (SELECT id FROM "{fk1}" WHERE id=t."{col1}")
-                 OR NOT EXISTS (SELECT id FROM "{fk2}" WHERE id=t."{col2}")
-    """.format(**locals())
+              WHERE (   NOT EXISTS (SELECT id FROM "{fk1}" WHERE id=t."{col1}")
+                     OR NOT EXISTS (SELECT id FROM "{fk2}" WHERE id=t."{col2}"))
+                AND {{parallel_filter}}
+    """.format(**locals()),
+        m2m,
+        "t",
     )
-    deleted = cr.rowcount
     if deleted:
         _logger.debug("%(m2m)s: removed %(deleted)d invalid rows", locals())
 
     # set not null
     cr.execute('ALTER TABLE "{m2m}" ALTER COLUMN "{col1}" SET NOT NULL'.format(**locals()))
     cr.execute('ALTER TABLE "{m2m}" ALTER COLUMN "{col2}" SET NOT NULL'.format(**locals()))
+    _invalidate_schema_cache(cr, m2m)
 
     # create  missing or bad fk
     target = target_of(cr, m2m, col1)
@@ -1650,6 +3666,7 @@ def fixup_m2m(cr, m2m, fk1, fk2, col1=None, col2=None):
         cr.execute(
             'ALTER TABLE "{m2m}" ADD FOREIGN KEY ("{col1}") REFERENCES "{fk1}" ON DELETE CASCADE'.format(**locals())
         )
+        _invalidate_schema_cache(cr, m2m)
 
     target = target_of(cr, m2m, col2)
     if target and target[:2] != (fk2, "id"):
@@ -1660,6 +3677,7 @@ def fixup_m2m(cr, m2m, fk1, fk2, col1=None, col2=None):
         cr.execute(
             'ALTER TABLE "{m2m}" ADD FOREIGN KEY ("{col2}") REFERENCES "{fk2}" ON DELETE CASCADE'.format(**locals())
         )
+        _invalidate_schema_cache(cr, m2m)
 
     # create indexes
     fixup_m2m_indexes(cr, m2m, col1, col2)
@@ -1723,6 +3741,7 @@ def fixup_m2m_indexes(cr, m2m, col1, col2):
         else:
             # create a PK (unique index)
             cr.execute('ALTER TABLE "%s" ADD PRIMARY KEY("%s", "%s")' % fmt)
+    _invalidate_schema_cache(cr, m2m)
 
     # remove indexes on 1 column only
     idx = get_index_on(cr, m2m, col1)
@@ -1780,6 +3799,9 @@ def get_m2m_on(cr, table):
     :return: list of (m2m_table, fk_col_to_table, other_fk_col, other_table) tuples
     """
     _validate_table(table)
+    cache = _schema_caches.get(cr)
+    if cache is not None and cache.bulk:
+        return cache.graph(cr).m2m_on(table)
     query = """
         WITH two_cols AS (
             SELECT t.oid
@@ -1829,12 +3851,30 @@ def get_m2m_on(cr, table):
     return cr.fetchall()
 
 
+try:
+    array.array("q")
+    _INT8_TYPECODE = "q"
+except ValueError:
+    # python 2
+    _INT8_TYPECODE = "l"
+
+# type oid -> (array typecode, numpy dtype)
+_COLUMNAR_TYPES = {
+    20: (_INT8_TYPECODE, "int64"),
+    21: ("h", "int16"),
+    23: ("i", "int32"),
+    700: ("f", "float32"),
+    701: ("d", "float64"),
+}
+
+
 class named_cursor(object):
     """
     Server side cursor.
 
     This class wraps a psycopg2 server-side cursor. It adds convenient methods like
-    `dictfetchmany` and `dictfetchall`. It should be used as a context manager.
+    `dictfetchmany` and `dictfetchall`, or `itercolumns` to process the rows by batches
+    of columns. It should be used as a context manager.
 
     Server-side cursors are useful to fetch huge amounts of data from the DB by chunks
     while at the same time keep using the main upgrade cursor.
@@ -1863,6 +3903,55 @@ class named_cursor(object):
     def iterdict(self):
         return map(self.__dictrow, self._ncr)
 
+    def fetchcolumns(self, size=None, arrays=False):
+        """
+        Fetch the next batch of rows, as columns.
+
+        Return a dict mapping each column name to the sequence of its values in the batch,
+        or `None` once all rows are fetched. No object is built per row.
+
+        .. example::
+            .. code-block:: python
+
+                with util.named_cursor(cr, itersize=10000) as ncr:
+                    ncr.execute("SELECT id, amount FROM account_move_line")
+                    for batch in ncr.itercolumns(arrays=True):
+                        total += sum(batch["amount"])
+
+        :param int size: number of rows of the batch, `itersize` by default
+        :param bool arrays: return the integer and float columns without `NULL` values as
+                            NumPy arrays when NumPy is available, as `array.array` otherwise.
+                            The other columns are tuples.
+        :rtype: dict(str, tuple)
+        """
+        rows = self._ncr.fetchmany(size or self._ncr.itersize)
+        if not rows:
+            return None
+        description = self._ncr.description
+        columns = collections.OrderedDict(zip((d.name for d in description), zip(*rows)))
+        if arrays:
+            numpy = _numpy()
+            for d in description:
+                types = _COLUMNAR_TYPES.get(d.type_code)
+                values = columns[d.name]
+                if types is None or None in values:
+                    continue
+                typecode, dtype = types
+                columns[d.name] = array.array(typecode, values) if numpy is None else numpy.array(values, dtype=dtype)
+        return columns
+
+    def itercolumns(self, size=None, arrays=False):
+        """
+        Iterate over the rows by batches of columns.
+
+        See :meth:`fetchcolumns`.
+        """
+        while True:
+            columns = self.fetchcolumns(size, arrays)
+            if columns is None:
+                return
+            yield columns
+
     def __iter__(self):
         return self._ncr.__iter__()
 
@@ -1877,6 +3966,14 @@ class named_cursor(object):
         return getattr(self._ncr, name)
 
 
+def _numpy():
+    try:
+        import numpy  # noqa: PLC0415
+    except ImportError:
+        return None
+    return numpy
+
+
 def create_id_sequence(cr, table, set_as_default=True):
     if not table_exists(cr, table):
         raise MigrationError("The table `%s` doesn't exist, sequence can't be created." % table)
@@ -1934,7 +4031,61 @@ def create_id_sequence(cr, table, set_as_default=True):
         )
 
 
-def bulk_update_table(cr, table, columns, mapping, key_col="id"):
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return unicode(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class _CopyReader(object):
+    """File-like object streaming `rows` in the text format of `COPY`."""
+
+    def __init__(self, rows):
+        self._lines = ("\t".join(map(_copy_value, row)) + "\n" for row in rows)
+        self._buffer = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def copy_rows(cr, table, columns, rows):
+    """
+    Bulk load rows into a table using `COPY`.
+
+    The rows are streamed to PostgreSQL in the text format of `COPY` while being consumed,
+    thus `rows` can be a generator of any size.
+
+    .. example::
+        .. code-block:: python
+
+            util.copy_rows(cr, "_upgrade_mapping", ["old", "new"], mapping.items())
+
+    :param str table: table to load the rows into
+    :param list(str) columns: columns of `table` to fill, in the order of the values of
+                              each row
+    :param iterable rows: rows to load, each row is a sequence of values. Values are
+                          converted to text, `None` is loaded as `NULL`.
+    """
+    _validate_table(table)
+    cr.copy_expert(
+        format_query(cr, "COPY {}({}) FROM STDIN", table, ColumnList.from_unquoted(cr, columns)),
+        _CopyReader(rows),
+    )
+
+
+def bulk_update_table(cr, table, columns, mapping, key_col="id", stage=False):
     """
     Update table based on mapping.
 
@@ -1968,6 +4119,10 @@ def bulk_update_table(cr, table, columns, mapping, key_col="id"):
                          following the **same** order
     :param str key_col: column used as key to get the values from `mapping` during the
                         update.
+    :param bool stage: whether to stream the mapping with `COPY` into an indexed staging
+                       table, then update the table in parallel buckets. It avoids
+                       building a huge JSON document for big mappings, but commits the
+                       cursor. Default is `False`.
 
     .. warning::
 
@@ -1986,6 +4141,10 @@ def bulk_update_table(cr, table, columns, mapping, key_col="id"):
         n_columns = len(columns)
         assert all(isinstance(value, (list, tuple)) and len(value) == n_columns for value in mapping.values())
 
+    if stage:
+        _bulk_update_table_staged(cr, table, columns, mapping, key_col)
+        return
+
     query = format_query(
         cr,
         """
@@ -2007,21 +4166,124 @@ def bulk_update_table(cr, table, columns, mapping, key_col="id"):
     cr.execute(query, [Json(mapping)])
 
 
+def _bulk_update_table_staged(cr, table, columns, mapping, key_col):
+    staging = "_upgrade_bulk_update_{}".format(uuid.uuid4().hex)
+    values = ["value_{}".format(i) for i in range(len(columns))]
+    # UNLOGGED rather than TEMP, the parallel updates are run on other connections
+    cr.execute(
+        format_query(
+            cr,
+            "CREATE UNLOGGED TABLE {}(key {}, {})",
+            staging,
+            sql.SQL(column_type(cr, table, key_col, sized=True)),
+            sql.SQL(", ").join(
+                sql.SQL("{} {}").format(sql.Identifier(value), sql.SQL(column_type(cr, table, column, sized=True)))
+                for value, column in zip(values, columns)
+            ),
+        )
+    )
+    try:
+        rows = mapping.items() if len(columns) == 1 else ((key,) + tuple(value) for key, value in mapping.items())
+        copy_rows(cr, staging, ["key"] + values, rows)
+        cr.execute(format_query(cr, "CREATE INDEX ON {}(key)", staging))
+        cr.execute(format_query(cr, "ANALYZE {}", staging))
+
+        query = format_query(
+            cr,
+            """
+            UPDATE {table} t
+               SET ({cols}) = ROW({values})
+              FROM {staging} m
+             WHERE t.{key_col} = m.key
+            """,
+            table=table,
+            cols=ColumnList.from_unquoted(cr, columns),
+            values=ColumnList.from_unquoted(cr, values).using(alias="m"),
+            staging=staging,
+            key_col=key_col,
+        )
+        if column_exists(cr, table, "id"):
+            explode_execute(cr, query + " AND {parallel_filter}", table=table, alias="t")
+        else:
+            cr.execute(query)
+    finally:
+        _drop_helper_table(cr, staging)
+
+
+_READ_ONLY_QUERY_RE = re.compile(r"^\s*(?:SELECT|WITH|VALUES|TABLE)\b", re.IGNORECASE)
+_WRITING_QUERY_RE = re.compile(r"\b(?:INSERT|UPDATE|DELETE|MERGE|INTO|SHARE|nextval|setval)\b", re.IGNORECASE)
+
+
+def _drop_helper_table(cr, table):
+    """
+    Drop a helper table, also from the `finally` clause of a failed transaction.
+
+    :meta private: exclude from online docs
+    """
+    try:
+        cr.execute(format_query(cr, "DROP TABLE IF EXISTS {}", table))
+    except psycopg2.InternalError as e:
+        # the rollback of the transaction drops the table, unless it was committed before
+        if e.pgcode != errorcodes.IN_FAILED_SQL_TRANSACTION:
+            raise
+
+
+_INT_TYPE_OIDS = {20: "int8", 23: "int4"}
+
+
 class query_ids(object):
     """
     Iterator over ids returned by a query.
 
     This allows iteration over a potentially huge number of ids without exhausting memory.
 
+    Read-only queries are streamed from a server-side cursor, the ids being validated while
+    they are iterated. Their length is only counted when requested, by executing the query
+    once more. Other queries, like DML ones with a `RETURNING` clause, are first materialized
+    into a temporary table.
+
     :param str query: the query that returns the ids. It can be DML,
                       e.g. `UPDATE table WHERE ... RETURNING id`.
     :param int itersize: determines the number of rows fetched from PG at once,
                          see :func:`~odoo.upgrade.util.pg.named_cursor`.
+
+    .. note::
+       Ids are always returned in ascending order. Duplicated or `NULL` ids raise a
+       `ValueError`, before any id is returned for materialized queries, when reached for
+       streamed ones.
     """
 
     def __init__(self, cr, query, itersize=None):
         self._ncr = None
         self._cr = cr
+        self._query = query
+        self._tmp_tbl = None
+        self._len = None
+        self._last = None
+        if _READ_ONLY_QUERY_RE.match(query) and not _WRITING_QUERY_RE.search(query):
+            self._stream(cr, query, itersize)
+        else:
+            self._materialize(cr, query, itersize)
+        self._it = iter(self._ncr)
+
+    def _stream(self, cr, query, itersize):
+        self._ncr = named_cursor(cr, itersize)
+        self._ncr.execute(format_query(cr, "SELECT id FROM ({}) q(id) ORDER BY id", SQLStr(query)))
+
+    def _validate(self, id_):
+        # streamed ids are sorted: `NULL` ones come last, duplicated ones in a row
+        if self._last is None:
+            type_code = self._ncr.description[0].type_code
+            idtype = _INT_TYPE_OIDS.get(type_code, type_code)
+            if idtype not in ["int4", "int8"]:
+                raise TypeError(
+                    "The query for ids is producing values of an unexpected type {}\n{}".format(idtype, self._query)
+                )
+        if id_ is None or id_ == self._last:
+            raise ValueError("The query for ids is producing duplicate or NULL values:\n{}".format(self._query))
+        self._last = id_
+
+    def _materialize(self, cr, query, itersize):
         self._tmp_tbl = "_upgrade_query_ids_{}".format(uuid.uuid4().hex)
         cr.execute(
             format_query(
@@ -2050,13 +4312,14 @@ class query_ids(object):
             raise
         self._ncr = named_cursor(cr, itersize)
         self._ncr.execute(format_query(cr, "SELECT id FROM {} ORDER BY id", self._tmp_tbl))
-        self._it = iter(self._ncr)
 
     def _close(self):
         if self._ncr:
             if self._ncr.closed:
                 return
             self._ncr.close()
+        if self._tmp_tbl is None:
+            return
         try:
             self._cr.execute(format_query(self._cr, "DROP TABLE IF EXISTS {}", self._tmp_tbl))
         except psycopg2.InternalError as e:
@@ -2064,6 +4327,9 @@ class query_ids(object):
                 raise
 
     def __len__(self):
+        if self._len is None:
+            self._cr.execute(format_query(self._cr, "SELECT count(*) FROM ({}) q", SQLStr(self._query)))
+            [self._len] = self._cr.fetchone()
         return self._len
 
     def __iter__(self):
@@ -2073,10 +4339,13 @@ class query_ids(object):
         if self._ncr.closed:
             raise StopIteration
         try:
-            return next(self._it)[0]
+            [id_] = next(self._it)
         except StopIteration:
             self._close()
             raise
+        if self._tmp_tbl is None:
+            self._validate(id_)
+        return id_
 
     def next(self):
         return self.__next__()
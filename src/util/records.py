@@ -10,7 +10,7 @@ from operator import itemgetter
 
 import lxml
 from psycopg2 import sql
-from psycopg2.extras import Json, execute_values
+from psycopg2.extras import Json
 
 try:
     from odoo import modules
@@ -41,11 +41,15 @@ from .pg import (
     ColumnList,
     PGRegexp,
     SQLStr,
+    _explode_execute_m2m,
     _get_unique_indexes_with,
+    _schema_cached,
+    _track_modified_rows,
     _validate_table,
     column_exists,
     column_type,
     column_updatable,
+    copy_rows,
     explode_execute,
     explode_query_range,
     format_query,
@@ -427,6 +431,7 @@ def remove_record(cr, name):
     return remove_records(cr, model, [res_id])
 
 
+@_schema_cached
 def remove_records(cr, model, ids):
     _validate_model(model)
     if not ids:
@@ -464,10 +469,11 @@ def remove_records(cr, model, ids):
 
     table = table_of_model(cr, model)
     base_query = format_query(cr, "DELETE FROM {} WHERE id IN %s", table)
-    parallel_execute(
+    deleted = parallel_execute(
         cr,
         [cr.mogrify(base_query, [chunk_ids]).decode() for chunk_ids in chunks(ids, 1000, fmt=tuple)],
     )
+    _track_modified_rows(cr, table, deleted)
     for ir in indirect_references(cr, bound_only=True):
         if not ir.company_dependent_comodel:
             query = 'DELETE FROM "{}" WHERE {} AND "{}" IN %s'.format(ir.table, ir.model_filter(), ir.res_id)
@@ -1384,6 +1390,7 @@ def __update_record_from_xml(
                 module_to_reload_from.update_translations()
 
 
+@_schema_cached
 def delete_unused(cr, *xmlids, **kwargs):
     """
     Remove unused records.
@@ -1413,18 +1420,17 @@ def delete_unused(cr, *xmlids, **kwargs):
     if kwargs:
         raise TypeError("delete_unused() got an unexpected keyword argument %r" % kwargs.popitem()[0])
 
-    select_xids = " UNION ".join(
-        [
-            cr.mogrify("SELECT %s::varchar as module, %s::varchar as name", [module, name]).decode()
-            for xmlid in xmlids
-            for module, _, name in [xmlid.partition(".")]
-        ]
-    )
+    modules, names = [], []
+    for xmlid in xmlids:
+        module, _, name = xmlid.partition(".")
+        modules.append(module)
+        names.append(name)
 
     cr.execute(
         """
        WITH xids AS (
-         {}
+         SELECT unnest(%s::varchar[]) AS module,
+                unnest(%s::varchar[]) AS name
        ),
        _upd AS (
             UPDATE ir_model_data d
@@ -1437,7 +1443,8 @@ def delete_unused(cr, *xmlids, **kwargs):
        SELECT model, array_agg(res_id ORDER BY id), array_agg(xmlid ORDER BY id)
          FROM _upd
      GROUP BY model
-    """.format(select_xids)
+    """,
+        [modules, names],
     )
 
     deleted = []
@@ -1535,17 +1542,20 @@ def delete_unused(cr, *xmlids, **kwargs):
                 cr.execute(format_query(cr, "UPDATE {} SET active = false WHERE id IN %s", table), [deactivate_ids])
 
     if not keep_xmlids:
-        query = """
+        cr.execute(
+            """
             WITH xids AS (
-                {}
+                SELECT unnest(%s::varchar[]) AS module,
+                       unnest(%s::varchar[]) AS name
             )
             DELETE
               FROM ir_model_data d
              USING xids x
              WHERE d.module = x.module
                AND d.name = x.name
-        """
-        cr.execute(query.format(select_xids))
+            """,
+            [modules, names],
+        )
 
     return deleted
 
@@ -1566,6 +1576,7 @@ def replace_record_references(cr, old, new, replace_xmlid=True, parent_field="pa
     return replace_record_references_batch(cr, {old[1]: new[1]}, old[0], new[0], replace_xmlid, parent_field)
 
 
+@_schema_cached
 def replace_record_references_batch(
     cr, id_mapping, model_src, model_dst=None, replace_xmlid=True, ignores=(), parent_field="parent_id"
 ):
@@ -1588,6 +1599,11 @@ def replace_record_references_batch(
     :paream str parent_field: when the target and source model are the same, and the model
                               table has `parent_path` column, this field will be used to
                               update it.
+
+    .. warning::
+       The references in the tables of models, and in many2many tables holding more than
+       `EXPLODE_M2M_THRESHOLD` rows (1M by default), are updated in parallel. As a side
+       effect, the cursor may be committed.
     """
     _validate_model(model_src)
     if model_dst is None:
@@ -1611,7 +1627,7 @@ def replace_record_references_batch(
         ignores.append("ir_model_data")
 
     cr.execute("CREATE UNLOGGED TABLE _upgrade_rrr(old int PRIMARY KEY, new int)")
-    execute_values(cr, "INSERT INTO _upgrade_rrr (old, new) VALUES %s", id_mapping.items())
+    copy_rows(cr, "_upgrade_rrr", ["old", "new"], id_mapping.items())
 
     if model_src == model_dst:
         fk_def = []
@@ -1670,6 +1686,7 @@ def replace_record_references_batch(
                     )
                 )
                 query += " AND NOT EXISTS(SELECT 1 FROM {table} e WHERE e.{col2} = t.{col2} AND e.{fk} = r.new)"
+                _explode_execute_m2m(cr, format_query(cr, query, table=table, fk=fk, col2=col2), table, "t")
 
                 col2_info = target_of(cr, table, col2)  # col2 may not be a FK
                 if col2_info and col2_info[:2] == (model_src_table, "id"):
@@ -1677,19 +1694,25 @@ def replace_record_references_batch(
                     # It only handle 1-level recursions. For multi-level recursions, it should be handled manually.
                     # We can't decide which link to break.
                     # XXX: add a warning?
-                    query += """;
-                        DELETE
-                          FROM {table} t
-                         USING _upgrade_rrr r
-                         WHERE t.{fk} = r.new
-                           AND t.{fk} = t.{col2};
-                    """
-
-                cr.execute(format_query(cr, query, table=table, fk=fk, col2=col2))
+                    cr.execute(
+                        format_query(
+                            cr,
+                            """
+                            DELETE
+                              FROM {table} t
+                             USING _upgrade_rrr r
+                             WHERE t.{fk} = r.new
+                               AND t.{fk} = t.{col2}
+                            """,
+                            table=table,
+                            fk=fk,
+                            col2=col2,
+                        )
+                    )
 
             else:  # it's a model
                 fmt_query = format_query(cr, query, table=table, fk=fk)
-                parallel_execute(cr, explode_query_range(cr, fmt_query, table=table, alias="t"))
+                explode_execute(cr, fmt_query, table=table, alias="t")
 
                 # track default values to update
                 model = model_of_table(cr, table)
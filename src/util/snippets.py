@@ -20,7 +20,7 @@ from .const import NEARLYWARN
 from .helpers import table_of_model
 from .misc import log_progress, make_pickleable_callback, version_gte
 from .modules import INSTALLED_MODULE_STATES
-from .pg import SQLStr, column_exists, column_type, format_query, get_max_workers, table_exists
+from .pg import SQLStr, _worker_cursors, column_exists, column_type, format_query, get_max_workers, table_exists
 
 _logger = logging.getLogger(__name__)
 utf8_parser = html.HTMLParser(encoding="utf-8")
@@ -303,7 +303,7 @@ class Convertor:
         if not self.dbname:
             return self._convert_row(row_or_query)
         # improved interface: caller passes a query for us to fetch input rows, convert and update them
-        with sql_db.db_connect(self.dbname).cursor() as cr:
+        with _worker_cursors.cursor(self.dbname) as cr:
             cr.execute(row_or_query)
             for changes in filter(None, map(self._convert_row, cr.fetchall())):
                 cr.execute(self.update_query, changes)
@@ -372,6 +372,7 @@ def convert_html_columns(cr, table, columns, converter_callback, where_column="I
     # children cannot borrow from copies of the same pool, it will cause protocol error
     def init_worker_process():
         sql_db._Pool = None
+        _worker_cursors.close_at_exit()
 
     cr.commit()
     with ProcessPoolExecutor(
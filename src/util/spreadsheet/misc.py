@@ -9,7 +9,7 @@ from odoo import sql_db
 
 from .. import json
 from ..misc import log_progress, make_pickleable_callback
-from ..pg import SQLStr, format_query, get_max_workers
+from ..pg import SQLStr, _worker_cursors, format_query, get_max_workers
 
 MEMORY_CAP = 2 * 10**8  # 200MB
 COUNT_CAP = 1000
@@ -120,7 +120,7 @@ def process_commands(cr, callback, *args, **kwargs):
 
 
 def _mp_callback(dbname, callback, ids):
-    with sql_db.db_connect(dbname).cursor() as cr:
+    with _worker_cursors.cursor(dbname) as cr:
         _transform(callback, _iter_ids(cr, ids))
 
 
@@ -130,6 +130,7 @@ def multiprocess_commands(cr, callback, like_all=(), like_any=(), logger=_logger
 
     def init_worker_process():
         sql_db._Pool = None
+        _worker_cursors.close_at_exit()
 
     callback = make_pickleable_callback(callback)
 